@@ -0,0 +1,290 @@
+# archive_pipeline.py
+"""
+archive-and-shred: encrypt files for retention, then destroy the plaintext.
+
+Each file streams through three stages connected by bounded queues:
+
+    reader thread -> encrypt thread -> writer (the file's worker thread)
+
+so reading, encrypting and writing overlap, and no stage can run more than
+queue_depth chunks ahead of the next one. The output is exactly what
+FileEncryptor.encrypt_file writes (the streaming format), so decrypt_file
+reads it back.
+
+Before the source is handed to secure_delete, the ciphertext is fsynced and
+checked: one chunk out of verify_every (and always the last one) is read
+back from disk, decrypted and compared with a digest of the plaintext taken
+on the way in. A file whose check fails keeps its plaintext and has no
+output.
+
+Many files run at once (files_in_flight), and new files are only started as
+others finish, so memory stays bounded however many files are queued.
+
+    python archive_pipeline.py archive-and-shred data/ report.pdf --output-dir vault/
+"""
+import argparse
+import getpass
+import hashlib
+import json
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from file_encryptor import AtomicOutput, FileEncryptor, collect_tree_jobs
+from mod7 import secure_delete
+
+
+PIPELINE_QUEUE_DEPTH = 4
+DEFAULT_FILES_IN_FLIGHT = 4
+DEFAULT_VERIFY_EVERY = 16
+KEY_ENV_VAR = 'ARCHIVE_KEY'
+
+# Queue item marking the end of a file's chunks
+_DONE = object()
+# How often a blocked stage checks whether another stage failed
+_POLL_SECONDS = 0.1
+
+
+class VerificationError(Exception):
+    """The ciphertext on disk does not decrypt back to the plaintext that was read"""
+
+
+def _put(q, item, stop):
+    """Blocking put that gives up once another stage has failed"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    """Blocking get that returns _DONE once another stage has failed"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+class _FilePipeline:
+    """The read -> encrypt -> write stages for one file"""
+
+    def __init__(self, encryptor, input_path, queue_depth, verify_every):
+        self.encryptor = encryptor
+        self.input_path = input_path
+        self.verify_every = verify_every
+        self.plain = queue.Queue(maxsize=queue_depth)
+        self.cipher = queue.Queue(maxsize=queue_depth)
+        self.stop = threading.Event()
+        self.errors = []
+        # (keystream offset, length, sha256 of the padded plaintext) per sampled chunk
+        self.samples = []
+
+    def _stage(self, body):
+        try:
+            body()
+        except BaseException as e:
+            self.errors.append(e)
+            self.stop.set()
+
+    def _read(self):
+        chunk_size = self.encryptor.chunk_size
+        with open(self.input_path, 'rb') as src:
+            chunk = src.read(chunk_size)
+            while True:
+                next_chunk = src.read(chunk_size)
+                if not _put(self.plain, (chunk, not next_chunk), self.stop):
+                    return
+                if not next_chunk:
+                    break
+                chunk = next_chunk
+        _put(self.plain, _DONE, self.stop)
+
+    def _encrypt(self):
+        encryptor = self.encryptor
+        offset = 0
+        index = 0
+        while True:
+            item = _get(self.plain, self.stop)
+            if item is _DONE:
+                break
+            chunk, last = item
+            if last:
+                # Same padding rule as encrypt_file
+                chunk = encryptor.pad_last_chunk(chunk, offset)
+            if last or index % self.verify_every == 0:
+                self.samples.append((offset, len(chunk), hashlib.sha256(chunk).digest()))
+            if not _put(self.cipher, encryptor.xor_at(chunk, offset), self.stop):
+                return
+            offset += len(chunk)
+            index += 1
+        _put(self.cipher, _DONE, self.stop)
+
+    def run(self, output_path):
+        """Encrypt into output_path; returns (ciphertext bytes, chunks verified)"""
+        threads = [
+            threading.Thread(target=self._stage, args=(self._read,), name='archive-read'),
+            threading.Thread(target=self._stage, args=(self._encrypt,), name='archive-encrypt'),
+        ]
+        for thread in threads:
+            thread.start()
+        written = 0
+        try:
+            with AtomicOutput(output_path) as dst:
+                while True:
+                    data = _get(self.cipher, self.stop)
+                    if data is _DONE:
+                        break
+                    dst.write(data)
+                    written += len(data)
+                for thread in threads:
+                    thread.join()
+                if self.errors:
+                    raise self.errors[0]
+                # The ciphertext must be on disk before the plaintext is destroyed
+                dst.flush()
+                os.fsync(dst.fileno())
+                self._verify(dst.name)
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+        _fsync_directory(output_path)
+        return written, len(self.samples)
+
+    def _verify(self, path):
+        encryptor = self.encryptor
+        with open(path, 'rb') as f:
+            for offset, length, digest in self.samples:
+                f.seek(offset)
+                plaintext = encryptor.xor_at(f.read(length), offset)
+                if hashlib.sha256(plaintext).digest() != digest:
+                    raise VerificationError(f"Chunk at offset {offset} does not decrypt correctly")
+
+
+def _fsync_directory(path):
+    """Make the rename of path durable (best effort - not every platform allows it)"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def archive_file(encryptor, input_path, output_path, passes=3, scheme='random', shred=True,
+                 queue_depth=PIPELINE_QUEUE_DEPTH, verify_every=DEFAULT_VERIFY_EVERY, audit=None):
+    """
+    Encrypt input_path into output_path through the pipeline, verify it and
+    (if shred) securely delete input_path.
+    audit: AuditLog for the shred steps (default: secure_delete's shared one)
+    Returns {'input', 'output', 'bytes', 'verified_chunks', 'shredded', 'ok', 'error'}.
+    """
+    result = {
+        'input': input_path, 'output': output_path, 'bytes': 0,
+        'verified_chunks': 0, 'shredded': False, 'ok': False, 'error': None,
+    }
+    # A private encryptor per file: the XOR kernels cache keystreams
+    worker = FileEncryptor.from_key_bytes(encryptor.key, encryptor.chunk_size, encryptor.kernel.name)
+    try:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        pipeline = _FilePipeline(worker, input_path, queue_depth, max(1, verify_every))
+        result['bytes'], result['verified_chunks'] = pipeline.run(output_path)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+        return result
+
+    if shred:
+        report = secure_delete.secure_delete(input_path, passes, scheme, echo=False, audit=audit)
+        if not report['ok']:
+            result['error'] = f"shred failed: {report['error']}"
+            return result
+        result['shredded'] = True
+    result['ok'] = True
+    return result
+
+
+def archive_and_shred(encryptor, jobs, files_in_flight=DEFAULT_FILES_IN_FLIGHT, **options):
+    """
+    Run archive_file for every (input_path, output_path) in jobs, with at most
+    files_in_flight files in progress; jobs may be a lazy iterable.
+    options are passed on to archive_file. Returns the results in job order.
+    """
+    finished = []
+    with ThreadPoolExecutor(max_workers=files_in_flight) as pool:
+        pending = {}
+        for index, (input_path, output_path) in enumerate(jobs):
+            if len(pending) >= files_in_flight:
+                # Backpressure: only start the next file once one has finished
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                finished.extend((pending.pop(future), future.result()) for future in done)
+            future = pool.submit(archive_file, encryptor, input_path, output_path, **options)
+            pending[future] = index
+        for future in wait(pending)[0]:
+            finished.append((pending[future], future.result()))
+    finished.sort(key=lambda item: item[0])
+    return [result for _, result in finished]
+
+
+def archive_tree_jobs(input_root, output_root):
+    """(input path, output path) for every file under input_root, same layout as encrypt_tree"""
+    return [(input_path, output_path) for _, input_path, output_path, _ in
+            collect_tree_jobs(input_root, output_root)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encrypt files for retention, then shred the plaintext.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('archive-and-shred', help="encrypt, verify and shred files or trees")
+    command.add_argument('sources', nargs='+', help="files or directories to archive")
+    command.add_argument('--output-dir', required=True, help="where the encrypted copies go")
+    command.add_argument('--key-env', default=KEY_ENV_VAR,
+                         help=f"environment variable holding the key (default: {KEY_ENV_VAR}); "
+                              "prompted for if unset")
+    command.add_argument('--passes', type=int, default=3, help="overwrite passes when shredding")
+    command.add_argument('--scheme', choices=sorted(secure_delete.OVERWRITE_SCHEMES), default='random')
+    command.add_argument('--files-in-flight', type=int, default=DEFAULT_FILES_IN_FLIGHT)
+    command.add_argument('--verify-every', type=int, default=DEFAULT_VERIFY_EVERY,
+                         help="decrypt-check one chunk out of this many (the last one always)")
+    command.add_argument('--keep-source', action='store_true', help="encrypt and verify, but do not shred")
+    command.add_argument('--audit-log', default=secure_delete.AUDIT_LOG_FILE,
+                         help=f"JSON-lines log of the shred steps (default: {secure_delete.AUDIT_LOG_FILE})")
+    args = parser.parse_args(argv)
+
+    key = os.environ.get(args.key_env) or getpass.getpass("Archive key: ")
+    encryptor = FileEncryptor(key)
+
+    jobs = []
+    for source in args.sources:
+        target = os.path.join(args.output_dir, os.path.basename(os.path.normpath(source)))
+        if os.path.isdir(source):
+            jobs.extend(archive_tree_jobs(source, target))
+        else:
+            jobs.append((source, target))
+
+    results = archive_and_shred(
+        encryptor, jobs, files_in_flight=args.files_in_flight, passes=args.passes,
+        scheme=args.scheme, shred=not args.keep_source, verify_every=args.verify_every,
+        audit=secure_delete.get_audit_log(args.audit_log),
+    )
+    failures = [result for result in results if not result['ok']]
+    print(json.dumps({
+        'files': len(results) - len(failures),
+        'bytes': sum(result['bytes'] for result in results if result['ok']),
+        'failures': [{'path': result['input'], 'error': result['error']} for result in failures],
+    }, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# audit_log.py
+"""
+Shared structured audit log.
+
+Every record is one JSON object per line:
+
+    {"ts": "2024-05-01T12:00:00.123456+00:00", "event": "user_added", "username": "alice"}
+
+log() only puts the record on a bounded queue. A background thread keeps
+the file open, writes whatever is queued in batches and fsyncs after
+flush_every records or flush_interval seconds, whichever comes first. When
+the queue is full log() blocks, so a burst slows the producers down instead
+of growing memory without limit.
+
+Once the file grows past max_bytes it is rotated: path -> path.1 -> path.2 ...
+keeping at most backups old files.
+
+get_audit_log(path) returns one shared AuditLog per file, so every component
+writing to the same path goes through a single writer thread.
+"""
+import atexit
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_FLUSH_EVERY = 256
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Queue item telling the writer thread to finish
+_STOP = object()
+
+
+class AuditLog:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS,
+                 queue_size=DEFAULT_QUEUE_SIZE, flush_every=DEFAULT_FLUSH_EVERY,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        max_bytes: rotate once the file is this big (0 = never rotate)
+        backups: rotated files to keep
+        queue_size: records that may wait for the writer before log() blocks
+        flush_every, flush_interval: fsync after this many records / seconds
+        """
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self.closed = False
+        self.last_error = None
+        # Opened here so a bad path fails in the caller, not in the thread
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+        self._thread.start()
+
+    def log(self, event, **fields):
+        """Queue one record; fields must be JSON serialisable (others are str()'d)"""
+        if self.closed:
+            raise ValueError("Audit log is closed")
+        record = {'ts': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'event': event}
+        record.update(fields)
+        self._queue.put(record)
+
+    def flush(self, timeout=None):
+        """Block until every record logged so far is written and fsynced"""
+        if self.closed:
+            return True
+        written = threading.Event()
+        self._queue.put(written)
+        return written.wait(timeout)
+
+    def close(self):
+        """Write out everything still queued and stop the writer thread"""
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        unsynced = 0
+        oldest_unsynced = 0.0
+        try:
+            while True:
+                # 1. Wait for work - but no longer than the pending fsync may be delayed
+                timeout = None
+                if unsynced:
+                    timeout = max(0.0, self.flush_interval - (time.monotonic() - oldest_unsynced))
+                try:
+                    batch = [self._queue.get(timeout=timeout)]
+                except queue.Empty:
+                    batch = []
+                while len(batch) < self.flush_every:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                # 2. Write the records of the batch in one go
+                lines = []
+                waiters = []
+                stop = False
+                for item in batch:
+                    if item is _STOP:
+                        stop = True
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        lines.append(json.dumps(item, default=str, separators=(',', ':')))
+                if lines:
+                    if not unsynced:
+                        oldest_unsynced = time.monotonic()
+                    unsynced += len(lines)
+                    self._write('\n'.join(lines) + '\n')
+
+                # 3. fsync when a count/time limit is hit or someone is waiting for it
+                due = unsynced >= self.flush_every or (
+                    unsynced and time.monotonic() - oldest_unsynced >= self.flush_interval)
+                if unsynced and (due or waiters or stop):
+                    self._sync()
+                    unsynced = 0
+                for waiter in waiters:
+                    waiter.set()
+                if stop:
+                    return
+        finally:
+            self._file.close()
+
+    def _write(self, text):
+        try:
+            self._file.write(text)
+        except (OSError, ValueError) as e:
+            # Keep the writer alive (log() must never block forever), remember why
+            self.last_error = str(e)
+
+    def _sync(self):
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except (OSError, ValueError) as e:
+            self.last_error = str(e)
+
+    def _rotate(self):
+        # The current file stays open until its replacement is: if a rename or
+        # open fails (ENOSPC, EACCES) we keep appending to it and retry later
+        if self.backups:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f'{self.path}.{i}'):
+                    os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+            if os.path.exists(self.path):
+                os.replace(self.path, f'{self.path}.1')
+            new_file = open(self.path, 'a', encoding='utf-8')
+        else:
+            new_file = open(self.path + '.new', 'w', encoding='utf-8')
+            os.replace(self.path + '.new', self.path)
+        old_file, self._file = self._file, new_file
+        old_file.close()
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def get_audit_log(path, **options):
+    """
+    The AuditLog shared by everyone writing to path (created on first use).
+    options are passed to AuditLog the first time only.
+    """
+    key = os.path.abspath(path)
+    with _shared_lock:
+        audit = _shared.get(key)
+        if audit is None or audit.closed:
+            audit = _shared[key] = AuditLog(key, **options)
+        return audit
+
+
+@atexit.register
+def _close_shared_logs():
+    for audit in list(_shared.values()):
+        audit.close()
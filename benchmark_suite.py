@@ -0,0 +1,337 @@
+# benchmark_suite.py
+"""
+Performance benchmarks for the lab's components.
+
+Workloads:
+- FileEncryptor: encrypt/decrypt MB/s and peak RSS, per file size
+- PasswordManager: add_user/sec and authenticate/sec, per user count
+- RBACSystem: check_permission and can_access_file decisions/sec,
+  per user count and policy size
+- secure_delete: MB/s, per file size
+
+Every metric is {"value", "unit", "higher_is_better"}. Results are written as
+JSON and can be compared against a stored baseline; the run fails when any
+metric is more than threshold (default 20%) worse than the baseline.
+
+    python benchmark_suite.py --output results.json --baseline benchmark_baseline.json
+    python benchmark_suite.py --save-baseline benchmark_baseline.json
+
+Numbers only compare on the same hardware, so no baseline is checked in.
+CI measures the target branch and the change on the same runner, one after
+the other:
+
+    git checkout main && python benchmark_suite.py --quick --save-baseline /tmp/baseline.json
+    git checkout - && python benchmark_suite.py --quick --baseline /tmp/baseline.json
+
+Timings are the best of `repeat` runs, which filters out most scheduler noise.
+PasswordManager runs with a cheap KDF by default so the numbers show the
+storage and bookkeeping cost rather than PBKDF2 itself (use --kdf-iterations
+to measure a production setting).
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from audit_log import AuditLog
+from file_encryptor import FileEncryptor
+from mod7 import secure_delete
+from password_manager import PasswordManager
+from rbac_system import RBACSystem
+
+
+MIB = 1024 * 1024
+
+DEFAULT_CONFIG = {
+    'file_sizes': [1 * MIB, 16 * MIB],
+    'user_counts': [100, 1000],
+    'rbac_users': [1000, 100000],
+    'rbac_roles': [4, 64],
+    'decisions': 200000,
+    'kdf_iterations': 1000,
+    'repeat': 3,
+}
+
+QUICK_CONFIG = {
+    'file_sizes': [256 * 1024],
+    'user_counts': [50],
+    'rbac_users': [1000],
+    'rbac_roles': [4],
+    'decisions': 20000,
+    'kdf_iterations': 1000,
+    'repeat': 1,
+}
+
+DEFAULT_THRESHOLD = 0.20
+
+
+def _write_fixture(path, size):
+    """Random file of size bytes, written a chunk at a time so building it costs no memory"""
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            chunk = os.urandom(min(MIB, remaining))
+            f.write(chunk)
+            remaining -= len(chunk)
+
+
+def _size_label(size):
+    return f'{size // MIB}MiB' if size >= MIB else f'{size // 1024}KiB'
+
+
+def _metric(value, unit, higher_is_better=True):
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def _best_time(func, repeat):
+    """Shortest wall time of repeat calls to func()"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MiB, or None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / MIB if sys.platform == 'darwin' else peak / 1024
+
+
+def _encryptor_worker(size, repeat):
+    """Runs in a fresh process so its peak RSS belongs to this file size alone"""
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, 'plain.bin')
+        encrypted = os.path.join(tmp, 'encrypted.bin')
+        decrypted = os.path.join(tmp, 'decrypted.bin')
+        _write_fixture(plain, size)
+        encryptor = FileEncryptor('benchmark-key')
+        with contextlib.redirect_stdout(io.StringIO()):
+            encrypt = _best_time(lambda: encryptor.encrypt_file(plain, encrypted), repeat)
+            decrypt = _best_time(lambda: encryptor.decrypt_file(encrypted, decrypted), repeat)
+    return size / MIB / encrypt, size / MIB / decrypt, _peak_rss_mb()
+
+
+def bench_file_encryptor(config):
+    results = {}
+    for size in config['file_sizes']:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            encrypt, decrypt, rss = pool.submit(_encryptor_worker, size, config['repeat']).result()
+        label = _size_label(size)
+        results[f'file_encryptor.encrypt.{label}'] = _metric(encrypt, 'MB/s')
+        results[f'file_encryptor.decrypt.{label}'] = _metric(decrypt, 'MB/s')
+        if rss is not None:
+            results[f'file_encryptor.peak_rss.{label}'] = _metric(rss, 'MiB', higher_is_better=False)
+    return results
+
+
+def bench_password_manager(config):
+    results = {}
+    kdf = {'name': 'pbkdf2_sha256', 'iterations': config['kdf_iterations']}
+    for count in config['user_counts']:
+        add_rates = []
+        auth_rates = []
+        for _ in range(config['repeat']):
+            with tempfile.TemporaryDirectory() as tmp:
+                pm = PasswordManager(os.path.join(tmp, 'passwords.json'), kdf_params=kdf)
+                start = time.perf_counter()
+                for i in range(count):
+                    pm.add_user(f'user{i}', f'password{i}')
+                add_rates.append(count / (time.perf_counter() - start))
+
+                order = list(range(count))
+                random.shuffle(order)
+                start = time.perf_counter()
+                for i in order:
+                    pm.authenticate(f'user{i}', f'password{i}')
+                auth_rates.append(count / (time.perf_counter() - start))
+                pm.close()
+        results[f'password_manager.add_user.{count}_users'] = _metric(max(add_rates), 'ops/s')
+        results[f'password_manager.authenticate.{count}_users'] = _metric(max(auth_rates), 'ops/s')
+    return results
+
+
+def _build_rbac(tmp, users, roles):
+    """RBACSystem with a policy of roles roles (each inheriting the previous one)"""
+    policy = {}
+    for r in range(roles):
+        definition = {'permissions': [f'perm_{r}_{p}' for p in range(8)]}
+        if r:
+            definition['inherits'] = [f'role{r - 1}']
+        policy[f'role{r}'] = definition
+    policy['role0']['permissions'] += ['read_public', 'read_own', 'write_own']
+    policy_file = os.path.join(tmp, 'policy.json')
+    with open(policy_file, 'w') as f:
+        json.dump(policy, f)
+    rbac = RBACSystem(policy_file)
+    rbac.add_users((f'user{i}', f'role{i % roles}') for i in range(users))
+    return rbac
+
+
+def bench_rbac(config):
+    results = {}
+    decisions = config['decisions']
+    with tempfile.TemporaryDirectory() as tmp:
+        for users in config['rbac_users']:
+            for roles in config['rbac_roles']:
+                rbac = _build_rbac(tmp, users, roles)
+                rng = random.Random(users * 31 + roles)
+                queries = [
+                    (f'user{rng.randrange(users)}', f'perm_{rng.randrange(roles)}_{rng.randrange(8)}')
+                    for _ in range(decisions)
+                ]
+                paths = ['public.txt', 'admin_logs.txt'] + [f'user{i}_private.txt' for i in range(50)]
+                file_queries = [(user_id, rng.choice(paths)) for user_id, _ in queries]
+
+                check = rbac.check_permission
+                can_access = rbac.can_access_file
+                permission_time = _best_time(
+                    lambda: [check(user_id, permission) for user_id, permission in queries],
+                    config['repeat'])
+                file_time = _best_time(
+                    lambda: [can_access(user_id, path) for user_id, path in file_queries],
+                    config['repeat'])
+                label = f'{users}_users.{roles}_roles'
+                results[f'rbac.check_permission.{label}'] = _metric(decisions / permission_time, 'decisions/s')
+                results[f'rbac.can_access_file.{label}'] = _metric(decisions / file_time, 'decisions/s')
+    return results
+
+
+def bench_secure_delete(config):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep the benchmark's deletions out of the real audit trail
+        audit = AuditLog(os.path.join(tmp, 'audit.jsonl'))
+        try:
+            for size in config['file_sizes']:
+                path = os.path.join(tmp, 'victim.bin')
+                best = None
+                for _ in range(config['repeat']):
+                    _write_fixture(path, size)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        report = secure_delete.secure_delete(path, passes=1, audit=audit)
+                    if not report['ok']:
+                        raise RuntimeError(f"secure_delete failed: {report['error']}")
+                    best = report['seconds'] if best is None else min(best, report['seconds'])
+                results[f'secure_delete.{_size_label(size)}'] = _metric(size / MIB / best, 'MB/s')
+        finally:
+            # Before the directory holding it is removed
+            audit.close()
+    return results
+
+
+BENCHMARKS = {
+    'file_encryptor': bench_file_encryptor,
+    'password_manager': bench_password_manager,
+    'rbac': bench_rbac,
+    'secure_delete': bench_secure_delete,
+}
+
+
+def run_benchmarks(config=None, only=None):
+    """
+    Run the benchmarks (all, or the names in only) and return
+    {'meta': {...}, 'results': {metric name: metric}}.
+    """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if only and name not in only:
+            continue
+        results.update(bench(config))
+    return {
+        'meta': {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': config,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare two run_benchmarks() outputs.
+    Returns a list of {'metric', 'baseline', 'current', 'slowdown'} for every
+    metric that got worse by more than threshold (0.2 = 20%). Metrics missing
+    from either side are ignored.
+    """
+    regressions = []
+    for name, current in results['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None or not previous['value'] or not current['value']:
+            continue
+        if current['higher_is_better']:
+            slowdown = 1 - current['value'] / previous['value']
+        else:
+            slowdown = current['value'] / previous['value'] - 1
+        if slowdown > threshold:
+            regressions.append({
+                'metric': name,
+                'baseline': previous['value'],
+                'current': current['value'],
+                'slowdown': slowdown,
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the performance benchmarks.")
+    parser.add_argument('--quick', action='store_true', help="small sizes, one repeat (smoke run)")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument('--kdf-iterations', type=int, help="PBKDF2 iterations for PasswordManager")
+    parser.add_argument('--output', help="write the results JSON here")
+    parser.add_argument('--baseline', help="compare against this results JSON")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"allowed slowdown before failing (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument('--save-baseline', metavar='PATH', help="store the results as the new baseline")
+    args = parser.parse_args(argv)
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error(f"baseline {args.baseline} not found - create one with --save-baseline")
+
+    config = dict(QUICK_CONFIG if args.quick else DEFAULT_CONFIG)
+    if args.kdf_iterations:
+        config['kdf_iterations'] = args.kdf_iterations
+    results = run_benchmarks(config, args.only)
+
+    for name, metric in results['results'].items():
+        print(f"{name:55} {metric['value']:14.1f} {metric['unit']}")
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']:.1f} -> "
+                  f"{regression['current']:.1f} ({regression['slowdown']:.0%} worse)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# encryption_manifest.py
+"""
+Manifest of what FileEncryptor.encrypt_tree_incremental has already encrypted.
+
+One entry per source file, keyed by its path relative to the input root:
+
+    {"path": "reports/q1.csv", "size": 1234, "mtime_ns": 1714550400000000000,
+     "hash": "<sha256 of the plaintext>", "output": "vault/reports/q1.csv",
+     "framed": false, "key_id": "<fingerprint of the key>"}
+
+Two backends with the same interface:
+- JsonlManifest: one compact JSON object per line, rewritten atomically
+  (write to a temporary file, then rename) after each run
+- SQLiteManifest: a WITHOUT ROWID table; a run only touches the rows of
+  files that changed, which suits very large trees
+
+open_manifest() picks the backend from the file extension.
+"""
+import os
+import json
+
+from password_storage import SQLITE_EXTENSIONS, connect_sqlite
+
+
+MANIFEST_FIELDS = ('path', 'size', 'mtime_ns', 'hash', 'output', 'framed', 'key_id')
+
+
+class JsonlManifest:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+    def load(self):
+        """Return {relative path: entry}; an absent manifest is empty"""
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry['path']] = entry
+        except FileNotFoundError:
+            pass
+        return dict(self.entries)
+
+    def apply(self, updated, removed):
+        """Store the updated entries, drop the removed paths and persist"""
+        self.entries.update(updated)
+        for path in removed:
+            self.entries.pop(path, None)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for path in sorted(self.entries):
+                f.write(json.dumps(self.entries[path], separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        pass
+
+
+class SQLiteManifest:
+    _ALL = 'SELECT path, size, mtime_ns, hash, output, framed, key_id FROM manifest'
+    _PUT = ('INSERT OR REPLACE INTO manifest (path, size, mtime_ns, hash, output, framed, key_id) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)')
+    _DELETE = 'DELETE FROM manifest WHERE path = ?'
+
+    def __init__(self, path):
+        """path: SQLite database file (created if missing)"""
+        self.path = path
+        self.conn = connect_sqlite(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS manifest ('
+            'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+            'hash TEXT NOT NULL, output TEXT NOT NULL, framed INTEGER NOT NULL, '
+            'key_id TEXT NOT NULL) WITHOUT ROWID'
+        )
+        self.conn.commit()
+
+    def load(self):
+        """Return {relative path: entry}"""
+        entries = {}
+        for row in self.conn.execute(self._ALL):
+            entry = dict(zip(MANIFEST_FIELDS, row))
+            entry['framed'] = bool(entry['framed'])
+            entries[entry['path']] = entry
+        return entries
+
+    def apply(self, updated, removed):
+        """Upsert the updated entries and delete the removed paths in one transaction"""
+        with self.conn:
+            self.conn.executemany(self._PUT, (
+                tuple(int(entry[field]) if field == 'framed' else entry[field] for field in MANIFEST_FIELDS)
+                for entry in updated.values()
+            ))
+            self.conn.executemany(self._DELETE, ((path,) for path in removed))
+
+    def close(self):
+        self.conn.close()
+
+
+def open_manifest(path):
+    """Pick a backend from the file extension (.db/.sqlite -> SQLite, else JSONL)"""
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        return SQLiteManifest(path)
+    return JsonlManifest(path)
@@ -1,34 +1,119 @@
 # file_encryptor.py - STUDENT TO COMPLETE
 import os
+import hmac
+import mmap
+import bisect
+import struct
 import hashlib
 from base64 import b64encode, b64decode
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from encryption_manifest import open_manifest
+from xor_kernels import get_kernel
+
+
+BLOCK_SIZE = 16
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MiB of plaintext per read
+
+# In-place journal: magic, operation, original size, transformed length,
+# final size, bytes done, length of the saved window that follows the header
+INPLACE_JOURNAL_SUFFIX = ".xorjournal"
+INPLACE_JOURNAL_HEADER = struct.Struct("<4sBQQQQQ")
+INPLACE_JOURNAL_MAGIC = b"XJNL"
+INPLACE_OPERATIONS = {"encrypt": 1, "decrypt": 2}
+
+# Framed container (version 1):
+#   header  = magic, version, chunk size
+#   frames  = keystream offset, length, tag, then `length` bytes of ciphertext
+#   index   = one (frame position, keystream offset, length) entry per frame
+#   trailer = index position, frame count, plaintext size, index tag, magic
+# Frames are not padded; every tag is a truncated HMAC-SHA256.
+FRAMED_MAGIC = b"XFRM"
+FRAMED_VERSION = 1
+FRAMED_HEADER = struct.Struct("<4sBI")
+FRAMED_FRAME = struct.Struct("<QI16s")
+FRAMED_INDEX_ENTRY = struct.Struct("<QQI")
+FRAMED_TRAILER = struct.Struct("<QQQ16s4s")
+FRAMED_TRAILER_MAGIC = b"XIDX"
+FRAMED_TAG_SIZE = 16
+
+
+class AtomicOutput:
+    """
+    Write to a temporary file next to path and move it into place on success.
+    On failure the temporary file is removed, so a failed run never leaves a
+    half-written output behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.part"
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.tmp_path, "wb")
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+        return False
 
 
 class FileEncryptor:
-    def __init__(self, key):
+    def __init__(self, key, chunk_size=DEFAULT_CHUNK_SIZE, backend="auto"):
         """
         Initialize with encryption key
         key: String password (will be hashed to 32 bytes)
+        chunk_size: Bytes read per step when streaming files
+        backend: XOR kernel to use - "auto", "numpy", "bigint" or "python"
         """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
         # Convert key string to 32-byte key using SHA-256
         self.key = hashlib.sha256(key.encode("utf-8")).digest()
+        self.chunk_size = chunk_size
+        self.kernel = get_kernel(backend)
+        # Last framed index read by decrypt_range: (path, stat signature, index)
+        self._index_cache = None
+
+    @classmethod
+    def from_key_bytes(cls, key_bytes, chunk_size=DEFAULT_CHUNK_SIZE, backend="auto"):
+        """Build an encryptor from an already-derived 32-byte key"""
+        encryptor = cls("", chunk_size=chunk_size, backend=backend)
+        encryptor.key = bytes(key_bytes)
+        return encryptor
+
+    def _xor_encrypt(self, data, key, offset=0):
+        """
+        Simple XOR encryption (for learning purposes)
+        offset: Position of data in the whole stream, so chunks line up with the key
+        """
+        # XOR each byte with the key byte at the same position (cycling the key).
+        # The kernel decides whether that happens per byte or per block.
+        return self.kernel.xor(data, key, offset)
+
+    def xor_at(self, data, offset=0):
+        """Encrypt data that sits at offset in a stream - or decrypt it, XOR is its own inverse"""
+        return self._xor_encrypt(data, self.key, offset)
 
-    def _xor_encrypt(self, data, key):
-        """Simple XOR encryption (for learning purposes)"""
-        # For each byte in data, XOR with key byte (cycle through key)
-        encrypted = bytearray()
-        key_len = len(key)
-        for i, b in enumerate(data):
-            encrypted.append(b ^ key[i % key_len])
-        return bytes(encrypted)
+    def pad_last_chunk(self, chunk, offset):
+        """The final chunk of a stream starting at offset, with the stream's PKCS7 padding added"""
+        return chunk + self._padding(offset + len(chunk), BLOCK_SIZE)
 
     def _pad_data(self, data, block_size=16):
         """Add PKCS7 padding"""
-        padding_length = block_size - (len(data) % block_size)
+        return data + self._padding(len(data), block_size)
+
+    def _padding(self, data_length, block_size=16):
+        """PKCS7 padding bytes for data of data_length bytes"""
+        padding_length = block_size - (data_length % block_size)
         if padding_length == 0:
             padding_length = block_size
-        padding = bytes([padding_length]) * padding_length
-        return data + padding
+        return bytes([padding_length]) * padding_length
 
     def _unpad_data(self, data):
         """Remove PKCS7 padding"""
@@ -41,53 +126,628 @@ class FileEncryptor:
             raise ValueError("Invalid PKCS7 padding")
         return data[:-padding_length]
 
-    def encrypt_file(self, input_path, output_path):
-        """Encrypt a file"""
+    def encrypt_file(self, input_path, output_path, framed=False):
+        """
+        Encrypt a file, streaming it chunk by chunk
+        framed: Write the chunk-framed container, which supports decrypt_range
+        """
         try:
-            # 1. Read input file
-            with open(input_path, "rb") as f:
-                plaintext = f.read()
-
-            # 2. Pad data to multiple of block size
-            padded = self._pad_data(plaintext, block_size=16)
-
-            # 3. Encrypt using _xor_encrypt
-            encrypted = self._xor_encrypt(padded, self.key)
-
-            # 4. Write to output file
-            with open(output_path, "wb") as f:
-                f.write(encrypted)
-
-            # 5. Return success status
+            self._encrypt_path(input_path, output_path, framed)
             return True
         except Exception as e:
             print(f"Encryption error: {e}")
             return False
 
     def decrypt_file(self, input_path, output_path):
-        """Decrypt a file"""
+        """Decrypt a file (either format), streaming it chunk by chunk"""
         try:
-            # 1. Read encrypted file
-            with open(input_path, "rb") as f:
-                encrypted = f.read()
+            self._decrypt_path(input_path, output_path)
+            return True
+        except Exception as e:
+            print(f"Decryption error: {e}")
+            return False
 
-            # 2. Decrypt using _xor_encrypt (XOR is symmetric)
-            padded = self._xor_encrypt(encrypted, self.key)
+    def _encrypt_path(self, input_path, output_path, framed=False, digest=None):
+        """digest: optional hashlib object that is fed the plaintext as it is read"""
+        if framed:
+            self._encrypt_framed(input_path, output_path, digest)
+        else:
+            self._encrypt_stream(input_path, output_path, digest)
 
-            # 3. Remove padding using _unpad_data
-            plaintext = self._unpad_data(padded)
+    def _decrypt_path(self, input_path, output_path):
+        # The format is detected from the file itself
+        if self._is_framed(input_path):
+            self._decrypt_framed(input_path, output_path)
+        else:
+            self._decrypt_stream(input_path, output_path)
 
-            # 4. Write to output file
-            with open(output_path, "wb") as f:
-                f.write(plaintext)
+    def _encrypt_stream(self, input_path, output_path, digest=None):
+        """
+        Encrypt input_path into output_path using at most one chunk of memory.
+        The keystream offset carries over between chunks and the PKCS7 padding
+        is only added to the final chunk, so the output is identical to
+        encrypting the whole file in one go.
+        """
+        offset = 0
+        with open(input_path, "rb") as src, AtomicOutput(output_path) as dst:
+            chunk = src.read(self.chunk_size)
+            while True:
+                if digest is not None:
+                    digest.update(chunk)
+                next_chunk = src.read(self.chunk_size)
+                if not next_chunk:
+                    # Last chunk -> pad based on the total length before encrypting
+                    chunk = self.pad_last_chunk(chunk, offset)
+                dst.write(self.xor_at(chunk, offset))
+                offset += len(chunk)
+                if not next_chunk:
+                    break
+                chunk = next_chunk
+
+    def _decrypt_stream(self, input_path, output_path):
+        """
+        Decrypt input_path into output_path using at most one chunk of memory.
+        The last block is held back until the end of the input so the padding
+        can be checked and removed even when it straddles two chunks.
+        """
+        offset = 0
+        tail = b""
+        with open(input_path, "rb") as src, AtomicOutput(output_path) as dst:
+            while True:
+                chunk = src.read(self.chunk_size)
+                if not chunk:
+                    break
+                data = tail + self._xor_encrypt(chunk, self.key, offset)
+                offset += len(chunk)
+                dst.write(data[:-BLOCK_SIZE])
+                tail = data[-BLOCK_SIZE:]
+            dst.write(self._unpad_data(tail))
+
+    def _frame_tag(self, offset, ciphertext):
+        """Integrity tag binding a frame's ciphertext to its position"""
+        mac = hmac.new(self._mac_key(), struct.pack("<QI", offset, len(ciphertext)), "sha256")
+        mac.update(ciphertext)
+        return mac.digest()[:FRAMED_TAG_SIZE]
+
+    def _index_tag(self, index_bytes, count, plaintext_size):
+        mac = hmac.new(self._mac_key(), index_bytes, "sha256")
+        mac.update(struct.pack("<QQ", count, plaintext_size))
+        return mac.digest()[:FRAMED_TAG_SIZE]
+
+    def _mac_key(self):
+        # Separate key for the tags so they never reuse the XOR keystream
+        return hashlib.sha256(b"frame-mac" + self.key).digest()
+
+    def _encrypt_framed(self, input_path, output_path, digest=None):
+        """Encrypt input_path into the chunk-framed container format"""
+        index = bytearray()
+        count = 0
+        offset = 0
+        with open(input_path, "rb") as src, AtomicOutput(output_path) as dst:
+            dst.write(FRAMED_HEADER.pack(FRAMED_MAGIC, FRAMED_VERSION, self.chunk_size))
+            position = FRAMED_HEADER.size
+            while True:
+                chunk = src.read(self.chunk_size)
+                if not chunk:
+                    break
+                if digest is not None:
+                    digest.update(chunk)
+                ciphertext = self._xor_encrypt(chunk, self.key, offset)
+                dst.write(FRAMED_FRAME.pack(offset, len(chunk), self._frame_tag(offset, ciphertext)))
+                dst.write(ciphertext)
+                index += FRAMED_INDEX_ENTRY.pack(position, offset, len(chunk))
+                position += FRAMED_FRAME.size + len(chunk)
+                offset += len(chunk)
+                count += 1
+            dst.write(index)
+            tag = self._index_tag(bytes(index), count, offset)
+            dst.write(FRAMED_TRAILER.pack(position, count, offset, tag, FRAMED_TRAILER_MAGIC))
+
+    def _decrypt_framed(self, input_path, output_path):
+        """Decrypt a chunk-framed container, checking every tag"""
+        index = self._read_framed_index(input_path)
+        with open(input_path, "rb") as src, AtomicOutput(output_path) as dst:
+            for entry in index["entries"]:
+                dst.write(self._read_frame(src, entry))
+
+    def _read_frame(self, src, entry):
+        """Read, verify and decrypt the frame described by an index entry"""
+        position, offset, length = entry
+        src.seek(position)
+        frame_offset, frame_length, tag = FRAMED_FRAME.unpack(src.read(FRAMED_FRAME.size))
+        ciphertext = src.read(frame_length)
+        if (frame_offset, frame_length) != (offset, length) or len(ciphertext) != length:
+            raise ValueError("Frame does not match the index")
+        if not hmac.compare_digest(tag, self._frame_tag(offset, ciphertext)):
+            raise ValueError("Frame integrity check failed (wrong key or corrupted data)")
+        return self._xor_encrypt(ciphertext, self.key, offset)
+
+    def _is_framed(self, path):
+        """Detect the chunk-framed container from its header and trailer"""
+        size = os.path.getsize(path)
+        if size < FRAMED_HEADER.size + FRAMED_TRAILER.size:
+            return False
+        with open(path, "rb") as f:
+            magic, version, _ = FRAMED_HEADER.unpack(f.read(FRAMED_HEADER.size))
+            f.seek(size - len(FRAMED_TRAILER_MAGIC))
+            trailer_magic = f.read()
+        return magic == FRAMED_MAGIC and trailer_magic == FRAMED_TRAILER_MAGIC and version == FRAMED_VERSION
 
-            # 5. Return success status
+    def _read_framed_index(self, path):
+        """Load and verify the footer index of a framed container"""
+        stat = os.stat(path)
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        cached = self._index_cache
+        if cached is not None and cached[0] == path and cached[1] == signature:
+            return cached[2]
+
+        with open(path, "rb") as f:
+            f.seek(stat.st_size - FRAMED_TRAILER.size)
+            index_pos, count, plaintext_size, tag, _ = FRAMED_TRAILER.unpack(f.read(FRAMED_TRAILER.size))
+            f.seek(index_pos)
+            index_bytes = f.read(count * FRAMED_INDEX_ENTRY.size)
+        if len(index_bytes) != count * FRAMED_INDEX_ENTRY.size:
+            raise ValueError("Truncated frame index")
+        if not hmac.compare_digest(tag, self._index_tag(index_bytes, count, plaintext_size)):
+            raise ValueError("Index integrity check failed (wrong key or corrupted data)")
+
+        entries = list(FRAMED_INDEX_ENTRY.iter_unpack(index_bytes))
+        index = {
+            "entries": entries,
+            "offsets": [entry[1] for entry in entries],
+            "size": plaintext_size,
+        }
+        self._index_cache = (path, signature, index)
+        return index
+
+    def decrypt_range(self, path, offset, length):
+        """
+        Decrypt only plaintext bytes [offset, offset + length) of an encrypted file.
+        Framed containers read just the frames the range touches; the legacy
+        format is decrypted in place since its keystream is position based.
+        Raises ValueError when the file cannot be decrypted with this key.
+        """
+        if offset < 0 or length < 0:
+            raise ValueError("offset and length must not be negative")
+        if self._is_framed(path):
+            return self._decrypt_framed_range(path, offset, length)
+        return self._decrypt_legacy_range(path, offset, length)
+
+    def _decrypt_framed_range(self, path, offset, length):
+        index = self._read_framed_index(path)
+        end = min(offset + length, index["size"])
+        if offset >= end:
+            return b""
+        # Frame holding the first byte, then every following frame up to end
+        first = bisect.bisect_right(index["offsets"], offset) - 1
+        pieces = []
+        with open(path, "rb") as src:
+            for entry in index["entries"][first:]:
+                frame_start = entry[1]
+                if frame_start >= end:
+                    break
+                plaintext = self._read_frame(src, entry)
+                pieces.append(plaintext[max(offset - frame_start, 0):end - frame_start])
+        return b"".join(pieces)
+
+    def _decrypt_legacy_range(self, path, offset, length):
+        size = os.path.getsize(path)
+        if size < BLOCK_SIZE:
+            raise ValueError("File is too short to be encrypted data")
+        with open(path, "rb") as src:
+            src.seek(size - BLOCK_SIZE)
+            last_block = self._xor_encrypt(src.read(BLOCK_SIZE), self.key, size - BLOCK_SIZE)
+            plaintext_size = size - BLOCK_SIZE + len(self._unpad_data(last_block))
+            end = min(offset + length, plaintext_size)
+            if offset >= end:
+                return b""
+            src.seek(offset)
+            return self._xor_encrypt(src.read(end - offset), self.key, offset)
+
+    def encrypt_file_inplace(self, path):
+        """
+        Encrypt a file in place through mmap (no second copy on disk).
+        If a previous run was interrupted, calling this again resumes it.
+        """
+        try:
+            self._transform_inplace(path, "encrypt")
+            return True
+        except Exception as e:
+            print(f"Encryption error: {e}")
+            return False
+
+    def decrypt_file_inplace(self, path):
+        """
+        Decrypt a file in place through mmap (no second copy on disk).
+        If a previous run was interrupted, calling this again resumes it.
+        """
+        try:
+            self._transform_inplace(path, "decrypt")
             return True
         except Exception as e:
             print(f"Decryption error: {e}")
             return False
 
+    def _transform_inplace(self, path, operation):
+        """
+        XOR the mapped pages of path one window at a time.
+
+        Before a window is touched its original bytes are saved in a small
+        journal next to the file (path + INPLACE_JOURNAL_SUFFIX). XOR is not
+        idempotent, so after a crash the last window is restored from the
+        journal and redone, and every window before it is known to be done.
+        The journal is removed once the file is complete.
+        """
+        journal_path = path + INPLACE_JOURNAL_SUFFIX
+        state = _read_inplace_journal(journal_path)
+        if state is None and operation == "decrypt" and self._is_framed(path):
+            raise ValueError("In-place mode only supports the unframed format")
+        if state is None:
+            state = self._start_inplace(path, operation, journal_path)
+        elif state["operation"] != operation:
+            raise ValueError(
+                f"'{path}' has an interrupted in-place {state['operation']}; "
+                f"resume that before running {operation}"
+            )
+
+        done = state["done"]
+        data_len = state["data_len"]
+        with open(path, "r+b") as f:
+            # done == data_len: every window was written before the crash, and
+            # the file may already be truncated - only the cleanup below is left
+            if done < data_len:
+                if state["pending"]:
+                    # Undo the window that may have been half written
+                    f.seek(done)
+                    f.write(state["pending"])
+                elif operation == "encrypt" and done == 0:
+                    # Padding may not have reached the disk before the crash
+                    f.seek(state["orig_size"])
+                    f.write(self._padding(state["orig_size"], BLOCK_SIZE))
+                    f.truncate(data_len)
+                f.flush()
+                os.fsync(f.fileno())
+
+                with mmap.mmap(f.fileno(), data_len) as mapped:
+                    while done < data_len:
+                        end = min(done + self.chunk_size, data_len)
+                        _write_inplace_journal(journal_path, state, done, mapped[done:end])
+                        with memoryview(mapped)[done:end] as window:
+                            self.kernel.xor_into(window, self.key, done)
+                        flush_start = done - done % mmap.ALLOCATIONGRANULARITY
+                        mapped.flush(flush_start, end - flush_start)
+                        done = end
+                    _write_inplace_journal(journal_path, state, done, b"")
+
+            if state["final_size"] != data_len:
+                # Decryption -> drop the padding from the tail (a no-op when resuming
+                # a run that crashed after the truncate)
+                f.truncate(state["final_size"])
+                os.fsync(f.fileno())
+        os.remove(journal_path)
+
+    def _start_inplace(self, path, operation, journal_path):
+        """Check the file, record the plan in a fresh journal and return it"""
+        size = os.path.getsize(path)
+        if operation == "encrypt":
+            data_len = size + len(self._padding(size, BLOCK_SIZE))
+            final_size = data_len
+        else:
+            if size < BLOCK_SIZE:
+                raise ValueError("File is too short to be encrypted data")
+            # Check the padding before touching anything, so a wrong key
+            # fails without scrambling the file
+            with open(path, "rb") as f:
+                f.seek(size - BLOCK_SIZE)
+                last_block = self._xor_encrypt(f.read(BLOCK_SIZE), self.key, size - BLOCK_SIZE)
+            data_len = size
+            final_size = size - BLOCK_SIZE + len(self._unpad_data(last_block))
+
+        state = {
+            "operation": operation,
+            "orig_size": size,
+            "data_len": data_len,
+            "final_size": final_size,
+            "done": 0,
+            "pending": b"",
+        }
+        _write_inplace_journal(journal_path, state, 0, b"")
+        return state
+
+    def encrypt_tree(self, input_root, output_root, workers=None, executor="process", framed=False):
+        """
+        Encrypt every file under input_root into the same layout under output_root.
+        Files are spread over a pool of workers ("process" or "thread").
+        Returns one result dict per file instead of printing errors.
+        """
+        operation = "encrypt_framed" if framed else "encrypt"
+        return self._run_tree(operation, input_root, output_root, workers, executor)
+
+    def decrypt_tree(self, input_root, output_root, workers=None, executor="process"):
+        """Decrypt every file under input_root into the same layout under output_root"""
+        return self._run_tree("decrypt", input_root, output_root, workers, executor)
+
+    def _run_tree(self, operation, input_root, output_root, workers, executor):
+        jobs = collect_tree_jobs(input_root, output_root)
+        return self._run_batches(_run_file_batch, (operation,), jobs, workers, executor)
+
+    def _run_batches(self, batch_function, options, jobs, workers, executor):
+        """Run batch_function(key, chunk_size, backend, *options, batch) over balanced batches of jobs"""
+        if executor not in ("process", "thread"):
+            raise ValueError(f"Unknown executor: {executor}")
+        if not jobs:
+            return []
+        workers = workers or os.cpu_count() or 1
+        pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+
+        results = []
+        with pool_class(max_workers=workers) as pool:
+            futures = [
+                pool.submit(batch_function, self.key, self.chunk_size,
+                            self.kernel.name, *options, batch)
+                for batch in balanced_batches(jobs, workers)
+            ]
+            for future in as_completed(futures):
+                results.extend(future.result())
+        results.sort(key=lambda result: result["path"])
+        return results
+
+    def encrypt_tree_incremental(self, input_root, output_root, manifest_path, workers=None,
+                                 executor="process", framed=False, prune=True):
+        """
+        Like encrypt_tree, but only re-encrypt files that changed since the last run.
+        manifest_path: .jsonl (or .db/.sqlite) manifest of what was encrypted
+        1. Files whose size, mtime, output, format and key all match the
+           manifest are skipped without being read.
+        2. Files with the same size but a new mtime may only have been touched:
+           they are hashed (read-only) and only encrypted if the hash differs.
+           Everything else is encrypted and hashed in the same read.
+        3. With prune, outputs of source files that no longer exist are deleted.
+        Returns {'encrypted': per-file results, 'unchanged', 'hashed', 'pruned': [paths]}.
+        """
+        key_id = self._key_id()
+        manifest = open_manifest(manifest_path)
+        try:
+            entries = manifest.load()
+            todo = []
+            updated = {}
+            removed = []
+            seen = set()
+            unchanged = hashed = 0
+            for job in collect_tree_jobs(input_root, output_root):
+                rel_path, input_path, output_path, _ = job
+                try:
+                    st = os.stat(input_path)
+                except OSError:
+                    # Gone since the walk: treat it as deleted, so prune removes it
+                    continue
+                seen.add(rel_path)
+                entry = entries.get(rel_path)
+                if (entry is None or entry["size"] != st.st_size or entry["output"] != output_path
+                        or entry["framed"] != framed or entry["key_id"] != key_id
+                        or not os.path.exists(output_path)):
+                    todo.append(job + (None,))
+                elif entry["mtime_ns"] == st.st_mtime_ns:
+                    unchanged += 1
+                else:
+                    # Same size, new mtime: maybe just touched - a read-only hash decides
+                    hashed += 1
+                    todo.append(job + (entry["hash"],))
+
+            results = self._run_batches(_run_incremental_batch, (framed,), todo, workers, executor)
+            encrypted = []
+            for result in results:
+                if result["ok"] and result["unchanged"]:
+                    unchanged += 1
+                    if result["stable"]:
+                        updated[result["path"]] = dict(entries[result["path"]], mtime_ns=result["mtime_ns"])
+                    continue
+                encrypted.append(result)
+                if result["ok"] and result["stable"]:
+                    updated[result["path"]] = {
+                        "path": result["path"], "size": result["bytes"], "mtime_ns": result["mtime_ns"],
+                        "hash": result["hash"], "output": result["output"], "framed": framed,
+                        "key_id": key_id,
+                    }
+                elif result["ok"]:
+                    # Modified while it was encrypted: forget it so the next run redoes it
+                    removed.append(result["path"])
+
+            pruned = []
+            if prune:
+                for rel_path, entry in entries.items():
+                    if rel_path in seen:
+                        continue
+                    try:
+                        os.remove(entry["output"])
+                    except FileNotFoundError:
+                        pass
+                    removed.append(rel_path)
+                    pruned.append(rel_path)
+
+            manifest.apply(updated, removed)
+        finally:
+            manifest.close()
+        return {"encrypted": encrypted, "unchanged": unchanged, "hashed": hashed, "pruned": sorted(pruned)}
+
+    def _key_id(self):
+        """Fingerprint of the key, so a manifest notices when the key changes"""
+        return hashlib.sha256(b"manifest-key-id" + self.key).hexdigest()[:16]
+
     def create_test_file(self, content, filename):
         """Create a test file with given content"""
         with open(filename, "w", encoding="utf-8") as f:
             f.write(content)
+
+
+def _hash_file(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """SHA-256 of a file's content, read in chunks; returns the hashlib object"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest
+
+
+def _write_inplace_journal(journal_path, state, done, pending):
+    """Atomically replace the journal with the current progress"""
+    header = INPLACE_JOURNAL_HEADER.pack(
+        INPLACE_JOURNAL_MAGIC,
+        INPLACE_OPERATIONS[state["operation"]],
+        state["orig_size"],
+        state["data_len"],
+        state["final_size"],
+        done,
+        len(pending),
+    )
+    tmp_path = journal_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(pending)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, journal_path)
+
+
+def _read_inplace_journal(journal_path):
+    """Return the journal state, or None when there is no interrupted run"""
+    try:
+        with open(journal_path, "rb") as f:
+            header = f.read(INPLACE_JOURNAL_HEADER.size)
+            magic, op_code, orig_size, data_len, final_size, done, pending_len = (
+                INPLACE_JOURNAL_HEADER.unpack(header)
+            )
+            pending = f.read(pending_len)
+    except FileNotFoundError:
+        return None
+    except struct.error:
+        raise ValueError(f"Corrupted in-place journal: {journal_path}") from None
+
+    operations = {code: name for name, code in INPLACE_OPERATIONS.items()}
+    if magic != INPLACE_JOURNAL_MAGIC or op_code not in operations or len(pending) != pending_len:
+        raise ValueError(f"Corrupted in-place journal: {journal_path}")
+    return {
+        "operation": operations[op_code],
+        "orig_size": orig_size,
+        "data_len": data_len,
+        "final_size": final_size,
+        "done": done,
+        "pending": pending,
+    }
+
+
+TREE_BATCH_MAX_FILES = 64
+
+
+def collect_tree_jobs(input_root, output_root):
+    """List (relative path, input path, output path, size) for every file in the tree"""
+    output_abs = os.path.abspath(output_root)
+    jobs = []
+    for dirpath, dirnames, filenames in os.walk(input_root):
+        # Never walk into the output tree if it lives inside the input tree
+        dirnames[:] = [
+            name for name in dirnames
+            if os.path.abspath(os.path.join(dirpath, name)) != output_abs
+        ]
+        for name in filenames:
+            input_path = os.path.join(dirpath, name)
+            rel_path = os.path.relpath(input_path, input_root)
+            try:
+                size = os.path.getsize(input_path)
+            except OSError:
+                size = 0
+            jobs.append((rel_path, input_path, os.path.join(output_root, rel_path), size))
+    return jobs
+
+
+def balanced_batches(jobs, workers, size_of=lambda job: job[3]):
+    """
+    Group jobs into batches of roughly equal size, largest first.
+    Big files get a batch of their own while small files are bundled together,
+    so workers neither starve at the end nor pay per-file pool overhead.
+    size_of: job -> size in bytes (default: the size field of collect_tree_jobs)
+    """
+    total = sum(size_of(job) for job in jobs)
+    target = max(total // (workers * 8), 1)
+    batches = []
+    current, current_size = [], 0
+    for job in sorted(jobs, key=size_of, reverse=True):
+        size = size_of(job)
+        if size >= target:
+            batches.append([job])
+            continue
+        current.append(job)
+        current_size += size
+        if current_size >= target or len(current) >= TREE_BATCH_MAX_FILES:
+            batches.append(current)
+            current, current_size = [], 0
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _run_file_batch(key, chunk_size, backend, operation, batch):
+    """Worker entry point for encrypt_tree/decrypt_tree (module level so it pickles)"""
+    encryptor = FileEncryptor.from_key_bytes(key, chunk_size=chunk_size, backend=backend)
+    results = []
+    for rel_path, input_path, output_path, size in batch:
+        result = {
+            "path": rel_path,
+            "input": input_path,
+            "output": output_path,
+            "bytes": size,
+            "ok": True,
+            "error": None,
+        }
+        try:
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            if operation == "decrypt":
+                encryptor._decrypt_path(input_path, output_path)
+            else:
+                encryptor._encrypt_path(input_path, output_path, framed=operation == "encrypt_framed")
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = f"{type(e).__name__}: {e}"
+        results.append(result)
+    return results
+
+
+def _run_incremental_batch(key, chunk_size, backend, framed, batch):
+    """
+    Worker entry point for encrypt_tree_incremental: encrypt and hash in one read.
+    Jobs carry the hash from the manifest (or None). Such a file is hashed
+    first, and if its content still has that hash it is reported as unchanged
+    without writing anything.
+    """
+    encryptor = FileEncryptor.from_key_bytes(key, chunk_size=chunk_size, backend=backend)
+    results = []
+    for rel_path, input_path, output_path, size, known_hash in batch:
+        result = {
+            "path": rel_path,
+            "input": input_path,
+            "output": output_path,
+            "bytes": size,
+            "ok": True,
+            "unchanged": False,
+            "error": None,
+        }
+        try:
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            before = os.stat(input_path)
+            digest = None
+            if known_hash is not None:
+                digest = _hash_file(input_path, chunk_size)
+                result["unchanged"] = digest.hexdigest() == known_hash
+            if not result["unchanged"]:
+                digest = hashlib.sha256()
+                encryptor._encrypt_path(input_path, output_path, framed=framed, digest=digest)
+            after = os.stat(input_path)
+            result["bytes"] = before.st_size
+            result["mtime_ns"] = before.st_mtime_ns
+            result["hash"] = digest.hexdigest()
+            result["stable"] = (before.st_size, before.st_mtime_ns) == (after.st_size, after.st_mtime_ns)
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = f"{type(e).__name__}: {e}"
+        results.append(result)
+    return results
@@ -1,56 +1,328 @@
 import os
+import sys
+import json
+import stat
 import random
 import string
+import argparse
 import datetime
+import threading
+import collections
+import time
 
-def log_action(message):
-    """Saves the action to a log file for audit trail."""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"[{timestamp}] {message}"
-    print(log_entry) # Print to screen so we see it happening
-    with open("deletion_audit.log", "a") as log_file:
-        log_file.write(log_entry + "\n")
+try:
+    from audit_log import get_audit_log
+except ImportError:
+    # Run as a script from mod7/ - the shared modules live one level up
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from audit_log import get_audit_log
 
-def secure_delete(filepath, passes=3):
+# JSON lines; deletion_audit.log holds the older plain-text entries
+AUDIT_LOG_FILE = "deletion_audit.jsonl"
+
+# Size of the reusable overwrite buffer - memory use does not grow with the file
+OVERWRITE_BUFFER_SIZE = 1024 * 1024
+
+# secure_delete_tree defaults: files in flight overall and per storage device
+TREE_WORKERS = 8
+TREE_PER_DEVICE = 4
+
+# Byte pattern of each pass; passes cycle through the chosen scheme
+OVERWRITE_SCHEMES = {
+    "random": ("random",),
+    "zeros": ("zeros",),
+    "ones": ("ones",),
+    # DoD 5220.22-M style: zeros, then ones, then random
+    "dod": ("zeros", "ones", "random"),
+}
+
+def _audit_log(audit=None):
+    """The AuditLog to write to: the one passed in, else the shared one for AUDIT_LOG_FILE."""
+    return audit if audit is not None else get_audit_log(AUDIT_LOG_FILE)
+
+def log_action(message, echo=True, audit=None, **fields):
+    """Saves the action to the audit log (JSON lines, written in the background)."""
+    if echo:
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print(f"[{timestamp}] {message}") # Print to screen so we see it happening
+    _audit_log(audit).log("secure_delete", message=message, **fields)
+
+def _fill_pattern(buffer, pattern):
+    """Fill the reusable buffer with the bytes one pass writes."""
+    size = len(buffer)
+    if pattern == "zeros":
+        buffer[:] = bytes(size)
+    elif pattern == "ones":
+        buffer[:] = b"\xff" * size
+    else:
+        # One fresh random block per pass, repeated over the whole file
+        buffer[:] = os.urandom(size)
+
+def _fadvise(fd, advice):
+    """posix_fadvise hint (e.g. "POSIX_FADV_SEQUENTIAL") where the platform has it."""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+        except OSError:
+            pass  # It is only a hint
+
+def _overwrite_pass(fd, file_size, buffer):
+    """Write the buffer over the whole file, then fsync so the pass reaches the disk."""
+    view = memoryview(buffer)
+    os.lseek(fd, 0, os.SEEK_SET)
+    remaining = file_size
+    while remaining > 0:
+        chunk = view[:min(len(view), remaining)]
+        while chunk:
+            written = os.write(fd, chunk)
+            chunk = chunk[written:]
+            remaining -= written
+    os.fsync(fd)
+
+def _throughput(num_bytes, seconds):
+    return f"{num_bytes / (1024 * 1024) / seconds:.1f} MB/s" if seconds > 0 else "n/a"
+
+def secure_delete(filepath, passes=3, scheme="random", buffer_size=OVERWRITE_BUFFER_SIZE, fadvise=True,
+                  echo=True, audit=None):
     """
-    Overwrites the file with random data multiple times before deleting.
+    Overwrites the file multiple times before deleting.
     This prevents recovery tools from reading the original data.
+
+    scheme picks the pattern of each pass (see OVERWRITE_SCHEMES); passes
+    cycle through it. The file is streamed through one reusable buffer of
+    at most buffer_size bytes, so memory stays flat whatever the file size.
+    echo=False only writes the audit log, nothing is printed.
+    audit: AuditLog to record the steps in (default: the shared AUDIT_LOG_FILE one)
+    Returns a report dict: path, bytes, passes, seconds, ok, error.
     """
-    
+    if scheme not in OVERWRITE_SCHEMES:
+        raise ValueError(f"Unknown overwrite scheme: {scheme}")
+    report = _shred(filepath, passes, scheme, buffer_size, fadvise, echo, audit)
+    # The audit trail of the deletion is on disk before we return
+    _audit_log(audit).flush()
+    return report
+
+def _shred(filepath, passes, scheme, buffer_size=OVERWRITE_BUFFER_SIZE, fadvise=True, echo=True,
+           audit=None):
+    """Overwrite and remove one file, logging each step; returns its report."""
+    report = {"path": filepath, "bytes": 0, "passes": passes, "seconds": 0.0, "ok": False, "error": None}
+
     # 1. Check if file exists (Validation)
     if not os.path.exists(filepath):
         print(f"Error: File '{filepath}' not found.")
-        return
+        report["error"] = "not found"
+        return report
 
     # Get file size to know how much to overwrite
     file_size = os.path.getsize(filepath)
-    log_action(f"START: Secure deletion for '{filepath}' ({file_size} bytes)")
+    report["bytes"] = file_size
+    log_action(f"START: Secure deletion for '{filepath}' ({file_size} bytes)", echo, audit,
+               action="start", path=filepath, bytes=file_size)
 
+    start = time.perf_counter()
     try:
-        with open(filepath, "rb+") as f:
+        fd = os.open(filepath, os.O_WRONLY)
+        try:
+            if fadvise:
+                _fadvise(fd, "POSIX_FADV_SEQUENTIAL")
+            buffer = bytearray(max(1, min(buffer_size, file_size)))
+            patterns = OVERWRITE_SCHEMES[scheme]
+
             # 2. Overwrite Logic (Security Practice)
             for i in range(passes):
-                # Move pointer to the beginning of the file
-                f.seek(0)
-                
-                # Generate random trash data
-                random_data = os.urandom(file_size)
-                
-                # Write the trash data over the file
-                f.write(random_data)
-                f.flush() # Force write to disk
-                
-                log_action(f"PASS {i+1}/{passes}: Overwritten with random data.")
-                
+                pattern = patterns[i % len(patterns)]
+                pass_start = time.perf_counter()
+                _fill_pattern(buffer, pattern)
+                _overwrite_pass(fd, file_size, buffer)
+                if fadvise:
+                    # The written pages are on disk now; don't keep them cached
+                    _fadvise(fd, "POSIX_FADV_DONTNEED")
+                elapsed = time.perf_counter() - pass_start
+                log_action(f"PASS {i+1}/{passes}: Overwritten with {pattern} data "
+                           f"({_throughput(file_size, elapsed)}).", echo, audit,
+                           action="pass", path=filepath, number=i + 1, pattern=pattern, seconds=elapsed)
+        finally:
+            os.close(fd)
+
         # 3. Final Delete (Disposal)
         os.remove(filepath)
-        log_action(f"SUCCESS: File '{filepath}' has been permanently deleted.")
-        
+        report["seconds"] = time.perf_counter() - start
+        report["ok"] = True
+        log_action(f"SUCCESS: File '{filepath}' has been permanently deleted.", echo, audit,
+                   action="success", path=filepath, bytes=file_size, passes=passes,
+                   seconds=report["seconds"])
+        if echo:
+            print(f"THROUGHPUT: {file_size * passes} bytes overwritten in {report['seconds']:.3f}s "
+                  f"({_throughput(file_size * passes, report['seconds'])}).")
+
     except Exception as e:
-        log_action(f"FAILURE: Could not delete '{filepath}'. Error: {e}")
+        report["seconds"] = time.perf_counter() - start
+        report["error"] = str(e)
+        log_action(f"FAILURE: Could not delete '{filepath}'. Error: {e}", echo, audit,
+                   action="failure", path=filepath, error=str(e))
+    return report
 
-# This part runs when you start the script
-if __name__ == "__main__":
+def _collect_tree(root):
+    """Regular files under root as (size, path, device), plus skipped paths.
+    Symlinks are never followed, so nothing outside root gets shredded."""
+    files = []
+    skipped = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        skipped.extend(os.path.join(dirpath, d) for d in dirnames if os.path.islink(os.path.join(dirpath, d)))
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                files.append((st.st_size, path, st.st_dev))
+            else:
+                skipped.append(path)
+    return files, skipped
+
+class _DeviceScheduler:
+    """Hands out files largest first, never running more than per_device
+    files of one device at the same time. Workers never sit blocked on a
+    busy device while another device still has work."""
+
+    def __init__(self, files, per_device):
+        self.per_device = per_device
+        self.queues = {}
+        for job in sorted(files, reverse=True):
+            self.queues.setdefault(job[2], collections.deque()).append(job)
+        self.active = dict.fromkeys(self.queues, 0)
+        self.condition = threading.Condition()
+
+    def next_job(self):
+        """Next (size, path, device) to shred, or None when everything is handed out"""
+        with self.condition:
+            while True:
+                ready = [dev for dev, queue in self.queues.items()
+                         if queue and self.active[dev] < self.per_device]
+                if ready:
+                    device = max(ready, key=lambda dev: self.queues[dev][0][0])
+                    self.active[device] += 1
+                    return self.queues[device].popleft()
+                if not any(self.queues.values()):
+                    return None
+                self.condition.wait()
+
+    def done(self, device):
+        with self.condition:
+            self.active[device] -= 1
+            self.condition.notify_all()
+
+def secure_delete_tree(root, passes=3, workers=TREE_WORKERS, scheme="random",
+                       per_device=TREE_PER_DEVICE, remove_dirs=True, audit=None):
+    """
+    Securely delete every file under root, then remove the emptied directories.
+    Files are shredded largest first by a bounded pool of threads (the work
+    is I/O bound), with at most per_device files in flight per device.
+    audit: AuditLog to record the steps in (default: the shared AUDIT_LOG_FILE one)
+    Returns an aggregate report: files, bytes, failures, skipped,
+    directories_removed, seconds.
+    """
+    if scheme not in OVERWRITE_SCHEMES:
+        raise ValueError(f"Unknown overwrite scheme: {scheme}")
+    report = {"root": root, "files": 0, "bytes": 0, "failures": [], "skipped": [],
+              "directories_removed": 0, "seconds": 0.0}
+
+    # 1. Check the directory exists (Validation)
+    if not os.path.isdir(root):
+        print(f"Error: Directory '{root}' not found.")
+        report["failures"].append({"path": root, "error": "not a directory"})
+        return report
+
+    start = time.perf_counter()
+    files, report["skipped"] = _collect_tree(root)
+    total = sum(size for size, _, _ in files)
+    log_action(f"START: Secure deletion of tree '{root}' ({len(files)} files, {total} bytes)",
+               audit=audit, action="tree_start", path=root, files=len(files), bytes=total)
+
+    # 2. Shred the files across the worker threads
+    scheduler = _DeviceScheduler(files, max(1, per_device))
+    results = []
+
+    def worker():
+        while True:
+            job = scheduler.next_job()
+            if job is None:
+                return
+            try:
+                results.append(_shred(job[1], passes, scheme, echo=False, audit=audit))
+            finally:
+                scheduler.done(job[2])
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(workers, len(files))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for result in results:
+        if result["ok"]:
+            report["files"] += 1
+            report["bytes"] += result["bytes"]
+        else:
+            report["failures"].append({"path": result["path"], "error": result["error"]})
+
+    # 3. Remove the directories that are now empty, deepest first
+    if remove_dirs:
+        for dirpath, _, _ in os.walk(root, topdown=False):
+            try:
+                os.rmdir(dirpath)
+                report["directories_removed"] += 1
+            except OSError:
+                pass  # Still holds a failed or skipped entry
+
+    report["seconds"] = time.perf_counter() - start
+    log_action(f"TREE DONE: '{root}' - {report['files']} files, {report['bytes']} bytes, "
+               f"{len(report['failures'])} failures, {len(report['skipped'])} skipped "
+               f"({_throughput(report['bytes'] * passes, report['seconds'])}).",
+               audit=audit, action="tree_done", path=root, files=report["files"], bytes=report["bytes"],
+               failures=len(report["failures"]), skipped=len(report["skipped"]), seconds=report["seconds"])
+    _audit_log(audit).flush()
+    return report
+
+def main(argv=None):
+    """Non-interactive command line: shred files and directory trees."""
+    parser = argparse.ArgumentParser(description="Securely overwrite and delete files or directory trees.")
+    parser.add_argument("paths", nargs="+", help="files or directories to destroy")
+    parser.add_argument("--passes", type=int, default=3, help="overwrite passes per file (default: 3)")
+    parser.add_argument("--scheme", choices=sorted(OVERWRITE_SCHEMES), default="random",
+                        help="pattern written by the passes (default: random)")
+    parser.add_argument("--workers", type=int, default=TREE_WORKERS,
+                        help=f"files shredded in parallel (default: {TREE_WORKERS})")
+    parser.add_argument("--per-device", type=int, default=TREE_PER_DEVICE,
+                        help=f"files shredded in parallel per device (default: {TREE_PER_DEVICE})")
+    parser.add_argument("--keep-dirs", action="store_true", help="do not remove emptied directories")
+    parser.add_argument("--audit-log", default=AUDIT_LOG_FILE,
+                        help=f"JSON-lines audit log (default: {AUDIT_LOG_FILE})")
+    args = parser.parse_args(argv)
+    audit = get_audit_log(args.audit_log)
+
+    summary = {"files": 0, "bytes": 0, "failures": [], "skipped": []}
+    for path in args.paths:
+        if os.path.isdir(path):
+            report = secure_delete_tree(path, args.passes, args.workers, args.scheme,
+                                        args.per_device, remove_dirs=not args.keep_dirs, audit=audit)
+            summary["files"] += report["files"]
+            summary["bytes"] += report["bytes"]
+            summary["failures"] += report["failures"]
+            summary["skipped"] += report["skipped"]
+        else:
+            result = secure_delete(path, args.passes, args.scheme, audit=audit)
+            if result["ok"]:
+                summary["files"] += 1
+                summary["bytes"] += result["bytes"]
+            else:
+                summary["failures"].append({"path": path, "error": result["error"]})
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failures"] else 0
+
+def interactive_demo():
+    """Create a dummy file and shred it after asking for confirmation."""
     # Create a dummy file for testing if it doesn't exist
     target_file = "confidential_data.txt"
     if not os.path.exists(target_file):
@@ -69,3 +341,10 @@ if __name__ == "__main__":
         secure_delete(target_file)
     else:
         print("Operation cancelled.")
+
+# This part runs when you start the script - with arguments it is a plain
+# command line tool, without them it runs the interactive demo
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main())
+    interactive_demo()
@@ -1,25 +1,33 @@
 import os
+import json
+import shutil
+import tempfile
 import time
+import threading
 import unittest
-from secure_delete import secure_delete, log_action
+from unittest import mock
+import secure_delete as secure_delete_module
+from secure_delete import secure_delete, secure_delete_tree, main, log_action, _fill_pattern, _overwrite_pass
 
 class TestSecureDelete(unittest.TestCase):
 
     def setUp(self):
-        """Setup a dummy file before each test."""
-        self.test_file = "test_secret.txt"
-        self.log_file = "deletion_audit.log"
-        
+        """Setup a dummy file and a private audit log before each test."""
+        self.tmp = tempfile.mkdtemp()
+        self.test_file = os.path.join(self.tmp, "test_secret.txt")
+        self.log_file = os.path.join(self.tmp, "deletion_audit.jsonl")
+        # Keep the tests out of the real audit log
+        log_patch = mock.patch.object(secure_delete_module, "AUDIT_LOG_FILE", self.log_file)
+        log_patch.start()
+        self.addCleanup(log_patch.stop)
+
         with open(self.test_file, "w") as f:
             f.write("Super secret data for testing.")
             
     def tearDown(self):
-        """Clean up if something failed."""
-        if os.path.exists(self.test_file):
-            try:
-                os.remove(self.test_file)
-            except:
-                pass
+        """Close the audit log and clean up if something failed."""
+        secure_delete_module.get_audit_log(self.log_file).close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
 
     def test_file_deletion_success(self):
         """Test if the file is actually deleted."""
@@ -37,11 +45,128 @@ class TestSecureDelete(unittest.TestCase):
         
         secure_delete(self.test_file, passes=1)
         
-        # Read the log file
+        # Read the log file (one JSON record per line)
         with open(self.log_file, "r") as f:
-            content = f.read()
-            
-        self.assertIn("SUCCESS: File 'test_secret.txt' has been permanently deleted.", content)
+            records = [json.loads(line) for line in f]
+
+        self.assertEqual(records[0]["message"], marker)
+        self.assertIn(f"SUCCESS: File '{self.test_file}' has been permanently deleted.",
+                      [record["message"] for record in records])
+
+    def test_streaming_overwrite(self):
+        """Test that a file larger than the buffer is shredded with bounded memory."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "big.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(100000))
+
+            report = secure_delete(path, passes=3, scheme="dod", buffer_size=4096)
+
+            self.assertTrue(report["ok"], report["error"])
+            self.assertEqual(report["bytes"], 100000)
+            self.assertFalse(os.path.exists(path))
+
+    def test_pass_patterns(self):
+        """Test that a pass overwrites every byte with its pattern."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data.bin")
+            with open(path, "wb") as f:
+                f.write(b"secret" * 5000)
+            fd = os.open(path, os.O_WRONLY)
+            try:
+                buffer = bytearray(1000)
+                for pattern, expected in (("zeros", 0x00), ("ones", 0xFF)):
+                    _fill_pattern(buffer, pattern)
+                    _overwrite_pass(fd, 30000, buffer)
+                    with open(path, "rb") as f:
+                        self.assertEqual(set(f.read()), {expected})
+            finally:
+                os.close(fd)
+            self.assertEqual(os.path.getsize(path), 30000)
+
+    def test_missing_file_and_unknown_scheme(self):
+        """Test that bad input is reported instead of crashing."""
+        self.assertFalse(secure_delete(os.path.join(self.tmp, "no_such_file.txt"))["ok"])
+        with self.assertRaises(ValueError):
+            secure_delete(self.test_file, scheme="gutmann")
+
+    def _make_tree(self, root):
+        """Nested directories with files of different sizes; returns the total size."""
+        total = 0
+        for i in range(12):
+            folder = os.path.join(root, f"dir{i % 3}", f"sub{i % 2}")
+            os.makedirs(folder, exist_ok=True)
+            data = os.urandom(1000 * (i + 1))
+            with open(os.path.join(folder, f"file{i}.bin"), "wb") as f:
+                f.write(data)
+            total += len(data)
+        return total
+
+    def test_tree_deletion(self):
+        """Test that a whole tree is shredded and its directories removed."""
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, "data")
+            total = self._make_tree(root)
+            outside = os.path.join(tmp, "outside.txt")
+            with open(outside, "w") as f:
+                f.write("not part of the tree")
+            os.symlink(outside, os.path.join(root, "dir0", "link.txt"))
+
+            report = secure_delete_tree(root, passes=1, workers=4)
+
+            self.assertEqual(report["files"], 12)
+            self.assertEqual(report["bytes"], total)
+            self.assertEqual(report["failures"], [])
+            # The symlink is skipped, never followed
+            self.assertEqual(report["skipped"], [os.path.join(root, "dir0", "link.txt")])
+            self.assertTrue(os.path.exists(outside))
+            self.assertEqual(sorted(os.listdir(root)), ["dir0"])
+
+    def test_tree_order_and_device_limit(self):
+        """Test that files go largest first and per-device concurrency is capped."""
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, "data")
+            self._make_tree(root)
+            lock = threading.Lock()
+            state = {"active": 0, "peak": 0, "sizes": []}
+            real_shred = secure_delete_module._shred
+
+            def tracking_shred(path, passes, scheme, **options):
+                with lock:
+                    state["active"] += 1
+                    state["peak"] = max(state["peak"], state["active"])
+                    state["sizes"].append(os.path.getsize(path))
+                time.sleep(0.01)
+                try:
+                    return real_shred(path, passes, scheme, **options)
+                finally:
+                    with lock:
+                        state["active"] -= 1
+
+            with mock.patch.object(secure_delete_module, "_shred", tracking_shred):
+                report = secure_delete_tree(root, passes=1, workers=1)
+                self.assertEqual(state["sizes"], sorted(state["sizes"], reverse=True))
+                self._make_tree(root)
+                report = secure_delete_tree(root, passes=1, workers=8, per_device=2)
+
+            self.assertEqual(report["files"], 12)
+            self.assertLessEqual(state["peak"], 2)
+            self.assertFalse(os.path.exists(root))
+
+    def test_command_line(self):
+        """Test the non-interactive command line."""
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, "data")
+            self._make_tree(root)
+            single = os.path.join(tmp, "single.txt")
+            with open(single, "w") as f:
+                f.write("secret")
+
+            self.assertEqual(main([root, single, "--passes", "1", "--scheme", "zeros"]), 0)
+            self.assertFalse(os.path.exists(root))
+            self.assertFalse(os.path.exists(single))
+            self.assertEqual(main([os.path.join(tmp, "missing.txt"), "--passes", "1",
+                                   "--audit-log", self.log_file]), 1)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,92 @@
+# password_kdf.py
+"""
+Password key-derivation functions for PasswordManager.
+
+A KDF is described by a small params dict that is stored next to each user's
+hash, e.g. {'name': 'pbkdf2_sha256', 'iterations': 600000}. That way users
+hashed with different algorithms or costs can live in the same store.
+"""
+import hashlib
+import time
+
+
+# What records written before KDF support used: sha256(salt + password)
+LEGACY_PARAMS = {'name': 'sha256'}
+
+# OWASP's current recommendation for PBKDF2-HMAC-SHA256
+DEFAULT_PARAMS = {'name': 'pbkdf2_sha256', 'iterations': 600000}
+
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_MAX_MEMORY = 256 * 1024 * 1024
+
+
+def _sha256(password, salt, params):
+    return hashlib.sha256((salt + password).encode('utf-8')).hexdigest()
+
+
+def _pbkdf2_sha256(password, salt, params):
+    return hashlib.pbkdf2_hmac(
+        'sha256', password.encode('utf-8'), salt.encode('utf-8'), params['iterations']
+    ).hex()
+
+
+def _scrypt(password, salt, params):
+    n, r, p = params['n'], params.get('r', SCRYPT_R), params.get('p', SCRYPT_P)
+    return hashlib.scrypt(
+        password.encode('utf-8'), salt=salt.encode('utf-8'), n=n, r=r, p=p,
+        maxmem=max(SCRYPT_MAX_MEMORY, 256 * n * r), dklen=32
+    ).hex()
+
+
+KDFS = {
+    'sha256': _sha256,
+    'pbkdf2_sha256': _pbkdf2_sha256,
+    'scrypt': _scrypt,
+}
+
+
+def derive(password, salt, params):
+    """Hash password with salt using the KDF described by params (hex digest)"""
+    try:
+        kdf = KDFS[params['name']]
+    except KeyError:
+        raise ValueError(f"Unknown KDF: {params.get('name')}") from None
+    return kdf(password, salt, params)
+
+
+def benchmark(params, rounds=5):
+    """Median seconds one derive() takes with params on this machine"""
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        derive('benchmark-password', 'benchmark-salt', params)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def calibrate(name='pbkdf2_sha256', target_seconds=0.1, rounds=3, min_iterations=100000):
+    """
+    Pick parameters so one verify takes about target_seconds here.
+    PBKDF2 scales linearly with iterations; scrypt doubles n until the
+    target is reached (or the memory cap would be exceeded).
+    """
+    if name == 'pbkdf2_sha256':
+        probe = {'name': name, 'iterations': 20000}
+        per_iteration = benchmark(probe, rounds) / probe['iterations']
+        iterations = int(target_seconds / per_iteration)
+        # Never go below a sane floor, whatever the machine
+        return {'name': name, 'iterations': max(iterations, min_iterations)}
+
+    if name == 'scrypt':
+        n = 2 ** 14
+        params = {'name': name, 'n': n, 'r': SCRYPT_R, 'p': SCRYPT_P}
+        while 128 * SCRYPT_R * n <= SCRYPT_MAX_MEMORY:
+            params = {'name': name, 'n': n, 'r': SCRYPT_R, 'p': SCRYPT_P}
+            if benchmark(params, rounds) >= target_seconds:
+                break
+            n *= 2
+        return params
+
+    raise ValueError(f"Cannot calibrate KDF: {name}")
@@ -1,68 +1,209 @@
-import hashlib
+import hmac
 import os
+import csv
 import json
 import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+import password_kdf
+from password_storage import open_store
 
 
 class PasswordManager:
-    def __init__(self, storage_file='passwords.json'):
+    def __init__(self, storage_file='passwords.json', sync_every=1,
+                 sync_interval=None, compact_every=1000, kdf_params=None, store=None,
+                 audit=None):
+        """
+        storage_file: passwords.json style store, or a .db/.sqlite file for SQLite
+        sync_every, sync_interval, compact_every: JSON journal tuning (see JsonFileStore)
+        kdf_params: KDF for new hashes (see password_kdf, e.g. from calibrate())
+        store: an already-open storage backend to use instead of storage_file
+        audit: AuditLog (see audit_log.py) that records every change to a user
+        """
         self.storage_file = storage_file
-        self.users = self._load_users()
-
-    def _load_users(self):
-        """Load users from storage file"""
-        try:
-            with open(self.storage_file, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            # No file yet -> start with empty dict
-            return {}
-        except json.JSONDecodeError:
-            # Corrupted/empty file -> also start fresh
-            return {}
-
-    def _save_users(self):
-        """Save users to storage file"""
-        with open(self.storage_file, 'w') as f:
-            json.dump(self.users, f, indent=4)
-
-    def hash_password(self, password, salt=None):
+        self.kdf_params = dict(kdf_params or password_kdf.DEFAULT_PARAMS)
+        if store is None:
+            store = open_store(storage_file, sync_every=sync_every,
+                               sync_interval=sync_interval, compact_every=compact_every)
+        self.store = store
+        self.audit = audit
+
+    @property
+    def users(self):
+        """Read-only mapping of username -> record, backed by the store"""
+        return self.store
+
+    def sync(self):
+        """Force pending changes to disk"""
+        self.store.sync()
+
+    def compact(self):
+        """Compact the store (JSON: rewrite the snapshot, SQLite: checkpoint the WAL)"""
+        self.store.compact()
+
+    def close(self):
+        self.store.close()
+
+    def _audit(self, event, **fields):
+        # Usernames and outcomes only - never passwords or hashes
+        if self.audit is not None:
+            self.audit.log(event, **fields)
+
+    def hash_password(self, password, salt=None, params=None):
         """
-        Hash a password using SHA-256 with salt
+        Hash a password with salt using the configured KDF
+        params: KDF params to use instead of self.kdf_params
         Returns: (hashed_password, salt_used)
         """
         if salt is None:
             salt = secrets.token_hex(16)  # Generate random salt
 
-        # Combine salt + password, then hash
-        combo = (salt + password).encode('utf-8')
-        hashed = hashlib.sha256(combo).hexdigest()
+        hashed = password_kdf.derive(password, salt, params or self.kdf_params)
         return hashed, salt
 
-    def verify_password(self, password, stored_hash, salt):
-        """Verify if password matches stored hash"""
-        candidate_hash, _ = self.hash_password(password, salt)
-        return candidate_hash == stored_hash
+    def verify_password(self, password, stored_hash, salt, params=None):
+        """Verify if password matches stored hash (constant-time compare)"""
+        candidate_hash, _ = self.hash_password(password, salt, params)
+        return hmac.compare_digest(candidate_hash, stored_hash)
+
+    def _verify_user(self, user, password):
+        # Records from before KDF support have no 'kdf' key -> plain SHA-256
+        params = user.get('kdf', password_kdf.LEGACY_PARAMS)
+        return self.verify_password(password, user['hash'], user['salt'], params)
+
+    def _with_password(self, user, password):
+        """Copy of user with password hashed under a new salt and the current KDF"""
+        updated = dict(user)
+        updated['hash'], updated['salt'] = self.hash_password(password)
+        updated['kdf'] = dict(self.kdf_params)
+        return updated
 
     def add_user(self, username, password, role='user'):
         """Add a new user with hashed password"""
         # 1. Check if username already exists
         if username in self.users:
+            self._audit('user_add_failed', username=username, error='user already exists')
             return False  # or raise an exception
 
         # 2. Hash the password with a new salt
         pwd_hash, salt = self.hash_password(password)
 
-        # 3. Store username, hashed password, salt, and role
-        self.users[username] = {
+        # 3. Store username, hashed password, salt, KDF params and role
+        #    (re-checked under the store's lock in case another process won)
+        added = self.store.add(username, {
             'hash': pwd_hash,
             'salt': salt,
+            'kdf': dict(self.kdf_params),
             'role': role
-        }
+        })
+        if added:
+            self._audit('user_added', username=username, role=role)
+        else:
+            self._audit('user_add_failed', username=username, error='user already exists')
+        return added
 
-        # 4. Save to file
-        self._save_users()
-        return True
+    def add_users(self, records, workers=None):
+        """
+        Add many users at once.
+        records: iterable of (username, password[, role]) tuples or dicts with
+                 'username', 'password' and optional 'role' keys
+        Passwords are hashed on a thread pool and all new users are written
+        to the journal as one transaction.
+        Returns one {'username', 'ok', 'error'} dict per record, in order.
+        """
+        # 1. Validate everything up front (including duplicates in the batch)
+        results = []
+        accepted = []
+        seen = set()
+        for record in records:
+            username, password, role, error = self._parse_user_record(record)
+            result = {'username': username, 'ok': False, 'error': None}
+            if error:
+                result['error'] = error
+            elif not username or password is None:
+                result['error'] = 'missing username or password'
+            elif username in self.users:
+                result['error'] = 'user already exists'
+            elif username in seen:
+                result['error'] = 'duplicate username in batch'
+            else:
+                seen.add(username)
+                accepted.append((result, username, password, role))
+            results.append(result)
+
+        if not accepted:
+            self._audit_batch(results)
+            return results
+
+        # 2. Hash in parallel
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashes = list(pool.map(self.hash_password, [item[2] for item in accepted]))
+
+        # 3. Apply and persist once
+        new_users = {}
+        for (result, username, _, role), (pwd_hash, salt) in zip(accepted, hashes):
+            new_users[username] = {
+                'hash': pwd_hash, 'salt': salt, 'kdf': dict(self.kdf_params), 'role': role
+            }
+            result['ok'] = True
+        # Another process may have taken some of the names meanwhile
+        taken = set(self.store.add_many(new_users))
+        for result, username, _, _ in accepted:
+            if username in taken:
+                result['ok'] = False
+                result['error'] = 'user already exists'
+        self._audit_batch(results, roles={username: role for _, username, _, role in accepted})
+        return results
+
+    def _audit_batch(self, results, roles=None):
+        if self.audit is None:
+            return
+        for result in results:
+            if result['ok']:
+                self.audit.log('user_added', username=result['username'], role=roles[result['username']])
+            else:
+                self.audit.log('user_add_failed', username=result['username'], error=result['error'])
+
+    def _parse_user_record(self, record):
+        """
+        Return (username, password, role, error) from a tuple or dict record;
+        error is None unless the record has the wrong shape or field types
+        """
+        if isinstance(record, dict):
+            username, password = record.get('username'), record.get('password')
+            role = record.get('role') or 'user'
+        elif isinstance(record, (tuple, list)) and len(record) in (2, 3):
+            username, password, role = (tuple(record) + ('user',))[:3]
+        else:
+            return None, None, None, 'malformed record'
+        if not all(value is None or isinstance(value, str) for value in (username, password, role)):
+            return (username if isinstance(username, str) else None), None, None, 'malformed record'
+        return username, password, role, None
+
+    def _parse_jsonl_line(self, line):
+        """The object on one import line, or None (reported as malformed) if it is not one"""
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        return record if isinstance(record, dict) else None
+
+    def import_users(self, path, workers=None):
+        """
+        Bulk import users from a .csv file (username,password,role header)
+        or a .jsonl file (one {"username", "password", "role"} object per line).
+        Returns the per-record results of add_users; a JSONL line that is not
+        a valid object gets a 'malformed record' result in its place.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            if extension == '.csv':
+                records = list(csv.DictReader(f))
+            elif extension in ('.jsonl', '.ndjson'):
+                records = [self._parse_jsonl_line(line) for line in f if line.strip()]
+            else:
+                raise ValueError(f"Unsupported import format: {extension}")
+        return self.add_users(records, workers=workers)
 
     def authenticate(self, username, password):
         """Authenticate a user"""
@@ -72,12 +213,18 @@ class PasswordManager:
             return False, None
 
         # 2. Verify password
-        if self.verify_password(password, user['hash'], user['salt']):
-            # 3. Return (success, role)
-            return True, user['role']
-        else:
+        if not self._verify_user(user, password):
             return False, None
 
+        # 3. Upgrade hashes made with an older/weaker KDF while we know the password
+        #    (skipped if another process changed the record in the meantime)
+        if user.get('kdf') != self.kdf_params:
+            if self.store.compare_and_put(username, user, self._with_password(user, password)):
+                self._audit('password_rehashed', username=username, kdf=self.kdf_params['name'])
+
+        # 4. Return (success, role)
+        return True, user['role']
+
     def change_password(self, username, old_password, new_password):
         """Change user password"""
         user = self.users.get(username)
@@ -85,14 +232,15 @@ class PasswordManager:
             return False
 
         # 1. Verify old password
-        if not self.verify_password(old_password, user['hash'], user['salt']):
+        if not self._verify_user(user, old_password):
+            self._audit('password_change_failed', username=username, error='wrong password')
             return False
 
-        # 2. Hash new password with new salt
-        new_hash, new_salt = self.hash_password(new_password)
-
-        # 3. Update stored credentials
-        user['hash'] = new_hash
-        user['salt'] = new_salt
-        self._save_users()
-        return True
+        # 2. Hash new password with new salt and update stored credentials,
+        #    unless another process changed them since we verified
+        changed = self.store.compare_and_put(username, user, self._with_password(user, new_password))
+        if changed:
+            self._audit('password_changed', username=username)
+        else:
+            self._audit('password_change_failed', username=username, error='changed concurrently')
+        return changed
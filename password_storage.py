@@ -0,0 +1,445 @@
+# password_storage.py
+"""
+Storage backends for PasswordManager.
+
+Both backends behave like a read-only mapping of username -> user record
+(a dict with 'hash', 'salt', 'role' and 'kdf'), plus put/put_many/add/
+add_many/compare_and_put to write:
+
+- JsonFileStore: the passwords.json snapshot plus an append-only journal,
+  everything held in memory
+- SQLiteStore: one indexed row per user, loaded on demand, so startup cost
+  and memory no longer grow with the number of users
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from collections.abc import Mapping
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no advisory locks, single-process use only
+    fcntl = None
+
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+
+class JsonFileStore(Mapping):
+    def __init__(self, storage_file, sync_every=1, sync_interval=None,
+                 compact_every=1000, refresh_interval=0.0):
+        """
+        storage_file: JSON snapshot of all users
+        sync_every: fsync the journal after this many unsynced records
+        sync_interval: also fsync at most this many seconds after a record was
+                       written, even if no further writes come (a background
+                       timer does it). With None, records beyond the last
+                       sync_every batch wait for the next write, sync() or close().
+        compact_every: fold the journal into the snapshot after this many records
+        refresh_interval: seconds between checks for changes made by other
+                          processes (0 = check on every read)
+
+        Several processes may share one store. Writers take an exclusive
+        flock on storage_file + '.lock', catch up with the files, then append;
+        the snapshot and the journal are only ever replaced by atomic renames.
+        Readers need no lock: a couple of stat() calls tell them whether the
+        files changed, and usually only the new journal tail has to be read.
+        """
+        self.storage_file = storage_file
+        self.journal_file = storage_file + '.journal'
+        self.lock_file = storage_file + '.lock'
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self.refresh_interval = refresh_interval
+        self._journal = None
+        self._lock_handle = None
+        self._thread_lock = threading.RLock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._sync_timer = None
+        self._next_refresh = 0.0
+        self.users = self._load_users()
+
+    def __getitem__(self, username):
+        self._maybe_refresh()
+        return self.users[username]
+
+    def __iter__(self):
+        self._maybe_refresh()
+        return iter(list(self.users))
+
+    def __len__(self):
+        self._maybe_refresh()
+        return len(self.users)
+
+    def __contains__(self, username):
+        self._maybe_refresh()
+        return username in self.users
+
+    def get(self, username, default=None):
+        self._maybe_refresh()
+        return self.users.get(username, default)
+
+    def put(self, username, record):
+        """Store one user record"""
+        with self._locked():
+            self.users[username] = record
+            self._append({'op': 'put', 'user': username, 'record': record}, 1)
+
+    def put_many(self, records):
+        """Store several user records as one transaction"""
+        with self._locked():
+            self.users.update(records)
+            self._append({'op': 'batch', 'records': records}, len(records))
+
+    def add(self, username, record):
+        """Store a new user; False if the username is already taken"""
+        with self._locked():
+            if username in self.users:
+                return False
+            self.users[username] = record
+            self._append({'op': 'put', 'user': username, 'record': record}, 1)
+            return True
+
+    def add_many(self, records):
+        """Store new users as one transaction; returns the usernames already taken"""
+        with self._locked():
+            taken = [name for name in records if name in self.users]
+            fresh = {name: record for name, record in records.items() if name not in self.users}
+            if fresh:
+                self.users.update(fresh)
+                self._append({'op': 'batch', 'records': fresh}, len(fresh))
+            return taken
+
+    def compare_and_put(self, username, expected, record):
+        """Replace a record only if it still equals expected (no lost updates)"""
+        with self._locked():
+            if self.users.get(username) != expected:
+                return False
+            self.users[username] = record
+            self._append({'op': 'put', 'user': username, 'record': record}, 1)
+            return True
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access across threads and processes, caught up with the files"""
+        with self._thread_lock:
+            if fcntl is not None:
+                if self._lock_handle is None:
+                    self._lock_handle = open(self.lock_file, 'a')
+                fcntl.flock(self._lock_handle.fileno(), fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_handle.fileno(), fcntl.LOCK_UN)
+
+    def _maybe_refresh(self):
+        if self.refresh_interval <= 0 or time.monotonic() >= self._next_refresh:
+            self.refresh()
+            self._next_refresh = time.monotonic() + self.refresh_interval
+
+    def refresh(self):
+        """Pick up changes made by other processes, reading as little as possible"""
+        with self._thread_lock:
+            if file_signature(self.storage_file) != self._snapshot_signature:
+                # Compacted (or rewritten) elsewhere -> start over
+                self.users = self._load_users()
+                return
+            journal = file_signature(self.journal_file)
+            if journal is None or journal[0] != self._journal_inode or journal[1] < self._journal_offset:
+                if journal is not None or self._journal_inode is not None:
+                    self.users = self._load_users()
+            elif journal[1] > self._journal_offset:
+                self._read_journal_tail(self.users)
+
+    def _load_users(self):
+        """Load the snapshot, then replay the journal on top of it"""
+        self._snapshot_signature = file_signature(self.storage_file)
+        users = self._load_snapshot()
+        self._journal_inode = None
+        self._journal_offset = 0
+        self._journal_records = 0
+        self._read_journal_tail(users)
+        return users
+
+    def _load_snapshot(self):
+        try:
+            with open(self.storage_file, 'r') as f:
+                content = f.read()
+        except FileNotFoundError:
+            # No file yet -> start with empty dict
+            return {}
+        if not content.strip():
+            return {}
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError as e:
+            # Never start fresh here - that would silently wipe every user
+            raise ValueError(f"Corrupted user store '{self.storage_file}': {e}") from e
+
+    def _read_journal_tail(self, users):
+        """
+        Apply the complete journal lines past the last offset read.
+        A trailing line without its newline is either still being written
+        by another process or torn by a crash; it is left alone here and
+        cut off by the next writer (which holds the lock).
+        """
+        try:
+            f = open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            self._journal_inode = os.fstat(f.fileno()).st_ino
+            f.seek(self._journal_offset)
+            data = f.read()
+
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.split(b'\n'):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                raise ValueError(f"Corrupted journal '{self.journal_file}'") from None
+            if entry.get('op') == 'put':
+                users[entry['user']] = entry['record']
+                self._journal_records += 1
+            elif entry.get('op') == 'batch':
+                users.update(entry['records'])
+                self._journal_records += len(entry['records'])
+        self._journal_offset += len(complete)
+
+    def _save_users(self):
+        """Atomically write all users to the snapshot file"""
+        tmp_file = self.storage_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.users, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.storage_file)
+
+    def _append(self, entry, count):
+        """
+        Append one journal entry covering count user records (lock held).
+        Each entry is a single line, so a crash either keeps the whole
+        change or (as a torn last line) none of it.
+        """
+        if self._journal is not None and os.fstat(self._journal.fileno()).st_ino != self._journal_inode:
+            # Another process compacted and started a new journal file
+            self._journal.close()
+            self._journal = None
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'ab')
+            self._journal_inode = os.fstat(self._journal.fileno()).st_ino
+        if os.fstat(self._journal.fileno()).st_size > self._journal_offset:
+            # Torn line left behind by a crashed writer
+            self._journal.truncate(self._journal_offset)
+
+        line = (json.dumps(entry) + '\n').encode('utf-8')
+        self._journal.write(line)
+        self._journal.flush()
+        self._journal_offset += len(line)
+        self._journal_records += count
+        self._unsynced += count
+
+        if self._journal_records >= self.compact_every:
+            self._compact_locked()
+        elif self._unsynced >= self.sync_every or (
+                self.sync_interval is not None
+                and time.monotonic() - self._last_sync >= self.sync_interval):
+            self.sync()
+        elif self.sync_interval is not None and self._sync_timer is None:
+            # Bound how long these records can stay unsynced if writes stop here
+            delay = max(0.0, self.sync_interval - (time.monotonic() - self._last_sync))
+            self._sync_timer = threading.Timer(delay, self._timed_sync)
+            self._sync_timer.daemon = True
+            self._sync_timer.start()
+
+    def _timed_sync(self):
+        with self._thread_lock:
+            self._sync_timer = None
+            self.sync()
+
+    def sync(self):
+        """Force journaled changes to disk"""
+        with self._thread_lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            if self._journal is not None and self._unsynced:
+                os.fsync(self._journal.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def compact(self):
+        """Write a fresh snapshot and start an empty journal"""
+        with self._locked():
+            self._compact_locked()
+
+    def _compact_locked(self):
+        self._save_users()
+        # The snapshot already holds every journaled change, so a crash
+        # before the journal is replaced only replays harmless duplicates.
+        # The journal is swapped by rename (never truncated) so other
+        # processes notice the new inode instead of misreading offsets.
+        tmp_file = self.journal_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.journal_file)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_file, 'ab')
+        self._snapshot_signature = file_signature(self.storage_file)
+        self._journal_inode = os.fstat(self._journal.fileno()).st_ino
+        self._journal_offset = 0
+        self._journal_records = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """Sync and close the journal"""
+        with self._thread_lock:
+            self.sync()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if self._lock_handle is not None:
+                self._lock_handle.close()
+                self._lock_handle = None
+
+
+def file_signature(path):
+    """(inode, size, mtime) of path, or None if it cannot be stat'ed - cheap change detection"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def connect_sqlite(path):
+    """Connection to an SQLite file (created if missing) in WAL mode"""
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class SQLiteStore(Mapping):
+    # Constant SQL strings, so sqlite3's statement cache keeps them prepared
+    _GET = 'SELECT record FROM users WHERE username = ?'
+    _PUT = 'INSERT OR REPLACE INTO users (username, record) VALUES (?, ?)'
+    _ADD = 'INSERT OR IGNORE INTO users (username, record) VALUES (?, ?)'
+    _EXISTS = 'SELECT 1 FROM users WHERE username = ?'
+    _COUNT = 'SELECT COUNT(*) FROM users'
+    _NAMES = 'SELECT username FROM users ORDER BY username'
+
+    def __init__(self, path):
+        """path: SQLite database file (created if missing)"""
+        self.path = path
+        self.conn = connect_sqlite(path)
+        # username is the primary key -> every lookup is an index seek
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS users ('
+            'username TEXT PRIMARY KEY, record TEXT NOT NULL) WITHOUT ROWID'
+        )
+        self.conn.commit()
+
+    def __getitem__(self, username):
+        row = self.conn.execute(self._GET, (username,)).fetchone()
+        if row is None:
+            raise KeyError(username)
+        return json.loads(row[0])
+
+    def __contains__(self, username):
+        return self.conn.execute(self._EXISTS, (username,)).fetchone() is not None
+
+    def __iter__(self):
+        for (username,) in self.conn.execute(self._NAMES):
+            yield username
+
+    def __len__(self):
+        return self.conn.execute(self._COUNT).fetchone()[0]
+
+    def put(self, username, record):
+        """Store one user record"""
+        with self.conn:
+            self.conn.execute(self._PUT, (username, json.dumps(record)))
+
+    def put_many(self, records):
+        """Store several user records as one transaction"""
+        with self.conn:
+            self.conn.executemany(
+                self._PUT, ((name, json.dumps(record)) for name, record in records.items())
+            )
+
+    def add(self, username, record):
+        """Store a new user; False if the username is already taken"""
+        with self.conn:
+            cursor = self.conn.execute(self._ADD, (username, json.dumps(record)))
+        return cursor.rowcount == 1
+
+    def add_many(self, records):
+        """Store new users as one transaction; returns the usernames already taken"""
+        taken = []
+        with self.conn:
+            for name, record in records.items():
+                if self.conn.execute(self._ADD, (name, json.dumps(record))).rowcount != 1:
+                    taken.append(name)
+        return taken
+
+    def compare_and_put(self, username, expected, record):
+        """Replace a record only if it still equals expected (no lost updates)"""
+        with self.conn:
+            # Take the write lock before reading so nobody can sneak in between
+            self.conn.execute('BEGIN IMMEDIATE')
+            row = self.conn.execute(self._GET, (username,)).fetchone()
+            if row is None or json.loads(row[0]) != expected:
+                return False
+            self.conn.execute(self._PUT, (username, json.dumps(record)))
+            return True
+
+    def sync(self):
+        """Every put is already committed; nothing to do"""
+
+    def compact(self):
+        """Fold the WAL back into the main database file"""
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self):
+        self.conn.close()
+
+
+def open_store(storage_file, **json_options):
+    """Pick a backend from the file extension (.db/.sqlite -> SQLite, else JSON)"""
+    if storage_file.lower().endswith(SQLITE_EXTENSIONS):
+        return SQLiteStore(storage_file)
+    return JsonFileStore(storage_file, **json_options)
+
+
+def migrate_json_to_sqlite(json_path, sqlite_path):
+    """Copy every user from a passwords.json store (and its journal) into SQLite"""
+    source = JsonFileStore(json_path)
+    target = SQLiteStore(sqlite_path)
+    try:
+        target.put_many(dict(source.users))
+        return len(source)
+    finally:
+        source.close()
+        target.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python password_storage.py passwords.json passwords.db")
+        sys.exit(1)
+    count = migrate_json_to_sqlite(sys.argv[1], sys.argv[2])
+    print(f"Migrated {count} users from '{sys.argv[1]}' to '{sys.argv[2]}'")
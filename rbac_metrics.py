@@ -0,0 +1,125 @@
+# rbac_metrics.py
+"""
+Opt-in authorization metrics for RBACSystem.
+
+RBACSystem.enable_metrics() swaps traced versions of check_permission and
+can_access_file onto the instance; disable_metrics() removes them again, so
+an RBACSystem without metrics runs the plain methods with no extra cost.
+
+Counters are plain dict/list increments under the GIL; in the rare case two
+threads update the same counter at the same moment one increment can be
+lost, which is accepted to keep the traced path lock-free.
+"""
+import time
+
+
+# Upper bounds of the latency histogram buckets, in nanoseconds
+LATENCY_BUCKETS_NS = (250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 1000000)
+
+OPERATIONS = ('check_permission', 'can_access_file')
+
+
+class AuthzMetrics:
+    def __init__(self, sample_every=64):
+        """sample_every: time one call out of this many for the latency histogram"""
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1")
+        self.sample_every = sample_every
+        self._calls = 0
+        # permission -> [allowed, denied]
+        self.permission_counts = {}
+        # can_access_file outcome ('allow' or a deny reason) -> count
+        self.file_decisions = {}
+        # operation -> bucket counts (last one is +Inf), plus sum/count of samples
+        self.latency_buckets = {op: [0] * (len(LATENCY_BUCKETS_NS) + 1) for op in OPERATIONS}
+        self.latency_sum_ns = dict.fromkeys(OPERATIONS, 0)
+        self.latency_samples = dict.fromkeys(OPERATIONS, 0)
+
+    def should_sample(self):
+        self._calls += 1
+        return self._calls % self.sample_every == 0
+
+    def count_permission(self, permission, allowed):
+        counts = self.permission_counts.get(permission)
+        if counts is None:
+            counts = self.permission_counts[permission] = [0, 0]
+        counts[0 if allowed else 1] += 1
+
+    def count_file_decision(self, reason):
+        outcome = reason or 'allow'
+        self.file_decisions[outcome] = self.file_decisions.get(outcome, 0) + 1
+
+    def observe_latency(self, operation, elapsed_ns):
+        buckets = self.latency_buckets[operation]
+        for i, bound in enumerate(LATENCY_BUCKETS_NS):
+            if elapsed_ns <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+        self.latency_sum_ns[operation] += elapsed_ns
+        self.latency_samples[operation] += 1
+
+    def timed(self, operation, func, *args):
+        """Call func(*args), timing it if this call is sampled"""
+        if not self.should_sample():
+            return func(*args)
+        start = time.perf_counter_ns()
+        result = func(*args)
+        self.observe_latency(operation, time.perf_counter_ns() - start)
+        return result
+
+    def snapshot(self):
+        """Plain-dict copy of every metric"""
+        return {
+            'permissions': {
+                permission: {'allowed': counts[0], 'denied': counts[1]}
+                for permission, counts in self.permission_counts.items()
+            },
+            'file_decisions': dict(self.file_decisions),
+            'latency': {
+                op: {
+                    'buckets_ns': dict(zip(LATENCY_BUCKETS_NS + ('+Inf',), self.latency_buckets[op])),
+                    'sum_ns': self.latency_sum_ns[op],
+                    'samples': self.latency_samples[op],
+                }
+                for op in OPERATIONS
+            },
+            'sample_every': self.sample_every,
+        }
+
+    def prometheus_text(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = [
+            '# HELP rbac_permission_checks_total check_permission calls by permission and result.',
+            '# TYPE rbac_permission_checks_total counter',
+        ]
+        for permission, (allowed, denied) in sorted(self.permission_counts.items()):
+            label = _escape_label(permission)
+            lines.append(f'rbac_permission_checks_total{{permission="{label}",result="allow"}} {allowed}')
+            lines.append(f'rbac_permission_checks_total{{permission="{label}",result="deny"}} {denied}')
+
+        lines += [
+            '# HELP rbac_file_decisions_total can_access_file calls by outcome (allow or deny reason).',
+            '# TYPE rbac_file_decisions_total counter',
+        ]
+        for outcome, count in sorted(self.file_decisions.items()):
+            lines.append(f'rbac_file_decisions_total{{outcome="{outcome}"}} {count}')
+
+        lines += [
+            '# HELP rbac_decision_latency_seconds Sampled authorization latency.',
+            '# TYPE rbac_decision_latency_seconds histogram',
+        ]
+        for op in OPERATIONS:
+            cumulative = 0
+            bounds = [f'{bound / 1e9:.9g}' for bound in LATENCY_BUCKETS_NS] + ['+Inf']
+            for bound, count in zip(bounds, self.latency_buckets[op]):
+                cumulative += count
+                lines.append(f'rbac_decision_latency_seconds_bucket{{operation="{op}",le="{bound}"}} {cumulative}')
+            lines.append(f'rbac_decision_latency_seconds_sum{{operation="{op}"}} {self.latency_sum_ns[op] / 1e9:.9g}')
+            lines.append(f'rbac_decision_latency_seconds_count{{operation="{op}"}} {self.latency_samples[op]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
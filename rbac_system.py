@@ -1,36 +1,329 @@
 # rbac_system.py - STUDENT TO COMPLETE
+import sys
 import json
+import threading
+from functools import lru_cache, partial
+
+from password_storage import file_signature
+from rbac_metrics import AuthzMetrics
+from rbac_users import UserTable
+from resource_rules import ResourceMatcher
+
+
+# Resource rules used when the policy file does not define any
+DEFAULT_RESOURCE_RULES = [
+    {'pattern': 'public.txt', 'actions': {'read': 'read_public', 'write': 'edit_public'}},
+    {'pattern': '{user_id}_private.txt', 'actions': {'read': 'read_own', 'write': 'write_own'}},
+    {'pattern': 'admin_logs.txt', 'actions': {'read': 'delete_any', 'write': 'manage_users'}},
+]
+
+# Reasons a decision can deny access (None means allowed)
+DENY_UNKNOWN_USER = 'unknown_user'
+DENY_UNKNOWN_RESOURCE = 'unknown_resource'
+DENY_UNKNOWN_ACTION = 'unknown_action'
+DENY_MISSING_PERMISSION = 'missing_permission'
+DENY_NOT_OWNER = 'not_owner'
+
+DECISION_CACHE_SIZE = 65536
+# Denied items named in one batch audit record; the rest are only counted
+AUDIT_BATCH_SAMPLE = 20
+
+
+def _role_definition(definition):
+    """
+    Return (permissions, parents) for one role of a policy.
+    A role is either a plain list of permissions or a dict like
+    {"permissions": [...], "inherits": ["parent", ...]}.
+    """
+    if isinstance(definition, dict):
+        return definition.get('permissions', []), definition.get('inherits', [])
+    return definition, []
+
+
+def _validate_policy(roles, resources):
+    """Raise ValueError unless roles and resource rules have the shape the policy needs"""
+    def is_names(value):
+        return isinstance(value, list) and all(isinstance(name, str) for name in value)
+
+    for role, definition in roles.items():
+        if isinstance(definition, dict):
+            permissions, parents = _role_definition(definition)
+            if not is_names(permissions) or not is_names(parents):
+                raise ValueError(f"Role '{role}': permissions and inherits must be lists of names")
+        elif not is_names(definition):
+            raise ValueError(f"Role '{role}' must be a list of permissions or an object")
+    if not isinstance(resources, list):
+        raise ValueError("resources must be a list of rules")
+    for rule in resources:
+        if (not isinstance(rule, dict) or not isinstance(rule.get('pattern'), str)
+                or not isinstance(rule.get('actions'), dict)
+                or not all(isinstance(p, str) for p in rule['actions'].values())):
+            raise ValueError(f"Invalid resource rule: {rule!r}")
+
+
+class CompiledPolicy:
+    """
+    Query-optimised form of a role policy, built once and never mutated.
+    Every permission name gets an integer id (bit position) and every role
+    becomes a bitmask of its permissions - including everything inherited
+    from its parent roles - so a check is two dict lookups and one AND
+    instead of a scan over a list.
+    Resource rules are compiled into a ResourceMatcher, and resource
+    decisions are memoised per (role, path, action) in an LRU cache that
+    lives and dies with this policy.
+    version identifies the snapshot, so a decision can be tied back to the
+    policy that produced it.
+    """
+
+    __slots__ = ('version', 'permission_bits', 'role_masks', 'resources', 'decide')
+
+    def __init__(self, roles, resources=DEFAULT_RESOURCE_RULES, version=1,
+                 cache_size=DECISION_CACHE_SIZE):
+        self.version = version
+        permission_bits = {}
+        own_masks = {}
+        parents = {}
+        for role, definition in roles.items():
+            permissions, parents[role] = _role_definition(definition)
+            mask = 0
+            for permission in permissions:
+                permission = sys.intern(permission)
+                bit = permission_bits.get(permission)
+                if bit is None:
+                    bit = permission_bits[permission] = 1 << len(permission_bits)
+                mask |= bit
+            own_masks[role] = mask
+
+        self.permission_bits = permission_bits
+        self.role_masks = _inherited_masks(own_masks, parents)
+        self.resources = ResourceMatcher(resources)
+        self.decide = lru_cache(maxsize=cache_size)(self._decide)
+
+    def _decide(self, role, path, action):
+        """
+        Return (deny_reason, owner) for role doing action on path.
+        deny_reason is None when the role has the required permission;
+        owner is whoever the path's {user_id} placeholder captured (or None)
+        and does not depend on the caller, which keeps the result cacheable.
+        """
+        actions, owner = self.resources.match(path)
+        if actions is None:
+            return DENY_UNKNOWN_RESOURCE, None
+        required = actions.get(action)
+        if required is None:
+            return DENY_UNKNOWN_ACTION, owner
+        if not self.allows(role, required):
+            return DENY_MISSING_PERMISSION, owner
+        return None, owner
+
+    def allows(self, role, permission):
+        """True if role has permission"""
+        return bool(self.role_masks.get(role, 0) & self.permission_bits.get(permission, 0))
+
+    def permissions_of(self, role):
+        """Set of permission names granted to role"""
+        mask = self.role_masks.get(role, 0)
+        return frozenset(name for name, bit in self.permission_bits.items() if mask & bit)
+
+
+def _inherited_masks(own_masks, parents):
+    """
+    Transitive closure of role inheritance, computed once per policy.
+    Raises ValueError for unknown parents and inheritance cycles.
+    """
+    effective = {}
+    in_progress = []
+
+    def resolve(role):
+        if role in effective:
+            return effective[role]
+        if role in in_progress:
+            cycle = in_progress[in_progress.index(role):] + [role]
+            raise ValueError(f"Role inheritance cycle: {' -> '.join(cycle)}")
+        in_progress.append(role)
+        mask = own_masks[role]
+        for parent in parents[role]:
+            if parent not in own_masks:
+                raise ValueError(f"Role '{role}' inherits unknown role '{parent}'")
+            mask |= resolve(parent)
+        in_progress.pop()
+        effective[sys.intern(role)] = mask
+        return mask
+
+    for role in own_masks:
+        resolve(role)
+    return effective
+
+
+class _DenyBatch:
+    """Denial tally for one batch call, logged as a single audit record"""
+    __slots__ = ('checked', 'denied', 'reasons', 'sample')
+
+    def __init__(self):
+        self.checked = 0
+        self.denied = 0
+        self.reasons = {}
+        self.sample = []
+
+    def add(self, reason, item):
+        self.checked += 1
+        self.denied += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        if len(self.sample) < AUDIT_BATCH_SAMPLE:
+            self.sample.append(item)
 
 
 class RBACSystem:
-    def __init__(self, policy_file='rbac_policy.json'):
+    def __init__(self, policy_file='rbac_policy.json', audit=None):
+        """
+        policy_file: JSON roles (and optionally resources) to load
+        audit: AuditLog (see audit_log.py) that records every denied check
+        """
         self.policy_file = policy_file
-        self.roles = self._load_roles()
-        self.users = {}
+        self.audit = audit
+        self._policy_signature = file_signature(policy_file)
+        self.roles, self.resources = self._load_policy()
+        self.users = UserTable()
+        self.last_reload_error = None
+        # Reentrant: set_role holds it across recompile()
+        self._write_lock = threading.RLock()
+        self._watcher = None
+        self._policy = None
+        self.metrics = None
+        self.recompile()
+
+    def recompile(self):
+        """Rebuild the compiled policy - call after changing self.roles or self.resources"""
+        with self._write_lock:
+            self._publish(CompiledPolicy(self.roles, self.resources, self._next_version()))
+
+    def _next_version(self):
+        return 1 if self._policy is None else self._policy.version + 1
+
+    def _publish(self, policy):
+        # A single reference assignment: readers see either the old or the new
+        # snapshot, never a mix, and never need a lock
+        self._policy = policy
+
+    @property
+    def policy_version(self):
+        """Version of the policy snapshot currently in use"""
+        return self._policy.version
+
+    def reload(self):
+        """
+        Re-read policy_file and publish it as a new snapshot.
+        The new policy is compiled before it is swapped in; if the file is
+        missing or invalid (e.g. half written) the current policy stays in
+        place, last_reload_error says why and False is returned.
+        """
+        with self._write_lock:
+            signature = file_signature(self.policy_file)
+            try:
+                roles, resources = self._load_policy(strict=True)
+                policy = CompiledPolicy(roles, resources, self._next_version())
+            except (OSError, ValueError) as e:
+                self.last_reload_error = str(e)
+                return False
+            self.roles, self.resources = roles, resources
+            self._policy_signature = signature
+            self.last_reload_error = None
+            self._publish(policy)
+            return True
+
+    def start_watching(self, interval=1.0):
+        """Poll policy_file in a background thread and reload when it changes"""
+        if self._watcher is not None:
+            return
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._watch, args=(interval, stop), name='rbac-policy-watcher', daemon=True
+        )
+        self._watcher = (thread, stop)
+        thread.start()
+
+    def stop_watching(self):
+        """Stop the background watcher started by start_watching"""
+        if self._watcher is None:
+            return
+        thread, stop = self._watcher
+        stop.set()
+        thread.join()
+        self._watcher = None
+
+    def _watch(self, interval, stop):
+        while not stop.wait(interval):
+            signature = file_signature(self.policy_file)
+            if signature is not None and signature != self._policy_signature:
+                # A failed reload (e.g. file still being written) is retried next tick
+                try:
+                    self.reload()
+                except Exception as e:
+                    # Never let the watcher thread die - hot reload would stop for good
+                    self.last_reload_error = f'{type(e).__name__}: {e}'
 
-    def _load_roles(self):
+
+    def set_role(self, role, permissions, inherits=None):
+        """Create or replace a role and recompile the index"""
+        # Under the write lock, so a concurrent reload() cannot swap self.roles mid-edit
+        with self._write_lock:
+            previous = self.roles.get(role)
+            self.roles[role] = {'permissions': list(permissions), 'inherits': list(inherits or [])}
+            try:
+                self.recompile()
+            except ValueError:
+                # Keep the last good policy if the change would break it
+                if previous is None:
+                    del self.roles[role]
+                else:
+                    self.roles[role] = previous
+                raise
+
+    def effective_permissions(self, role):
+        """All permissions of role, including inherited ones"""
+        return self._policy.permissions_of(role)
+
+    def _load_policy(self, strict=False):
+        """
+        Load (roles, resource rules) from the policy file.
+        The file is either just the roles dict, or
+        {"roles": {...}, "resources": [{"pattern": ..., "actions": {...}}, ...]}.
+        strict: raise instead of falling back to the defaults
+        """
+        roles = self._load_roles(strict)
+        if isinstance(roles.get('roles'), dict):
+            roles, resources = roles['roles'], roles.get('resources', DEFAULT_RESOURCE_RULES)
+        else:
+            resources = DEFAULT_RESOURCE_RULES
+        if strict:
+            _validate_policy(roles, resources)
+        return roles, resources
+
+    def _load_roles(self, strict=False):
         """Load roles and permissions from policy file"""
-        # Default roles if file doesn't exist
+        # Default roles if file doesn't exist - each role builds on the one before
         default_roles = {
             'guest': ['read_public'],
-            'user': ['read_public', 'write_own', 'read_own'],
-            'editor': ['read_public', 'write_own', 'read_own', 'edit_public'],
-            'admin': [
-                'read_public', 'write_own', 'read_own',
-                'edit_public', 'delete_any', 'manage_users'
-            ]
+            'user': {'permissions': ['write_own', 'read_own'], 'inherits': ['guest']},
+            'editor': {'permissions': ['edit_public'], 'inherits': ['user']},
+            'admin': {'permissions': ['delete_any', 'manage_users'], 'inherits': ['editor']}
         }
 
         # Try to load from file, use defaults if file not found or invalid
         try:
             with open(self.policy_file, 'r') as f:
                 data = json.load(f)
-                # Expecting a dict like default_roles
+                # Expecting a dict like default_roles (lists or
+                # {"permissions": [...], "inherits": [...]} per role)
                 if isinstance(data, dict):
                     return data
+                elif strict:
+                    raise ValueError(f"Policy file '{self.policy_file}' must contain an object")
                 else:
                     return default_roles
         except (FileNotFoundError, json.JSONDecodeError):
+            if strict:
+                raise
             return default_roles
 
     def add_user(self, user_id, role='user'):
@@ -42,46 +335,226 @@ class RBACSystem:
         # Add user to users dictionary
         self.users[user_id] = role
 
+    def add_users(self, records):
+        """
+        Add many (user_id, role) pairs at once.
+        Every role is validated before any user is added; returns the count.
+        """
+        records = list(records)
+        unknown = {role for _, role in records if role not in self.roles}
+        if unknown:
+            raise ValueError(f"Unknown role: {', '.join(sorted(unknown))}")
+        return self.users.add_many(records)
+
     def check_permission(self, user_id, permission):
         """Check if user has specific permission"""
         # Find user's role
         role = self.users.get(user_id)
         if role is None:
+            if self.audit is not None:
+                self._audit_deny(user_id, DENY_UNKNOWN_USER, permission=permission)
             return False
 
-        # Check if permission exists in role's permissions
-        permissions = self.roles.get(role, [])
-        return permission in permissions
+        # Check the role's bitmask for the permission's bit
+        policy = self._policy
+        if policy.role_masks.get(role, 0) & policy.permission_bits.get(permission, 0):
+            return True
+        if self.audit is not None:
+            self._audit_deny(user_id, DENY_MISSING_PERMISSION, permission=permission)
+        return False
 
     def can_access_file(self, user_id, filename, action='read'):
         """Check if user can perform action on file"""
-        # Define file types and required permissions
-        file_permissions = {
-            'public.txt': {'read': 'read_public', 'write': 'edit_public'},
-            f'{user_id}_private.txt': {'read': 'read_own', 'write': 'write_own'},
-            'admin_logs.txt': {'read': 'delete_any', 'write': 'manage_users'}
-        }
-
-        # Determine required permission for this file/action
-        perms_for_file = file_permissions.get(filename)
-        if not perms_for_file:
-            # Unknown file -> deny by default
+        # Find user's role
+        role = self.users.get(user_id)
+        if role is None:
+            if self.audit is not None:
+                self._audit_deny(user_id, DENY_UNKNOWN_USER, path=filename, action=action)
             return False
 
-        required_perm = perms_for_file.get(action)
-        if not required_perm:
-            return False
+        # Most specific resource rule -> required permission -> role check.
+        # Unknown files and actions are denied by default, and paths owned
+        # through a {user_id} placeholder only let their owner in.
+        reason, owner = self._policy.decide(role, filename, action)
+        if reason is None and (owner is None or owner == user_id):
+            return True
+        if self.audit is not None:
+            self._audit_deny(user_id, reason or DENY_NOT_OWNER, path=filename, action=action)
+        return False
+
+    def _audit_deny(self, user_id, reason, **fields):
+        self.audit.log('access_denied', user_id=user_id, reason=reason,
+                       policy_version=self._policy.version, **fields)
+
+    def explain_access(self, user_id, filename, action='read'):
+        """
+        Like can_access_file, but returns the full decision:
+        {'allowed': bool, 'reason': deny reason or None, 'policy_version': int}
+        """
+        reason, policy = self._file_decision(user_id, filename, action)
+        return {'allowed': reason is None, 'reason': reason, 'policy_version': policy.version}
+
+    def _file_decision(self, user_id, filename, action):
+        """(deny reason or None, policy snapshot that decided)"""
+        policy = self._policy
+        return self._path_reason(policy, user_id, filename, action), policy
+
+    def enable_metrics(self, metrics=None, sample_every=64):
+        """
+        Start counting check_permission and can_access_file decisions.
+        Traced versions of both methods are put on this instance only, so
+        nothing changes for the normal code path until this is called.
+        Returns the AuthzMetrics collecting the data.
+        """
+        metrics = metrics if metrics is not None else AuthzMetrics(sample_every)
+        self.metrics = metrics
+        # Bind the collector, so calls racing with disable_metrics stay valid
+        self.check_permission = partial(self._traced_check_permission, metrics)
+        self.can_access_file = partial(self._traced_can_access_file, metrics)
+        return metrics
+
+    def disable_metrics(self):
+        """Go back to the untraced methods; returns the metrics collected so far"""
+        metrics, self.metrics = self.metrics, None
+        self.__dict__.pop('check_permission', None)
+        self.__dict__.pop('can_access_file', None)
+        return metrics
 
-        # Use check_permission to verify
-        return self.check_permission(user_id, required_perm)
+    def _traced_check_permission(self, metrics, user_id, permission):
+        allowed = metrics.timed(
+            'check_permission', RBACSystem.check_permission, self, user_id, permission
+        )
+        metrics.count_permission(permission, allowed)
+        return allowed
+
+    def _traced_can_access_file(self, metrics, user_id, filename, action='read'):
+        reason, _ = metrics.timed('can_access_file', self._file_decision, user_id, filename, action)
+        metrics.count_file_decision(reason)
+        if reason is not None and self.audit is not None:
+            self._audit_deny(user_id, reason, path=filename, action=action)
+        return reason is None
+
+    def filter_accessible(self, user_id, paths, action='read'):
+        """
+        Yield the paths from an iterable that user may perform action on.
+        The role and the policy are resolved once for the whole listing, and
+        every path goes through the shared (role, path, action) decision
+        cache, so large listings stream through without per-call overhead.
+        With an audit log, one access_denied_batch record summarises the
+        denials once the listing is exhausted or closed.
+        """
+        if self.audit is not None:
+            return self._audited_filter(user_id, paths, action)
+        allowed = self._access_checker(user_id, action)
+        return (path for path in paths if allowed(path))
+
+    def _audited_filter(self, user_id, paths, action):
+        policy = self._policy
+        batch = _DenyBatch()
+        try:
+            for path in paths:
+                reason = self._path_reason(policy, user_id, path, action)
+                if reason is None:
+                    batch.checked += 1
+                    yield path
+                else:
+                    batch.add(reason, path)
+        finally:
+            self._audit_batch(batch, policy, user_id=user_id, action=action)
+
+    def access_mask(self, user_id, paths, action='read'):
+        """
+        List of booleans, one per path: can user perform action on it?
+        With an audit log, denials go into one access_denied_batch record.
+        """
+        if self.audit is None:
+            allowed = self._access_checker(user_id, action)
+            return [allowed(path) for path in paths]
+        policy = self._policy
+        batch = _DenyBatch()
+        mask = []
+        for path in paths:
+            reason = self._path_reason(policy, user_id, path, action)
+            if reason is None:
+                batch.checked += 1
+            else:
+                batch.add(reason, path)
+            mask.append(reason is None)
+        self._audit_batch(batch, policy, user_id=user_id, action=action)
+        return mask
+
+    def _path_reason(self, policy, user_id, path, action):
+        """Deny reason for one path (None = allowed), same rules as can_access_file"""
+        role = self.users.get(user_id)
+        if role is None:
+            return DENY_UNKNOWN_USER
+        reason, owner = policy.decide(role, path, action)
+        if reason is None and owner is not None and owner != user_id:
+            return DENY_NOT_OWNER
+        return reason
+
+    def _audit_batch(self, batch, policy, **fields):
+        if batch.denied:
+            self.audit.log('access_denied_batch', checked=batch.checked, denied=batch.denied,
+                           reasons=batch.reasons, sample=batch.sample,
+                           policy_version=policy.version, **fields)
+
+    def _access_checker(self, user_id, action):
+        """One-argument path check with the user's role and the policy bound"""
+        role = self.users.get(user_id)
+        if role is None:
+            return lambda path: False
+        decide = self._policy.decide
+
+        def allowed(path):
+            reason, owner = decide(role, path, action)
+            return reason is None and (owner is None or owner == user_id)
+        return allowed
+
+    def check_many(self, user_ids, permissions):
+        """
+        Check every permission for every user in one call.
+        Returns one row per user (in order) with one boolean per permission.
+        With an audit log, denials go into one access_denied_batch record,
+        sampled as [user_id, permission] pairs.
+        """
+        policy = self._policy
+        permissions = list(permissions)
+        bits = [policy.permission_bits.get(permission, 0) for permission in permissions]
+        batch = _DenyBatch() if self.audit is not None else None
+        rows = []
+        for user_id in user_ids:
+            role = self.users.get(user_id)
+            mask = policy.role_masks.get(role, 0)
+            row = [bool(mask & bit) for bit in bits]
+            rows.append(row)
+            if batch is not None:
+                reason = DENY_UNKNOWN_USER if role is None else DENY_MISSING_PERMISSION
+                for permission, allowed in zip(permissions, row):
+                    if allowed:
+                        batch.checked += 1
+                    else:
+                        batch.add(reason, [user_id, permission])
+        if batch is not None:
+            self._audit_batch(batch, policy)
+        return rows
 
     def list_users(self):
         """List all users and their roles"""
-        # Return formatted list of users
-        lines = []
-        for user_id, role in self.users.items():
-            lines.append(f"{user_id}: {role}")
-        return "\n".join(lines)
+        # Return formatted list of users - for large tables use
+        # iter_users or list_users_page instead of building one string
+        return "\n".join(f"{user_id}: {role}" for user_id, role in self.iter_users())
+
+    def iter_users(self, role=None):
+        """Yield (user_id, role) pairs, optionally only for one role"""
+        return self.users.iter_users(role)
+
+    def list_users_page(self, cursor=0, limit=1000, role=None):
+        """
+        One page of users: returns (items, next_cursor), where items is a list
+        of (user_id, role) pairs and next_cursor is None after the last page.
+        """
+        return self.users.page(cursor, limit, role)
 
 
 # Sample data to test with
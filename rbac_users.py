@@ -0,0 +1,128 @@
+# rbac_users.py
+"""
+User -> role table for RBACSystem, with insertion-ordered cursor paging.
+
+Role names are interned to small integer codes, so a million users of four
+roles share four role strings, and each user's value is a cached small int
+(a role's code object is reused for every user of that role even past 256).
+Per user that is one dict slot, like a plain {user_id: role} dict, plus one
+slot in the order list that paging needs.
+
+A cursor is a position in the order list. Removing a user only drops it
+from the dict (O(1)); its stale entry stays in the list and is skipped, so
+cursors held by other callers stay valid. compact() drops the stale entries
+(and invalidates outstanding cursors); re-adding a removed user compacts
+first, so nobody is listed twice.
+"""
+import sys
+from collections.abc import MutableMapping
+
+
+class UserTable(MutableMapping):
+    __slots__ = ('_codes', '_order', '_role_codes', '_role_names', '_stale')
+
+    def __init__(self, users=None):
+        self._codes = {}        # user_id -> role code
+        self._order = []        # user_ids in insertion order, including removed ones
+        self._role_codes = {}   # role name -> code
+        self._role_names = []   # code -> role name
+        self._stale = set()     # removed user_ids still in _order
+        if users:
+            self.add_many(users.items() if hasattr(users, 'items') else users)
+
+    def role_code(self, role):
+        """Small integer code for role, allocated on first use"""
+        code = self._role_codes.get(role)
+        if code is None:
+            role = sys.intern(role)
+            code = self._role_codes[role] = len(self._role_names)
+            self._role_names.append(role)
+        return code
+
+    # Mapping interface - values are role names
+
+    def get(self, user_id, default=None):
+        code = self._codes.get(user_id)
+        return default if code is None else self._role_names[code]
+
+    def __getitem__(self, user_id):
+        return self._role_names[self._codes[user_id]]
+
+    def __setitem__(self, user_id, role):
+        code = self.role_code(role)
+        if user_id not in self._codes:
+            if user_id in self._stale:
+                self.compact()
+            self._order.append(user_id)
+        self._codes[user_id] = code
+
+    def __delitem__(self, user_id):
+        del self._codes[user_id]
+        self._stale.add(user_id)
+
+    def __contains__(self, user_id):
+        return user_id in self._codes
+
+    def __iter__(self):
+        codes = self._codes
+        return (user_id for user_id in self._order if user_id in codes)
+
+    def __len__(self):
+        return len(self._codes)
+
+    def add_many(self, pairs):
+        """Insert or update (user_id, role) pairs; returns how many were given"""
+        codes, role_code = self._codes, self.role_code
+        count = 0
+        for user_id, role in pairs:
+            code = role_code(role)
+            if user_id not in codes:
+                if user_id in self._stale:
+                    self.compact()
+                self._order.append(user_id)
+            codes[user_id] = code
+            count += 1
+        return count
+
+    def iter_users(self, role=None, start=0):
+        """Yield (user_id, role) in insertion order, optionally for one role only"""
+        for _, user_id, role_name in self._scan(start, role):
+            yield user_id, role_name
+
+    def page(self, cursor=0, limit=1000, role=None):
+        """
+        Return (items, next_cursor): up to limit (user_id, role) pairs from
+        cursor on. next_cursor is None once the table has been read to the end.
+        """
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        items = []
+        for position, user_id, role_name in self._scan(cursor, role):
+            items.append((user_id, role_name))
+            if len(items) == limit:
+                next_cursor = position + 1
+                return items, next_cursor if next_cursor < len(self._order) else None
+        return items, None
+
+    def _scan(self, start, role):
+        """(position, user_id, role) for live users from position start on"""
+        wanted = None
+        if role is not None:
+            wanted = self._role_codes.get(role)
+            if wanted is None:
+                return
+        codes, names, order = self._codes, self._role_names, self._order
+        for position in range(start, len(order)):
+            user_id = order[position]
+            code = codes.get(user_id)
+            if code is None:
+                continue
+            if wanted is None or code == wanted:
+                yield position, user_id, names[code]
+
+    def compact(self):
+        """Drop stale entries left by removed users (outstanding cursors become invalid)"""
+        if self._stale:
+            codes = self._codes
+            self._order = [user_id for user_id in self._order if user_id in codes]
+            self._stale = set()
@@ -0,0 +1,212 @@
+# resource_rules.py
+"""
+Path-pattern matching for RBAC resource rules.
+
+A rule maps a path pattern to the permission each action needs:
+
+    {"pattern": "projects/*/reports/**", "actions": {"read": "read_reports"}}
+
+Patterns are split on "/" and compiled into a trie of segments:
+- a literal segment ("reports") is a dict lookup
+- "*" matches exactly one segment, "**" matches zero or more segments
+- any other segment may use fnmatch-style wildcards (*, ?, [...]) and the
+  {user_id} placeholder, e.g. "{user_id}_private.txt". These are bucketed by
+  their literal prefix ("app42-" for "app42-*.log"), so a path segment is
+  only run against the few patterns it could match, however many rules
+  share the node
+
+When several rules match, the most specific one wins: comparing segment by
+segment from the left, a literal beats a wildcard segment, which beats "*",
+which beats "**". A {user_id} placeholder captures the owner of the path;
+the caller decides what to do with it (RBACSystem only lets the owner in).
+"""
+import re
+
+
+USER_PLACEHOLDER = '{user_id}'
+_WILDCARD_CHARS = set('*?[')
+
+
+class _Node:
+    __slots__ = ('literal', 'patterns', 'buckets', 'prefix_lengths', 'star', 'globstar', 'rule')
+
+    def __init__(self):
+        self.literal = {}
+        # segment -> (specificity, regex, child) while building, then a
+        # tuple of (specificity, regex, child) sorted most specific first
+        self.patterns = {}
+        # literal prefix -> ((rank, regex, child), ...): a segment is only tried
+        # against the patterns whose prefix it starts with
+        self.buckets = {}
+        self.prefix_lengths = ()
+        self.star = None
+        self.globstar = None
+        self.rule = None
+
+
+def _literal_prefix(segment):
+    """The characters of a pattern segment before its first wildcard or placeholder"""
+    end = len(segment)
+    for marker in ('*', '?', '[', USER_PLACEHOLDER):
+        position = segment.find(marker)
+        if position != -1:
+            end = min(end, position)
+    return segment[:end]
+
+
+def _compile_segment(segment):
+    """Regex for one wildcard/placeholder segment; owner captured as 'owner'"""
+    parts = []
+    placeholder_seen = False
+    i = 0
+    while i < len(segment):
+        if segment.startswith(USER_PLACEHOLDER, i):
+            if placeholder_seen:
+                parts.append('(?P=owner)')
+            else:
+                parts.append('(?P<owner>[^/]+)')
+                placeholder_seen = True
+            i += len(USER_PLACEHOLDER)
+            continue
+        char = segment[i]
+        if char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif char == '[':
+            end = segment.find(']', i + 1)
+            if end == -1:
+                parts.append(re.escape(char))
+            else:
+                body = segment[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                parts.append(f'[{body}]')
+                i = end
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return re.compile(''.join(parts))
+
+
+class ResourceMatcher:
+    def __init__(self, rules):
+        """
+        rules: list of {"pattern": ..., "actions": {action: permission}}
+        The matcher is built once and not changed afterwards.
+        """
+        self.root = _Node()
+        self.rule_count = 0
+        for rule in rules:
+            self._add(rule['pattern'], rule.get('actions', {}))
+        self._finish(self.root)
+
+    def _finish(self, node):
+        """Freeze the pattern segments of every node in priority order"""
+        ordered = sorted(node.patterns.items(), key=lambda item: -item[1][0])
+        buckets = {}
+        for rank, (segment, (_, regex, child)) in enumerate(ordered):
+            buckets.setdefault(_literal_prefix(segment), []).append((rank, regex, child))
+        node.buckets = {prefix: tuple(bucket) for prefix, bucket in buckets.items()}
+        node.prefix_lengths = tuple(sorted({len(prefix) for prefix in buckets}))
+        ordered = [item for _, item in ordered]
+        node.patterns = tuple(ordered)
+        children = list(node.literal.values()) + [item[2] for item in ordered]
+        children += [child for child in (node.star, node.globstar) if child is not None]
+        for child in children:
+            self._finish(child)
+
+    def _add(self, pattern, actions):
+        node = self.root
+        for segment in pattern.split('/'):
+            node = self._child(node, segment)
+        # The first rule for an identical pattern wins
+        if node.rule is None:
+            node.rule = dict(actions)
+            self.rule_count += 1
+
+    def _child(self, node, segment):
+        if segment == '**':
+            if node.globstar is None:
+                node.globstar = _Node()
+            return node.globstar
+        if segment == '*':
+            if node.star is None:
+                node.star = _Node()
+            return node.star
+        if USER_PLACEHOLDER not in segment and not _WILDCARD_CHARS & set(segment):
+            child = node.literal.get(segment)
+            if child is None:
+                child = node.literal[segment] = _Node()
+            return child
+
+        existing = node.patterns.get(segment)
+        if existing is not None:
+            return existing[2]
+        child = _Node()
+        # More literal characters -> more specific
+        specificity = len(segment.replace(USER_PLACEHOLDER, '')) - sum(segment.count(c) for c in '*?[')
+        node.patterns[segment] = (specificity, _compile_segment(segment), child)
+        return child
+
+    def match(self, path):
+        """
+        Return (actions, owner) of the most specific rule matching path,
+        or (None, None). owner is the value captured by {user_id}, if any.
+        """
+        result = self._match(self.root, path.split('/'), 0, None)
+        return result if result is not None else (None, None)
+
+    def _match(self, node, segments, index, owner):
+        if index == len(segments):
+            if node.rule is not None:
+                return node.rule, owner
+            # A trailing "**" may match zero segments
+            if node.globstar is not None and node.globstar.rule is not None:
+                return node.globstar.rule, owner
+            return None
+
+        segment = segments[index]
+        child = node.literal.get(segment)
+        if child is not None:
+            found = self._match(child, segments, index + 1, owner)
+            if found is not None:
+                return found
+
+        for _, regex, child in self._candidates(node, segment):
+            matched = regex.fullmatch(segment)
+            if matched is None:
+                continue
+            captured = matched.groupdict().get('owner')
+            if captured is not None and owner is not None and captured != owner:
+                continue
+            found = self._match(child, segments, index + 1, captured or owner)
+            if found is not None:
+                return found
+
+        if node.star is not None:
+            found = self._match(node.star, segments, index + 1, owner)
+            if found is not None:
+                return found
+
+        if node.globstar is not None:
+            for next_index in range(index, len(segments) + 1):
+                found = self._match(node.globstar, segments, next_index, owner)
+                if found is not None:
+                    return found
+        return None
+
+    @staticmethod
+    def _candidates(node, segment):
+        """The node's patterns whose literal prefix segment starts with, most specific first"""
+        candidates = []
+        buckets = node.buckets
+        for length in node.prefix_lengths:
+            if length > len(segment):
+                break
+            bucket = buckets.get(segment[:length])
+            if bucket is not None:
+                candidates.extend(bucket)
+        if len(candidates) > 1:
+            candidates.sort(key=lambda candidate: candidate[0])
+        return candidates
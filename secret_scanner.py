@@ -0,0 +1,272 @@
+# secret_scanner.py
+"""
+Scan directory trees for plaintext secrets.
+
+Every file is memory-mapped and searched window by window: each window is
+chunk_size bytes plus an overlap, so a secret straddling two windows is still
+found while the pages already scanned can be dropped again. All signatures
+are compiled into one regex alternation, so each byte is looked at by a
+single pass of the regex engine, whatever the number of signatures.
+
+Files are scanned on a pool of workers ("process" by default - the regex
+engine holds the GIL). With a cache_file, results are remembered per file
+under its (inode, size, mtime) signature, so a rescan only reads files that
+changed since the last run.
+
+Findings never contain the secret itself, only its kind, offset and a
+redacted preview.
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import stat
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from file_encryptor import balanced_batches
+
+
+# name -> regex (bytes). Lengths are bounded so a match never outgrows the overlap.
+DEFAULT_PATTERNS = {
+    # Bare SHA-256 digests, e.g. unsalted password hashes
+    'sha256_hex': rb'(?<![0-9A-Fa-f])[0-9A-Fa-f]{64}(?![0-9A-Fa-f])',
+    'password_assignment': (
+        rb'(?i:(?:password|passwd|pwd|secret|api[_-]?key|access[_-]?token)\b)'
+        rb'["\']?\s{0,8}[:=]\s{0,8}["\']?[^\s"\'<>,;]{4,256}'
+    ),
+    'private_key': rb'-----BEGIN (?:RSA |EC |DSA |OPENSSH |PGP |ENCRYPTED )?PRIVATE KEY-----',
+    'aws_access_key': rb'\b(?:AKIA|ASIA)[0-9A-Z]{16}\b',
+    'github_token': rb'\bgh[pousr]_[A-Za-z0-9]{36,255}\b',
+    'slack_token': rb'\bxox[abprs]-[A-Za-z0-9-]{10,200}',
+    'jwt': rb'\beyJ[A-Za-z0-9_-]{8,1024}\.eyJ[A-Za-z0-9_-]{8,1024}\.[A-Za-z0-9_-]{8,1024}',
+}
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+# Must be longer than the longest possible match
+DEFAULT_OVERLAP = 4096
+MAX_FINDINGS_PER_FILE = 100
+DEFAULT_EXCLUDE_DIRS = frozenset({'.git', '.hg', '.svn', '__pycache__', 'node_modules'})
+CACHE_VERSION = 1
+
+
+def compile_patterns(patterns=None):
+    """One regex with a named group per signature"""
+    patterns = patterns or DEFAULT_PATTERNS
+    return re.compile(b'|'.join(
+        b'(?P<%s>%s)' % (name.encode('ascii'), regex) for name, regex in patterns.items()
+    ))
+
+
+def _redact(secret):
+    """Enough to recognise a finding, not enough to use it"""
+    text = secret[:4].decode('ascii', 'replace')
+    return f'{text}...({len(secret)} bytes)'
+
+
+def scan_file(path, regex, chunk_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_OVERLAP,
+              max_findings=MAX_FINDINGS_PER_FILE):
+    """
+    Return the findings in one file as a list of {'kind', 'offset', 'preview'}.
+    The file is mmap-scanned in windows of chunk_size + overlap bytes.
+    """
+    findings = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return findings
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            for start in range(0, size, chunk_size):
+                chunk_end = min(start + chunk_size, size)
+                window_end = min(chunk_end + overlap, size)
+                for match in regex.finditer(mm, start, window_end):
+                    # Matches starting in the overlap belong to the next window,
+                    # and one touching a cut-off window end may be incomplete
+                    if match.start() >= chunk_end:
+                        break
+                    if match.end() == window_end and window_end != size:
+                        continue
+                    findings.append({
+                        'kind': match.lastgroup,
+                        'offset': match.start(),
+                        'preview': _redact(match.group()),
+                    })
+                    if len(findings) >= max_findings:
+                        return findings
+                if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+                    # Done with this window - let the kernel reclaim its pages
+                    page_start = start - start % mmap.PAGESIZE
+                    mm.madvise(mmap.MADV_DONTNEED, page_start, chunk_end - page_start)
+    return findings
+
+
+def _job_size(job):
+    """job = (path, (inode, size, mtime_ns))"""
+    return job[1][1]
+
+
+def _scan_batch(regex, chunk_size, overlap, max_findings, batch):
+    """Worker entry point for SecretScanner.scan: scan one batch of files"""
+    results = []
+    for path, signature in batch:
+        result = {'path': path, 'signature': signature, 'findings': [], 'error': None}
+        try:
+            result['findings'] = scan_file(path, regex, chunk_size, overlap, max_findings)
+        except (OSError, ValueError) as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        results.append(result)
+    return results
+
+
+class SecretScanner:
+    def __init__(self, patterns=None, chunk_size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_OVERLAP,
+                 workers=None, executor='process', cache_file=None,
+                 max_findings=MAX_FINDINGS_PER_FILE, exclude_dirs=DEFAULT_EXCLUDE_DIRS):
+        """
+        patterns: {name: bytes regex}, DEFAULT_PATTERNS if None
+        chunk_size, overlap: mmap window size and how far windows overlap
+        workers, executor: pool size and kind ("process" or "thread")
+        cache_file: JSON file with the results of earlier scans (optional)
+        """
+        if executor not in ('process', 'thread'):
+            raise ValueError(f"Unknown executor: {executor}")
+        patterns = patterns or DEFAULT_PATTERNS
+        self.regex = compile_patterns(patterns)
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = executor
+        self.cache_file = cache_file
+        self.max_findings = max_findings
+        self.exclude_dirs = frozenset(exclude_dirs)
+        # Cached results are only valid for the same signatures
+        self._rules_id = hashlib.sha256(
+            json.dumps(sorted((k, v.decode('latin-1')) for k, v in patterns.items())).encode()
+        ).hexdigest()
+
+    def _collect(self, roots):
+        """(path, (inode, size, mtime_ns)) for every regular file under roots"""
+        files = []
+        for root in roots:
+            if os.path.isfile(root):
+                walk = [(os.path.dirname(root), [], [os.path.basename(root)])]
+            else:
+                walk = os.walk(root)
+            for dirpath, dirnames, filenames in walk:
+                dirnames[:] = [name for name in dirnames if name not in self.exclude_dirs]
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.lstat(path)
+                    except OSError:
+                        continue
+                    if stat.S_ISREG(st.st_mode):
+                        files.append((path, (st.st_ino, st.st_size, st.st_mtime_ns)))
+        return files
+
+    def _load_cache(self):
+        if not self.cache_file:
+            return {}
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if data.get('version') != CACHE_VERSION or data.get('rules') != self._rules_id:
+            return {}
+        return data.get('files', {})
+
+    def _save_cache(self, entries):
+        tmp_path = self.cache_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'rules': self._rules_id, 'files': entries}, f)
+        os.replace(tmp_path, self.cache_file)
+
+    def scan(self, roots):
+        """
+        Scan files and directory trees; returns the JSON-ready report:
+        {'findings': [{'path', 'kind', 'offset', 'preview'}], 'errors': [...],
+         'files_scanned', 'files_cached', 'bytes_scanned', 'seconds'}
+        """
+        if isinstance(roots, (str, os.PathLike)):
+            roots = [roots]
+        start = time.perf_counter()
+        files = self._collect(roots)
+        cache = self._load_cache()
+
+        # 1. Reuse the results of files that have not changed
+        results = []
+        jobs = []
+        for path, signature in files:
+            entry = cache.get(path)
+            if entry is not None and tuple(entry['signature']) == signature:
+                results.append({'path': path, 'signature': signature,
+                                'findings': entry['findings'], 'error': None})
+            else:
+                jobs.append((path, signature))
+        cached_count = len(results)
+
+        # 2. Scan the rest on the worker pool
+        if jobs:
+            pool_class = ProcessPoolExecutor if self.executor == 'process' else ThreadPoolExecutor
+            with pool_class(max_workers=self.workers) as pool:
+                futures = [
+                    pool.submit(_scan_batch, self.regex, self.chunk_size, self.overlap,
+                                self.max_findings, batch)
+                    for batch in balanced_batches(jobs, self.workers, size_of=_job_size)
+                ]
+                for future in as_completed(futures):
+                    results.extend(future.result())
+
+        # 3. Remember what was scanned (files that failed are retried next time)
+        if self.cache_file:
+            self._save_cache({
+                result['path']: {'signature': list(result['signature']), 'findings': result['findings']}
+                for result in results if result['error'] is None
+            })
+
+        results.sort(key=lambda result: result['path'])
+        return {
+            'roots': [os.fspath(root) for root in roots],
+            'findings': [
+                dict(finding, path=result['path'])
+                for result in results for finding in result['findings']
+            ],
+            'errors': [
+                {'path': result['path'], 'error': result['error']}
+                for result in results if result['error'] is not None
+            ],
+            'files_scanned': len(jobs),
+            'files_cached': cached_count,
+            'bytes_scanned': sum(signature[1] for _, signature in jobs),
+            'seconds': time.perf_counter() - start,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan files and directories for plaintext secrets.")
+    parser.add_argument('roots', nargs='+', help="files or directories to scan")
+    parser.add_argument('--cache', help="incremental cache file (rescans skip unchanged files)")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--workers', type=int, help="worker count (default: CPU count)")
+    parser.add_argument('--executor', choices=('process', 'thread'), default='process')
+    args = parser.parse_args(argv)
+
+    scanner = SecretScanner(workers=args.workers, executor=args.executor, cache_file=args.cache)
+    report = scanner.scan(args.roots)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 1 if report['findings'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
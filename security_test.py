@@ -1,22 +1,25 @@
 # security_tests.py
 import os
 
+from secret_scanner import SecretScanner
 
-def run_security_tests():
+
+def run_security_tests(scan_root='.'):
     print("SECURITY VULNERABILITY TESTS")
     print("=" * 60)
 
-    # Test 1: Check for plaintext passwords
-    print("\nTest 1: Searching for plaintext passwords in files...")
-    files_to_check = ['passwords.json', 'test_passwords.json']
-    for file in files_to_check:
-        if os.path.exists(file):
-            with open(file, 'r', encoding="utf-8") as f:
-                content = f.read()
-            if 'password' in content.lower():
-                print(f" WARNING: '{file}' may contain plaintext passwords")
-            else:
-                print(f" ✓ '{file}' appears safe")
+    # Test 1: Check for plaintext passwords and other secrets
+    print("\nTest 1: Searching for plaintext secrets in files...")
+    report = SecretScanner(executor='thread').scan(scan_root)
+    flagged = {}
+    for finding in report['findings']:
+        flagged.setdefault(finding['path'], set()).add(finding['kind'])
+    for file, kinds in sorted(flagged.items()):
+        print(f" WARNING: '{file}' may contain secrets ({', '.join(sorted(kinds))})")
+    for error in report['errors']:
+        print(f" Could not scan '{error['path']}': {error['error']}")
+    if not flagged:
+        print(f" ✓ No secrets found in {report['files_scanned']} files")
 
     # Test 2: Check file permissions
     print("\nTest 2: Checking file permissions...")
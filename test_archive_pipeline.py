@@ -0,0 +1,112 @@
+# test_archive_pipeline.py
+import os
+import tempfile
+from unittest import mock
+
+from archive_pipeline import archive_and_shred, archive_file, archive_tree_jobs, main
+from audit_log import AuditLog
+from file_encryptor import FileEncryptor
+from mod7 import secure_delete
+
+KEY = "RetentionKey123"
+
+
+def _make_tree(root):
+    """Files of assorted sizes (including empty and exact chunk multiples)"""
+    contents = {}
+    for i, size in enumerate((0, 15, 16, 1000, 3000, 4096, 10007)):
+        path = os.path.join(root, f"dir{i % 2}", f"file{i}.bin")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = bytes((i * 7 + j) % 251 for j in range(size))
+        with open(path, "wb") as f:
+            f.write(data)
+        contents[os.path.relpath(path, root)] = data
+    return contents
+
+
+def test_archive_and_shred():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source")
+        vault = os.path.join(tmp, "vault")
+        contents = _make_tree(source)
+        encryptor = FileEncryptor(KEY, chunk_size=1024)
+        audit = AuditLog(os.path.join(tmp, "audit.jsonl"))
+
+        print("Files stream through the pipeline, are verified and shredded")
+        jobs = archive_tree_jobs(source, vault)
+        results = archive_and_shred(encryptor, iter(jobs), files_in_flight=3, passes=1,
+                                    verify_every=2, queue_depth=2, audit=audit)
+        audit.close()
+        assert [result["input"] for result in results] == [job[0] for job in jobs]
+        assert all(result["ok"] and result["shredded"] for result in results), results
+        assert all(result["verified_chunks"] >= 1 for result in results)
+
+        print("The output is what encrypt_file writes and decrypts back")
+        reference = FileEncryptor(KEY)
+        for rel_path, data in contents.items():
+            assert not os.path.exists(os.path.join(source, rel_path))
+            encrypted = os.path.join(vault, rel_path)
+            plain_copy = os.path.join(tmp, "plain.bin")
+            expected = os.path.join(tmp, "expected.bin")
+            with open(plain_copy, "wb") as f:
+                f.write(data)
+            assert reference.encrypt_file(plain_copy, expected)
+            with open(encrypted, "rb") as f1, open(expected, "rb") as f2:
+                assert f1.read() == f2.read(), rel_path
+            decrypted = os.path.join(tmp, "decrypted.bin")
+            assert reference.decrypt_file(encrypted, decrypted)
+            with open(decrypted, "rb") as f:
+                assert f.read() == data
+
+
+def test_failures_keep_the_plaintext():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "report.txt")
+        output = os.path.join(tmp, "vault", "report.txt")
+        with open(source, "wb") as f:
+            f.write(b"quarterly numbers " * 500)
+        encryptor = FileEncryptor(KEY, chunk_size=1000)
+        audit_file = os.path.join(tmp, "audit.jsonl")
+
+        print("A chunk that does not decrypt back stops the shred")
+        real_xor = FileEncryptor._xor_encrypt
+        calls = []
+
+        def corrupting_xor(self, data, key, offset=0):
+            calls.append(offset)
+            result = real_xor(self, data, key, offset)
+            # Damage the first chunk as it is encrypted, not when it is verified
+            return b"\x00" + result[1:] if len(calls) == 1 else result
+
+        with mock.patch.object(FileEncryptor, "_xor_encrypt", corrupting_xor):
+            result = archive_file(encryptor, source, output, passes=1)
+        assert not result["ok"] and "VerificationError" in result["error"]
+        assert os.path.exists(source)
+        assert not os.path.exists(output) and not os.path.exists(output + ".part")
+
+        print("A missing source is reported, nothing is written")
+        result = archive_file(encryptor, os.path.join(tmp, "missing.txt"), output, passes=1)
+        assert not result["ok"] and "FileNotFoundError" in result["error"]
+        assert not os.path.exists(output)
+
+        print("--keep-source encrypts without shredding")
+        with mock.patch.dict(os.environ, {"ARCHIVE_KEY": KEY}):
+            assert main(["archive-and-shred", source, "--output-dir", os.path.join(tmp, "vault"),
+                         "--keep-source", "--audit-log", audit_file]) == 0
+        assert os.path.exists(source) and os.path.exists(output)
+
+        print("The command line archives trees and shreds the sources")
+        tree = os.path.join(tmp, "tree")
+        _make_tree(tree)
+        with mock.patch.dict(os.environ, {"ARCHIVE_KEY": KEY}):
+            assert main(["archive-and-shred", tree, source, "--output-dir", os.path.join(tmp, "out"),
+                         "--passes", "1", "--files-in-flight", "2", "--audit-log", audit_file]) == 0
+        assert not os.path.exists(source)
+        assert os.path.exists(os.path.join(tmp, "out", "tree", "dir0", "file0.bin"))
+        assert os.path.exists(os.path.join(tmp, "out", "report.txt"))
+        secure_delete.get_audit_log(audit_file).close()
+
+
+if __name__ == "__main__":
+    test_archive_and_shred()
+    test_failures_keep_the_plaintext()
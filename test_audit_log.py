@@ -0,0 +1,137 @@
+# test_audit_log.py
+import json
+import os
+import tempfile
+from unittest import mock
+
+from audit_log import AuditLog, get_audit_log
+from password_manager import PasswordManager
+from rbac_system import RBACSystem
+
+FAST_KDF = {'name': 'pbkdf2_sha256', 'iterations': 1000}
+
+
+def _records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_audit_log_batching_and_rotation():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'audit.log')
+
+        print("Records are written as JSON lines by the background writer")
+        audit = AuditLog(path, flush_every=50, flush_interval=60)
+        for i in range(120):
+            audit.log('tick', number=i)
+        assert audit.flush(timeout=5)
+        records = _records(path)
+        assert [record['number'] for record in records] == list(range(120))
+        assert all(record['event'] == 'tick' and record['ts'] for record in records)
+        audit.close()
+        assert audit.closed
+
+        print("The file is rotated once it passes max_bytes")
+        audit = AuditLog(path, max_bytes=2000, backups=2, flush_every=10)
+        for i in range(300):
+            audit.log('tick', number=i, padding='x' * 20)
+        audit.close()
+        assert os.path.exists(path + '.1') and os.path.exists(path + '.2')
+        assert not os.path.exists(path + '.3')
+        assert os.path.getsize(path + '.1') >= 2000
+        # Nothing is lost from the files that are kept, and the order holds
+        kept = _records(path + '.2') + _records(path + '.1') + _records(path)
+        numbers = [record['number'] for record in kept]
+        assert numbers == list(range(numbers[0], 300))
+
+        print("A failed rotation keeps the current file open")
+        failing = os.path.join(tmp, 'failing.log')
+        audit = AuditLog(failing, max_bytes=500, backups=1, flush_every=5)
+        with mock.patch('audit_log.open', side_effect=OSError(28, 'No space left on device'), create=True):
+            for i in range(50):
+                audit.log('tick', number=i)
+            assert audit.flush(timeout=5)
+        assert 'No space left' in audit.last_error
+        for i in range(50, 60):
+            audit.log('tick', number=i)
+        audit.close()
+        kept = _records(failing + '.1') + _records(failing)
+        assert [record['number'] for record in kept] == list(range(60))
+
+        print("get_audit_log shares one writer per file")
+        shared = get_audit_log(os.path.join(tmp, 'shared.log'))
+        assert get_audit_log(os.path.join(tmp, 'shared.log')) is shared
+        shared.close()
+
+
+def test_audit_hooks():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'audit.log')
+        audit = AuditLog(path)
+
+        print("PasswordManager records user changes, never passwords")
+        pm = PasswordManager(os.path.join(tmp, 'passwords.json'), kdf_params=FAST_KDF, audit=audit)
+        pm.add_user('alice', 'Password123!', 'admin')
+        pm.add_user('alice', 'again')
+        pm.add_users([('bob', 'hunter2'), ('carol', None)])
+        pm.change_password('alice', 'wrong', 'x')
+        pm.change_password('alice', 'Password123!', 'NewPassword!')
+
+        print("RBACSystem records denied decisions only")
+        rbac = RBACSystem(audit=audit)
+        rbac.add_user('user1', 'user')
+        assert rbac.can_access_file('user1', 'user1_private.txt')
+        assert not rbac.can_access_file('user1', 'admin1_private.txt')
+        assert not rbac.check_permission('user1', 'manage_users')
+        assert not rbac.check_permission('nobody', 'read_public')
+        audit.close()
+
+        records = _records(path)
+        assert [record['event'] for record in records] == [
+            'user_added', 'user_add_failed', 'user_added', 'user_add_failed',
+            'password_change_failed', 'password_changed',
+            'access_denied', 'access_denied', 'access_denied',
+        ]
+        assert 'Password123!' not in open(path).read()
+        denies = records[-3:]
+        assert denies[0]['reason'] == 'not_owner' and denies[0]['path'] == 'admin1_private.txt'
+        assert denies[1]['reason'] == 'missing_permission' and denies[1]['permission'] == 'manage_users'
+        assert denies[2]['reason'] == 'unknown_user'
+        assert all(record['policy_version'] == rbac.policy_version for record in denies)
+        pm.close()
+
+
+def test_batch_access_audit():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'audit.log')
+        audit = AuditLog(path)
+        rbac = RBACSystem(audit=audit)
+        rbac.add_user('user1', 'user')
+        paths = ['public.txt', 'user1_private.txt', 'admin1_private.txt', 'nope.bin']
+
+        print("Batch checks write one summary record per call")
+        assert list(rbac.filter_accessible('user1', paths)) == paths[:2]
+        assert rbac.access_mask('nobody', paths) == [False] * 4
+        assert rbac.check_many(['user1', 'nobody'], ['read_public', 'manage_users']) == [
+            [True, False], [False, False]]
+        assert rbac.access_mask('user1', paths[:2]) == [True, True]
+        audit.close()
+
+        records = _records(path)
+        assert [record['event'] for record in records] == ['access_denied_batch'] * 3
+        listing, unknown, permissions = records
+        assert listing['user_id'] == 'user1' and listing['action'] == 'read'
+        assert listing['checked'] == 4 and listing['denied'] == 2
+        assert listing['reasons'] == {'not_owner': 1, 'unknown_resource': 1}
+        assert listing['sample'] == ['admin1_private.txt', 'nope.bin']
+        assert unknown['reasons'] == {'unknown_user': 4}
+        assert permissions['checked'] == 4 and permissions['denied'] == 3
+        assert permissions['sample'] == [
+            ['user1', 'manage_users'], ['nobody', 'read_public'], ['nobody', 'manage_users']]
+        assert all(record['policy_version'] == rbac.policy_version for record in records)
+
+
+if __name__ == "__main__":
+    test_audit_log_batching_and_rotation()
+    test_audit_hooks()
+    test_batch_access_audit()
@@ -0,0 +1,58 @@
+# test_benchmark_suite.py
+import json
+import os
+import tempfile
+
+from benchmark_suite import compare, main, run_benchmarks
+
+TINY_CONFIG = {
+    'file_sizes': [64 * 1024],
+    'user_counts': [5],
+    'rbac_users': [50],
+    'rbac_roles': [3],
+    'decisions': 500,
+    'repeat': 1,
+}
+
+
+def _results(**values):
+    return {'results': {
+        name: {'value': value, 'unit': 'x', 'higher_is_better': not name.endswith('rss')}
+        for name, value in values.items()
+    }}
+
+
+def test_compare():
+    print("Slowdowns past the threshold are regressions, in both directions")
+    baseline = _results(speed=100.0, rss=10.0, steady=50.0, removed=1.0)
+    current = _results(speed=70.0, rss=13.0, steady=45.0, added=5.0)
+    regressions = {item['metric']: item for item in compare(current, baseline, threshold=0.2)}
+    assert sorted(regressions) == ['rss', 'speed']
+    assert abs(regressions['speed']['slowdown'] - 0.3) < 1e-9
+    assert compare(current, baseline, threshold=0.5) == []
+
+
+def test_benchmark_run():
+    print("A tiny run produces every workload's metrics")
+    results = run_benchmarks(TINY_CONFIG)
+    names = set(results['results'])
+    for expected in ('file_encryptor.encrypt.64KiB', 'file_encryptor.decrypt.64KiB',
+                     'password_manager.add_user.5_users', 'password_manager.authenticate.5_users',
+                     'rbac.check_permission.50_users.3_roles', 'rbac.can_access_file.50_users.3_roles',
+                     'secure_delete.64KiB'):
+        assert expected in names, expected
+    assert all(metric['value'] > 0 for metric in results['results'].values())
+
+    print("The command line fails on a regression against the baseline")
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = os.path.join(tmp, 'baseline.json')
+        results['results']['rbac.check_permission.1000_users.4_roles'] = {
+            'value': 1e15, 'unit': 'decisions/s', 'higher_is_better': True}
+        with open(baseline, 'w') as f:
+            json.dump(results, f)
+        assert main(['--quick', '--only', 'rbac', '--baseline', baseline]) == 1
+
+
+if __name__ == "__main__":
+    test_compare()
+    test_benchmark_run()
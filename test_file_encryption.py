@@ -1,5 +1,10 @@
 # test_file_encryption.py
+import os
+import tempfile
+from unittest import mock
+
 from file_encryptor import FileEncryptor
+from xor_kernels import available_kernels, get_kernel
 
 
 def test_encryption():
@@ -37,5 +42,300 @@ def test_encryption():
         print(" ✗ WRONG: Decryption should have failed!")
 
 
+def test_streaming_matches_whole_file():
+    # Chunk sizes that do and don't line up with the key and block sizes
+    data = os.urandom(5000)
+    reference = FileEncryptor("MySecretPassword123")
+    expected = reference._xor_encrypt(reference._pad_data(data), reference.key)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, "plain.bin")
+        with open(plain, "wb") as f:
+            f.write(data)
+
+        for chunk_size in (1, 7, 16, 32, 1000, 4096, 10000):
+            print(f"Streaming with chunk_size={chunk_size}")
+            encryptor = FileEncryptor("MySecretPassword123", chunk_size=chunk_size)
+            enc = os.path.join(tmp, "enc.bin")
+            dec = os.path.join(tmp, "dec.bin")
+            assert encryptor.encrypt_file(plain, enc)
+            with open(enc, "rb") as f:
+                assert f.read() == expected
+            assert encryptor.decrypt_file(enc, dec)
+            with open(dec, "rb") as f:
+                assert f.read() == data
+
+        # A failed decryption must not leave a partial output behind
+        wrong = FileEncryptor("WrongPassword", chunk_size=7)
+        failed = os.path.join(tmp, "failed.bin")
+        assert not wrong.decrypt_file(enc, failed)
+        assert not os.path.exists(failed)
+        assert not os.path.exists(failed + ".part")
+
+
+def test_xor_kernels_match_reference():
+    key = FileEncryptor("MySecretPassword123").key
+    reference = get_kernel("python")
+    for name in available_kernels():
+        print(f"Checking XOR backend '{name}'")
+        kernel = get_kernel(name)
+        for length, offset in ((0, 0), (1, 31), (33, 5), (4096, 0), (5000, 12345)):
+            data = os.urandom(length)
+            assert kernel.xor(data, key, offset) == reference.xor(data, key, offset)
+
+    # Every backend must produce byte-identical files
+    data = os.urandom(3000)
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, "plain.bin")
+        with open(plain, "wb") as f:
+            f.write(data)
+        outputs = set()
+        for name in available_kernels():
+            enc = os.path.join(tmp, f"{name}.bin")
+            FileEncryptor("MySecretPassword123", chunk_size=1000, backend=name).encrypt_file(plain, enc)
+            with open(enc, "rb") as f:
+                outputs.add(f.read())
+        assert len(outputs) == 1
+
+
+def test_encrypt_tree_round_trip():
+    encryptor = FileEncryptor("MySecretPassword123", chunk_size=256)
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src")
+        contents = {}
+        for rel_path, size in (("a.txt", 10), ("big.bin", 5000), (os.path.join("sub", "deep", "c.bin"), 300)):
+            path = os.path.join(src, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            contents[rel_path] = (rel_path.encode() * size)[:size]
+            with open(path, "wb") as f:
+                f.write(contents[rel_path])
+
+        for executor in ("thread", "process"):
+            print(f"Encrypting tree with a {executor} pool")
+            enc_root = os.path.join(tmp, f"enc_{executor}")
+            dec_root = os.path.join(tmp, f"dec_{executor}")
+            report = encryptor.encrypt_tree(src, enc_root, workers=2, executor=executor)
+            assert sorted(r["path"] for r in report) == sorted(contents)
+            assert all(r["ok"] for r in report)
+            report = encryptor.decrypt_tree(enc_root, dec_root, workers=2, executor=executor)
+            assert all(r["ok"] for r in report)
+            for rel_path, data in contents.items():
+                with open(os.path.join(dec_root, rel_path), "rb") as f:
+                    assert f.read() == data
+
+        # Failures are reported per file instead of being printed
+        report = FileEncryptor("WrongPassword").decrypt_tree(
+            os.path.join(tmp, "enc_thread"), os.path.join(tmp, "wrong"), executor="thread")
+        assert not any(r["ok"] for r in report)
+        assert all(r["error"] for r in report)
+
+
+def test_incremental_tree():
+    encryptor = FileEncryptor("MySecretPassword123", chunk_size=256)
+    for manifest_name in ("manifest.jsonl", "manifest.db"):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "src")
+            enc = os.path.join(tmp, "enc")
+            manifest = os.path.join(tmp, manifest_name)
+
+            def write(rel_path, data):
+                path = os.path.join(src, rel_path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(data)
+
+            for rel_path in ("a.txt", "b.txt", os.path.join("sub", "c.bin"), "gone.txt"):
+                write(rel_path, rel_path.encode() * 100)
+
+            print(f"First run encrypts everything ({manifest_name})")
+            report = encryptor.encrypt_tree_incremental(src, enc, manifest, workers=2, executor="thread")
+            assert len(report["encrypted"]) == 4 and report["unchanged"] == 0
+
+            print("A rerun without changes reads nothing")
+            report = encryptor.encrypt_tree_incremental(src, enc, manifest, workers=2, executor="thread")
+            assert report["encrypted"] == [] and report["unchanged"] == 4 and report["hashed"] == 0
+
+            print("Touching every file costs a hash, not an encryption")
+            for rel_path in ("a.txt", "b.txt", os.path.join("sub", "c.bin"), "gone.txt"):
+                path = os.path.join(src, rel_path)
+                st = os.stat(path)
+                os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            with mock.patch.object(FileEncryptor, "_encrypt_path") as encrypt_path:
+                report = encryptor.encrypt_tree_incremental(src, enc, manifest, executor="thread")
+            assert not encrypt_path.called
+            assert report["encrypted"] == [] and report["unchanged"] == 4 and report["hashed"] == 4
+
+            print("Touched files are hashed, modified ones re-encrypted, deleted ones pruned")
+            a_path = os.path.join(src, "a.txt")
+            st = os.stat(a_path)
+            os.utime(a_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            b_data = b"B" * len(b"b.txt" * 100)
+            b_path = os.path.join(src, "b.txt")
+            st = os.stat(b_path)
+            write("b.txt", b_data)
+            os.utime(b_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            os.remove(os.path.join(src, "gone.txt"))
+            write("new.txt", b"fresh")
+            a_output = os.stat(os.path.join(enc, "a.txt"))
+            report = encryptor.encrypt_tree_incremental(src, enc, manifest, workers=2, executor="process")
+            assert sorted(r["path"] for r in report["encrypted"]) == ["b.txt", "new.txt"]
+            assert all(r["ok"] for r in report["encrypted"])
+            assert report["hashed"] == 2 and report["unchanged"] == 2
+            assert report["pruned"] == ["gone.txt"]
+            assert not os.path.exists(os.path.join(enc, "gone.txt"))
+            # The touched file's output was kept, not rewritten
+            assert os.stat(os.path.join(enc, "a.txt")).st_ino == a_output.st_ino
+            assert not os.path.exists(os.path.join(enc, "a.txt.part"))
+
+            dec = os.path.join(tmp, "dec")
+            assert all(r["ok"] for r in encryptor.decrypt_tree(enc, dec, executor="thread"))
+            with open(os.path.join(dec, "b.txt"), "rb") as f:
+                assert f.read() == b_data
+            assert sorted(os.listdir(dec)) == ["a.txt", "b.txt", "new.txt", "sub"]
+
+            print("A file deleted between the walk and its stat is pruned too")
+            real_stat = os.stat
+
+            def vanishing_stat(path, *args, **kwargs):
+                if os.fspath(path).endswith("new.txt"):
+                    raise FileNotFoundError(path)
+                return real_stat(path, *args, **kwargs)
+
+            with mock.patch("os.stat", vanishing_stat):
+                report = encryptor.encrypt_tree_incremental(src, enc, manifest, executor="thread")
+            assert report["pruned"] == ["new.txt"] and report["encrypted"] == []
+            assert not os.path.exists(os.path.join(enc, "new.txt"))
+            report = encryptor.encrypt_tree_incremental(src, enc, manifest, executor="thread")
+            assert [r["path"] for r in report["encrypted"]] == ["new.txt"]
+
+            print("A different key or format re-encrypts everything")
+            report = encryptor.encrypt_tree_incremental(src, enc, manifest, executor="thread", framed=True)
+            assert len(report["encrypted"]) == 4
+            report = FileEncryptor("OtherPassword").encrypt_tree_incremental(
+                src, enc, manifest, executor="thread", framed=True)
+            assert len(report["encrypted"]) == 4
+
+
+class _CrashingKernel:
+    """Wraps a kernel and dies half way through its second window"""
+
+    def __init__(self, kernel):
+        self.kernel = kernel
+        self.name = kernel.name
+        self.calls = 0
+
+    def xor(self, data, key, offset=0):
+        return self.kernel.xor(data, key, offset)
+
+    def xor_into(self, buffer, key, offset=0):
+        self.calls += 1
+        if self.calls == 2:
+            half = len(buffer) // 2
+            self.kernel.xor_into(buffer[:half], key, offset)
+            raise RuntimeError("simulated crash")
+        self.kernel.xor_into(buffer, key, offset)
+
+
+def test_inplace_encryption_and_resume():
+    data = os.urandom(3000)
+    encryptor = FileEncryptor("MySecretPassword123", chunk_size=1024)
+    expected = encryptor._xor_encrypt(encryptor._pad_data(data), encryptor.key)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "big.bin")
+        with open(path, "wb") as f:
+            f.write(data)
+
+        print("In-place encryption and decryption")
+        assert encryptor.encrypt_file_inplace(path)
+        with open(path, "rb") as f:
+            assert f.read() == expected
+        assert not os.path.exists(path + ".xorjournal")
+
+        # Wrong key is rejected before anything is modified
+        assert not FileEncryptor("WrongPassword").decrypt_file_inplace(path)
+        with open(path, "rb") as f:
+            assert f.read() == expected
+
+        assert encryptor.decrypt_file_inplace(path)
+        with open(path, "rb") as f:
+            assert f.read() == data
+
+        print("Resuming an interrupted in-place encryption")
+        crashing = FileEncryptor("MySecretPassword123", chunk_size=1024)
+        crashing.kernel = _CrashingKernel(crashing.kernel)
+        assert not crashing.encrypt_file_inplace(path)
+        assert os.path.exists(path + ".xorjournal")
+        # The interrupted run has to be finished before anything else
+        assert not encryptor.decrypt_file_inplace(path)
+        assert encryptor.encrypt_file_inplace(path)
+        with open(path, "rb") as f:
+            assert f.read() == expected
+        assert not os.path.exists(path + ".xorjournal")
+
+        print("Resuming a decryption that crashed after dropping the padding")
+        real_remove = os.remove
+
+        def crash_before_journal_removal(target):
+            if target.endswith(".xorjournal"):
+                raise OSError("simulated crash")
+            real_remove(target)
+
+        with mock.patch("os.remove", crash_before_journal_removal):
+            assert not encryptor.decrypt_file_inplace(path)
+        assert os.path.getsize(path) == len(data) and os.path.exists(path + ".xorjournal")
+        assert encryptor.decrypt_file_inplace(path)
+        with open(path, "rb") as f:
+            assert f.read() == data
+        assert not os.path.exists(path + ".xorjournal")
+
+
+def test_framed_container_and_range_decryption():
+    data = os.urandom(10000)
+    encryptor = FileEncryptor("MySecretPassword123", chunk_size=1024)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, "log.txt")
+        with open(plain, "wb") as f:
+            f.write(data)
+        framed = os.path.join(tmp, "framed.bin")
+        legacy = os.path.join(tmp, "legacy.bin")
+        assert encryptor.encrypt_file(plain, framed, framed=True)
+        assert encryptor.encrypt_file(plain, legacy)
+
+        print("Full decryption detects the format from the header")
+        for path in (framed, legacy):
+            out = path + ".out"
+            assert encryptor.decrypt_file(path, out)
+            with open(out, "rb") as f:
+                assert f.read() == data
+
+        print("Range decryption reads only what it needs")
+        for path in (framed, legacy):
+            for offset, length in ((0, 10), (1000, 100), (1020, 2000), (9990, 100), (20000, 5), (0, 10000)):
+                assert encryptor.decrypt_range(path, offset, length) == data[offset:offset + length]
+
+        # Tampering with one frame is caught by its tag
+        with open(framed, "r+b") as f:
+            f.seek(3000)
+            byte = f.read(1)
+            f.seek(3000)
+            f.write(bytes([byte[0] ^ 1]))
+        assert encryptor.decrypt_range(framed, 0, 100) == data[:100]
+        try:
+            encryptor.decrypt_range(framed, 2500, 100)
+            assert False, "tampered frame should fail"
+        except ValueError:
+            pass
+        assert not encryptor.decrypt_file(framed, os.path.join(tmp, "tampered.out"))
+        assert not FileEncryptor("WrongPassword").decrypt_file(legacy, os.path.join(tmp, "wrong.out"))
+
+
 if __name__ == "__main__":
-    test_encryption()
\ No newline at end of file
+    test_encryption()
+    test_streaming_matches_whole_file()
+    test_xor_kernels_match_reference()
+    test_encrypt_tree_round_trip()
+    test_incremental_tree()
+    test_inplace_encryption_and_resume()
+    test_framed_container_and_range_decryption()
\ No newline at end of file
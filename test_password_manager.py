@@ -1,38 +1,276 @@
 # test_password_manager.py
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import password_kdf
 from password_manager import PasswordManager
+from password_storage import JsonFileStore, SQLiteStore, migrate_json_to_sqlite
+
+# Cheap KDF so the tests that hash many passwords stay fast
+FAST_KDF = {'name': 'pbkdf2_sha256', 'iterations': 1000}
 
 
 def test_password_manager():
-    pm = PasswordManager('test_passwords.json')
+    # Work on a copy: loading the legacy fixture rehashes it, which writes a
+    # journal and a lock file next to it
+    with tempfile.TemporaryDirectory() as tmp:
+        store = os.path.join(tmp, 'test_passwords.json')
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_passwords.json'), store)
+        pm = PasswordManager(store)
+
+        # Test 1: Add user
+        print("Test 1: Adding user 'alice'")
+        pm.add_user('alice', 'Password123!', 'admin')
+
+        # Test 2: Authentication - correct password
+        print("\nTest 2: Authenticating with correct password")
+        success, role = pm.authenticate('alice', 'Password123!')
+        print(f" Success: {success}, Role: {role}")
+
+        # Test 3: Authentication - wrong password
+        print("\nTest 3: Authenticating with wrong password")
+        success, role = pm.authenticate('alice', 'WrongPassword')
+        print(f" Success: {success}, Role: {role}")
+
+        # Test 4: Change password
+        print("\nTest 4: Changing password")
+        pm.change_password('alice', 'Password123!', 'NewPassword456!')
+
+        # Test 5: Verify new password works
+        print("\nTest 5: Verifying new password")
+        success, role = pm.authenticate('alice', 'NewPassword456!')
+        print(f" Success: {success}, Role: {role}")
+
+        # Test 6: Old password should not work
+        print("\nTest 6: Old password should fail")
+        success, role = pm.authenticate('alice', 'Password123!')
+        print(f" Success: {success} (should be False)")
+        pm.close()
+
+
+def test_journal_persistence():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = os.path.join(tmp, 'passwords.json')
+
+        print("Mutations are appended to the journal, not rewritten")
+        pm = PasswordManager(store, compact_every=3, kdf_params=FAST_KDF)
+        pm.add_user('alice', 'Password123!', 'admin')
+        pm.add_user('bob', 'hunter2')
+        assert not os.path.exists(store)
+        with open(store + '.journal') as f:
+            assert len(f.read().splitlines()) == 2
+
+        # A restart replays the journal
+        assert PasswordManager(store, kdf_params=FAST_KDF).authenticate('bob', 'hunter2') == (True, 'user')
+
+        print("Reaching compact_every folds the journal into the snapshot")
+        pm.change_password('alice', 'Password123!', 'NewPassword456!')
+        pm.close()
+        assert os.path.getsize(store + '.journal') == 0
+        with open(store) as f:
+            assert sorted(json.load(f)) == ['alice', 'bob']
+        assert PasswordManager(store, kdf_params=FAST_KDF).authenticate('alice', 'NewPassword456!') == (True, 'admin')
+
+        print("A torn last journal line from a crash is dropped")
+        pm = PasswordManager(store, kdf_params=FAST_KDF)
+        pm.add_user('carol', 'pw')
+        pm.close()
+        with open(store + '.journal', 'a') as f:
+            f.write('{"op": "put", "user": "dave", "rec')
+        pm = PasswordManager(store, kdf_params=FAST_KDF)
+        assert 'carol' in pm.users and 'dave' not in pm.users
+        pm.add_user('erin', 'pw')
+        pm.close()
+        assert 'erin' in PasswordManager(store, kdf_params=FAST_KDF).users
+
+        print("sync_interval fsyncs batched records even when writes stop")
+        pm = PasswordManager(store, sync_every=100, sync_interval=0.05, kdf_params=FAST_KDF)
+        pm.add_user('frank', 'pw')
+        assert pm.store._unsynced == 1
+        deadline = time.monotonic() + 2
+        while pm.store._unsynced and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert pm.store._unsynced == 0
+        pm.close()
+
+        print("A corrupted snapshot is an error, not an empty store")
+        with open(store, 'w') as f:
+            f.write('{"alice": ')
+        try:
+            PasswordManager(store, kdf_params=FAST_KDF)
+            assert False, "corrupted snapshot should raise"
+        except ValueError:
+            pass
+
+
+def test_bulk_import():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = os.path.join(tmp, 'passwords.json')
+        pm = PasswordManager(store, kdf_params=FAST_KDF)
+        pm.add_user('alice', 'Password123!', 'admin')
+
+        print("add_users validates up front and reports per record")
+        results = pm.add_users([
+            ('bob', 'pw1'),
+            {'username': 'carol', 'password': 'pw2', 'role': 'editor'},
+            ('alice', 'again'),
+            ('bob', 'dup'),
+            {'username': 'dave'},
+        ])
+        assert [r['ok'] for r in results] == [True, True, False, False, False]
+        assert results[2]['error'] == 'user already exists'
+        assert results[3]['error'] == 'duplicate username in batch'
+
+        print("Malformed records get an error entry instead of raising")
+        results = pm.add_users([('short',), ('x', 'pw', 'user', 'extra'), 'bob', None,
+                                {'username': 5, 'password': 'pw'}, ('heidi', 42)])
+        assert [r['error'] for r in results] == ['malformed record'] * 6
+        assert results[5]['username'] == 'heidi' and results[4]['username'] is None
+        # One journal line for the whole batch
+        with open(store + '.journal') as f:
+            assert len(f.read().splitlines()) == 2
+        pm.close()
+
+        reloaded = PasswordManager(store, kdf_params=FAST_KDF)
+        assert reloaded.authenticate('carol', 'pw2') == (True, 'editor')
+
+        print("import_users reads CSV and JSONL")
+        csv_path = os.path.join(tmp, 'users.csv')
+        with open(csv_path, 'w') as f:
+            f.write('username,password,role\nerin,pw3,user\nfrank,pw4,admin\n')
+        jsonl_path = os.path.join(tmp, 'users.jsonl')
+        with open(jsonl_path, 'w') as f:
+            f.write(json.dumps({'username': 'grace', 'password': 'pw5'}) + '\n')
+        assert all(r['ok'] for r in reloaded.import_users(csv_path, workers=4))
+        assert all(r['ok'] for r in reloaded.import_users(jsonl_path))
+        assert reloaded.authenticate('frank', 'pw4') == (True, 'admin')
+        assert reloaded.authenticate('grace', 'pw5') == (True, 'user')
+
+        print("Bad JSONL lines are reported in place, the rest is imported")
+        with open(jsonl_path, 'w') as f:
+            f.write('{bad\n["ivan", "pw6"]\n' + json.dumps({'username': 'judy', 'password': 'pw7'}) + '\n')
+        results = reloaded.import_users(jsonl_path)
+        assert [(r['ok'], r['error']) for r in results] == [
+            (False, 'malformed record'), (False, 'malformed record'), (True, None)]
+        assert 'ivan' not in reloaded.users and reloaded.authenticate('judy', 'pw7') == (True, 'user')
+
+
+def test_kdf_upgrade_and_calibration():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = os.path.join(tmp, 'passwords.json')
+        # A record written before KDF support: plain salted SHA-256
+        with open(store, 'w') as f:
+            json.dump({'alice': {
+                'hash': '7913393d45ca5ba4959f3897f7838f6528badc3a990e457e089709e45124a0a8',
+                'salt': 'e398e2b1a36f21985c6c7b46dfa58d80',
+                'role': 'admin',
+            }}, f)
+
+        print("Legacy SHA-256 hashes are rehashed on the next successful login")
+        pm = PasswordManager(store, kdf_params=FAST_KDF)
+        assert pm.authenticate('alice', 'WrongPassword') == (False, None)
+        assert 'kdf' not in pm.users['alice']
+        assert pm.authenticate('alice', 'NewPassword456!') == (True, 'admin')
+        assert pm.users['alice']['kdf'] == FAST_KDF
+        pm.close()
+
+        print("Users with different KDF costs can all log in")
+        scrypt_params = {'name': 'scrypt', 'n': 1024, 'r': 8, 'p': 1}
+        pm = PasswordManager(store, kdf_params=scrypt_params)
+        pm.add_user('bob', 'hunter2')
+        assert pm.users['bob']['kdf'] == scrypt_params
+        assert pm.users['alice']['kdf'] == FAST_KDF
+        assert pm.authenticate('bob', 'hunter2') == (True, 'user')
+        assert pm.authenticate('alice', 'NewPassword456!') == (True, 'admin')
+        assert pm.users['alice']['kdf'] == scrypt_params
+        pm.close()
+
+    print("Calibration picks parameters for this machine")
+    params = password_kdf.calibrate('pbkdf2_sha256', target_seconds=0.01, rounds=1, min_iterations=1000)
+    assert params['name'] == 'pbkdf2_sha256' and params['iterations'] >= 1000
+    assert password_kdf.benchmark(params, rounds=1) > 0
+
+
+def test_sqlite_backend_and_migration():
+    with tempfile.TemporaryDirectory() as tmp:
+        json_store = os.path.join(tmp, 'passwords.json')
+        db = os.path.join(tmp, 'passwords.db')
+
+        pm = PasswordManager(json_store, kdf_params=FAST_KDF)
+        pm.add_user('alice', 'Password123!', 'admin')
+        pm.add_users([('bob', 'pw1'), ('carol', 'pw2', 'editor')])
+        pm.close()
+
+        print("Migrating passwords.json (snapshot + journal) to SQLite")
+        assert migrate_json_to_sqlite(json_store, db) == 3
+
+        print("The .db extension selects the SQLite backend")
+        pm = PasswordManager(db, kdf_params=FAST_KDF)
+        assert isinstance(pm.store, SQLiteStore)
+        assert len(pm.users) == 3 and 'bob' in pm.users
+        assert pm.authenticate('carol', 'pw2') == (True, 'editor')
+        assert pm.change_password('alice', 'Password123!', 'NewPassword456!')
+        assert not pm.add_user('bob', 'again')
+        assert pm.add_user('dave', 'pw3')
+        pm.close()
+
+        pm = PasswordManager(db, kdf_params=FAST_KDF)
+        assert pm.authenticate('alice', 'NewPassword456!') == (True, 'admin')
+        assert pm.authenticate('dave', 'pw3') == (True, 'user')
+        assert sorted(pm.users) == ['alice', 'bob', 'carol', 'dave']
+        pm.close()
+
 
-    # Test 1: Add user
-    print("Test 1: Adding user 'alice'")
-    pm.add_user('alice', 'Password123!', 'admin')
+def _add_users_in_process(store_path, worker, count):
+    store = JsonFileStore(store_path, compact_every=7)
+    for i in range(count):
+        store.add(f'w{worker}_u{i}', {'hash': 'x', 'salt': 'y', 'role': 'user'})
+    store.close()
 
-    # Test 2: Authentication - correct password
-    print("\nTest 2: Authenticating with correct password")
-    success, role = pm.authenticate('alice', 'Password123!')
-    print(f" Success: {success}, Role: {role}")
 
-    # Test 3: Authentication - wrong password
-    print("\nTest 3: Authenticating with wrong password")
-    success, role = pm.authenticate('alice', 'WrongPassword')
-    print(f" Success: {success}, Role: {role}")
+def test_multi_process_json_store():
+    with tempfile.TemporaryDirectory() as tmp:
+        store_path = os.path.join(tmp, 'passwords.json')
 
-    # Test 4: Change password
-    print("\nTest 4: Changing password")
-    pm.change_password('alice', 'Password123!', 'NewPassword456!')
+        print("Concurrent writers in several processes lose no updates")
+        workers = [
+            multiprocessing.Process(target=_add_users_in_process, args=(store_path, worker, 25))
+            for worker in range(4)
+        ]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+            assert process.exitcode == 0
+        assert len(JsonFileStore(store_path)) == 100
 
-    # Test 5: Verify new password works
-    print("\nTest 5: Verifying new password")
-    success, role = pm.authenticate('alice', 'NewPassword456!')
-    print(f" Success: {success}, Role: {role}")
+        print("Readers see other writers' changes, including compactions")
+        first = PasswordManager(store_path, kdf_params=FAST_KDF)
+        second = PasswordManager(store_path, kdf_params=FAST_KDF)
+        first.add_user('alice', 'Password123!', 'admin')
+        assert second.authenticate('alice', 'Password123!') == (True, 'admin')
+        assert not second.add_user('alice', 'someone else')
+        second.compact()
+        assert first.change_password('alice', 'Password123!', 'NewPassword456!')
+        assert second.authenticate('alice', 'NewPassword456!') == (True, 'admin')
 
-    # Test 6: Old password should not work
-    print("\nTest 6: Old password should fail")
-    success, role = pm.authenticate('alice', 'Password123!')
-    print(f" Success: {success} (should be False)")
+        # A write based on a stale copy of the record is refused
+        stale = dict(first.users['alice'])
+        assert second.change_password('alice', 'NewPassword456!', 'Other789!')
+        assert not first.store.compare_and_put('alice', stale, dict(stale, role='user'))
+        assert first.authenticate('alice', 'Other789!') == (True, 'admin')
+        first.close()
+        second.close()
 
 
 if __name__ == "__main__":
     test_password_manager()
+    test_journal_persistence()
+    test_bulk_import()
+    test_kdf_upgrade_and_calibration()
+    test_sqlite_backend_and_migration()
+    test_multi_process_json_store()
@@ -1,6 +1,15 @@
 # test_rbac.py
 
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
 from rbac_system import RBACSystem
+from rbac_users import UserTable
+from resource_rules import ResourceMatcher
 
 
 def test_rbac():
@@ -46,5 +55,336 @@ def test_rbac():
     print(rbac.list_users())
 
 
+def test_compiled_permission_index():
+    rbac = RBACSystem()
+    for user_id, role in (('guest1', 'guest'), ('user1', 'user'), ('admin1', 'admin')):
+        rbac.add_user(user_id, role)
+
+    print("Compiled checks agree with the policy")
+    expected = {
+        'guest': {'read_public'},
+        'user': {'read_public', 'write_own', 'read_own'},
+        'admin': {'read_public', 'write_own', 'read_own', 'edit_public', 'delete_any', 'manage_users'},
+    }
+    permissions = set(expected['admin']) | {'no_such_permission'}
+    for user_id, role in rbac.users.items():
+        assert rbac.effective_permissions(role) == expected[role]
+        for permission in permissions:
+            assert rbac.check_permission(user_id, permission) == (permission in expected[role])
+    assert not rbac.check_permission('nobody', 'read_public')
+
+    print("Changing a role recompiles the index")
+    assert not rbac.check_permission('guest1', 'write_own')
+    rbac.set_role('guest', ['read_public', 'write_own'])
+    assert rbac.check_permission('guest1', 'write_own')
+    rbac.roles['guest'] = ['read_public']
+    rbac.recompile()
+    assert not rbac.check_permission('guest1', 'write_own')
+
+
+def test_role_inheritance():
+    with tempfile.TemporaryDirectory() as tmp:
+        policy_file = os.path.join(tmp, 'policy.json')
+        with open(policy_file, 'w') as f:
+            json.dump({
+                'viewer': ['view'],
+                'commenter': {'permissions': ['comment'], 'inherits': ['viewer']},
+                'auditor': {'permissions': ['audit'], 'inherits': ['viewer']},
+                'lead': {'permissions': ['approve'], 'inherits': ['commenter', 'auditor']},
+            }, f)
+        rbac = RBACSystem(policy_file)
+
+    print("Permissions are inherited transitively")
+    rbac.add_user('lead1', 'lead')
+    assert rbac.effective_permissions('lead') == {'view', 'comment', 'audit', 'approve'}
+    assert rbac.check_permission('lead1', 'view')
+
+    print("Cycles and unknown parents are rejected, keeping the old policy")
+    for inherits in (['lead'], ['no_such_role']):
+        try:
+            rbac.set_role('viewer', ['view'], inherits=inherits)
+            assert False, "invalid inheritance should raise"
+        except ValueError as e:
+            print(f" Rejected: {e}")
+    assert rbac.roles['viewer'] == ['view']
+    assert rbac.check_permission('lead1', 'view')
+
+
+def test_resource_rules():
+    print("Default rules behave like the original hard-coded files")
+    rbac = RBACSystem()
+    rbac.add_user('user1', 'user')
+    rbac.add_user('user2', 'user')
+    rbac.add_user('admin1', 'admin')
+    assert rbac.can_access_file('user1', 'public.txt', 'read')
+    assert not rbac.can_access_file('user1', 'public.txt', 'write')
+    assert rbac.can_access_file('user1', 'user1_private.txt', 'write')
+    assert not rbac.can_access_file('user1', 'user2_private.txt', 'read')
+    assert not rbac.can_access_file('admin1', 'user1_private.txt', 'read')
+    assert rbac.can_access_file('admin1', 'admin_logs.txt', 'read')
+    assert not rbac.can_access_file('admin1', 'unknown.txt', 'read')
+    assert not rbac.can_access_file('admin1', 'public.txt', 'delete')
+
+    print("Glob and placeholder rules from the policy file, most specific wins")
+    with tempfile.TemporaryDirectory() as tmp:
+        policy_file = os.path.join(tmp, 'policy.json')
+        with open(policy_file, 'w') as f:
+            json.dump({
+                'roles': {
+                    'staff': ['read_reports', 'read_home'],
+                    'board': {'permissions': ['read_board'], 'inherits': ['staff']},
+                },
+                'resources': [
+                    {'pattern': 'projects/*/reports/**', 'actions': {'read': 'read_reports'}},
+                    {'pattern': 'projects/*/reports/board-*.pdf', 'actions': {'read': 'read_board'}},
+                    {'pattern': 'home/{user_id}/**', 'actions': {'read': 'read_home'}},
+                ],
+            }, f)
+        rbac = RBACSystem(policy_file)
+    rbac.add_user('alice', 'staff')
+    rbac.add_user('bob', 'board')
+    assert rbac.can_access_file('alice', 'projects/apollo/reports/q1/summary.pdf')
+    assert not rbac.can_access_file('alice', 'projects/apollo/reports/board-q1.pdf')
+    assert rbac.can_access_file('bob', 'projects/apollo/reports/board-q1.pdf')
+    assert not rbac.can_access_file('alice', 'projects/apollo/notes.txt')
+    assert rbac.can_access_file('alice', 'home/alice/todo.txt')
+    assert not rbac.can_access_file('bob', 'home/alice/todo.txt')
+    # Cached decisions still respect ownership
+    assert rbac.can_access_file('bob', 'home/bob/todo.txt')
+
+    print("Wildcard segments are bucketed by literal prefix, specificity still wins")
+    matcher = ResourceMatcher(
+        [{'pattern': f'logs/app{i}-*.log', 'actions': {'read': f'read_app{i}'}} for i in range(10000)]
+        + [{'pattern': 'logs/*.log', 'actions': {'read': 'read_logs'}},
+           {'pattern': 'logs/app1-2*.log', 'actions': {'read': 'read_app1_2'}},
+           {'pattern': 'logs/{user_id}-notes.log', 'actions': {'read': 'read_notes'}}]
+    )
+    assert matcher.match('logs/app42-x.log') == ({'read': 'read_app42'}, None)
+    assert matcher.match('logs/app1-x.log') == ({'read': 'read_app1'}, None)
+    assert matcher.match('logs/app1-23.log') == ({'read': 'read_app1_2'}, None)
+    assert matcher.match('logs/other.log') == ({'read': 'read_logs'}, None)
+    assert matcher.match('logs/bob-notes.log') == ({'read': 'read_notes'}, 'bob')
+    assert matcher.match('logs/app42-x.txt') == (None, None)
+    # A miss no longer tries every rule of the node
+    start = time.perf_counter()
+    for i in range(2000):
+        matcher.match(f'logs/app{i}-{i}.txt')
+    assert (time.perf_counter() - start) / 2000 < 100e-6
+
+
+def test_batch_authorization():
+    rbac = RBACSystem()
+    for user_id, role in (('guest1', 'guest'), ('user1', 'user'), ('admin1', 'admin')):
+        rbac.add_user(user_id, role)
+    listing = ['public.txt', 'user1_private.txt', 'admin1_private.txt', 'admin_logs.txt', 'other.txt']
+
+    print("Batch results match per-call checks")
+    for user_id in ('guest1', 'user1', 'admin1', 'nobody'):
+        for action in ('read', 'write'):
+            expected = [rbac.can_access_file(user_id, path, action) for path in listing]
+            assert rbac.access_mask(user_id, listing, action) == expected
+            assert list(rbac.filter_accessible(user_id, listing, action)) == [
+                path for path, ok in zip(listing, expected) if ok
+            ]
+
+    print("filter_accessible streams lazily")
+    generated = (f'file_{i}.txt' if i % 2 else 'public.txt' for i in range(100000))
+    accessible = rbac.filter_accessible('guest1', generated)
+    assert next(accessible) == 'public.txt'
+
+    permissions = ['read_public', 'manage_users', 'no_such_permission']
+    assert rbac.check_many(['guest1', 'admin1', 'nobody'], permissions) == [
+        [True, False, False],
+        [True, True, False],
+        [False, False, False],
+    ]
+
+
+def test_hot_reload():
+    with tempfile.TemporaryDirectory() as tmp:
+        policy_file = os.path.join(tmp, 'policy.json')
+
+        def write_policy(roles):
+            with open(policy_file + '.tmp', 'w') as f:
+                json.dump(roles, f)
+            os.replace(policy_file + '.tmp', policy_file)
+
+        write_policy({'reader': ['read'], 'writer': {'permissions': ['write'], 'inherits': ['reader']}})
+        rbac = RBACSystem(policy_file)
+        rbac.add_user('alice', 'reader')
+        assert rbac.policy_version == 1
+        assert not rbac.check_permission('alice', 'write')
+
+        print("reload() publishes a new versioned snapshot")
+        write_policy({'reader': ['read', 'write'], 'writer': ['write']})
+        assert rbac.reload()
+        assert rbac.policy_version == 2
+        assert rbac.check_permission('alice', 'write')
+
+        print("An invalid policy file keeps the current snapshot")
+        with open(policy_file, 'w') as f:
+            f.write('{"reader": ')
+        assert not rbac.reload()
+        assert rbac.last_reload_error
+        assert rbac.policy_version == 2 and rbac.check_permission('alice', 'write')
+
+        print("Malformed policies are rejected, the watcher survives them")
+        for bad_policy in ({'reader': {'permissions': 5}},
+                           {'roles': {'reader': ['read']}, 'resources': [{'actions': {}}]}):
+            write_policy(bad_policy)
+            assert not rbac.reload()
+            assert rbac.last_reload_error and rbac.policy_version == 2
+        rbac.start_watching(interval=0.01)
+        time.sleep(0.05)
+        write_policy({'reader': ['read', 'write', 'delete'], 'writer': ['write']})
+        deadline = time.monotonic() + 5
+        while not rbac.check_permission('alice', 'delete') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        rbac.stop_watching()
+        assert rbac.check_permission('alice', 'delete')
+
+        print("The watcher reloads while readers keep checking")
+        errors = []
+        stop = threading.Event()
+
+        def reader():
+            while not stop.is_set():
+                try:
+                    decision = rbac.explain_access('alice', 'public.txt', 'read')
+                    assert decision['policy_version'] >= 3
+                    rbac.check_permission('alice', 'read')
+                except Exception as e:
+                    errors.append(e)
+
+        readers = [threading.Thread(target=reader) for _ in range(2)]
+        for thread in readers:
+            thread.start()
+        rbac.start_watching(interval=0.01)
+        write_policy({'reader': ['read'], 'writer': ['write']})
+        deadline = time.monotonic() + 5
+        while rbac.check_permission('alice', 'write') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        rbac.stop_watching()
+        stop.set()
+        for thread in readers:
+            thread.join()
+        assert not errors
+        assert not rbac.check_permission('alice', 'write')
+        assert rbac.policy_version >= 4
+
+
+def test_metrics():
+    rbac = RBACSystem()
+    rbac.add_user('user1', 'user')
+    rbac.add_user('admin1', 'admin')
+
+    print("Metrics are off by default")
+    assert rbac.metrics is None
+    assert 'check_permission' not in vars(rbac)
+
+    metrics = rbac.enable_metrics(sample_every=1)
+    assert rbac.check_permission('user1', 'read_own')
+    assert not rbac.check_permission('user1', 'manage_users')
+    assert rbac.check_permission('admin1', 'manage_users')
+    assert rbac.can_access_file('user1', 'user1_private.txt')
+    assert not rbac.can_access_file('user1', 'admin1_private.txt')
+    assert not rbac.can_access_file('user1', 'admin_logs.txt')
+    assert not rbac.can_access_file('nobody', 'public.txt')
+    assert not rbac.can_access_file('user1', 'unknown.txt')
+
+    print("Counters, deny reasons and latency samples are recorded")
+    snapshot = metrics.snapshot()
+    assert snapshot['permissions']['manage_users'] == {'allowed': 1, 'denied': 1}
+    assert snapshot['permissions']['read_own'] == {'allowed': 1, 'denied': 0}
+    assert snapshot['file_decisions'] == {
+        'allow': 1, 'not_owner': 1, 'missing_permission': 1, 'unknown_user': 1, 'unknown_resource': 1,
+    }
+    assert snapshot['latency']['check_permission']['samples'] == 3
+    assert sum(snapshot['latency']['can_access_file']['buckets_ns'].values()) == 5
+
+    text = metrics.prometheus_text()
+    assert 'rbac_permission_checks_total{permission="manage_users",result="deny"} 1' in text
+    assert 'rbac_file_decisions_total{outcome="not_owner"} 1' in text
+    assert 'rbac_decision_latency_seconds_count{operation="can_access_file"} 5' in text
+
+    print("Disabling restores the untraced methods")
+    assert rbac.disable_metrics() is metrics
+    assert 'check_permission' not in vars(rbac)
+    rbac.check_permission('user1', 'read_own')
+    assert metrics.permission_counts['read_own'] == [1, 0]
+
+
+def test_user_table():
+    rbac = RBACSystem()
+    count = rbac.add_users((f'user{i}', 'admin' if i % 10 == 0 else 'user') for i in range(2500))
+    assert count == 2500 and len(rbac.users) == 2500
+    assert rbac.users['user10'] == 'admin' and rbac.users.get('nobody') is None
+    assert rbac.check_permission('user10', 'manage_users')
+    assert not rbac.check_permission('user11', 'manage_users')
+
+    print("Bulk add validates every role first")
+    try:
+        rbac.add_users([('new1', 'user'), ('new2', 'superuser')])
+        assert False, "unknown role accepted"
+    except ValueError:
+        pass
+    assert 'new1' not in rbac.users
+
+    print("Roles are interned to one string per role")
+    role_objects = {id(role) for _, role in rbac.iter_users()}
+    assert len(role_objects) == 2
+
+    print("Cursor pages cover every user exactly once")
+    del rbac.users['user5']
+    seen = []
+    cursor = 0
+    while cursor is not None:
+        items, cursor = rbac.list_users_page(cursor, limit=1000)
+        assert len(items) <= 1000
+        seen.extend(user_id for user_id, _ in items)
+    assert seen == [f'user{i}' for i in range(2500) if i != 5]
+
+    admins, cursor = rbac.list_users_page(limit=100, role='admin')
+    assert len(admins) == 100 and all(role == 'admin' for _, role in admins)
+    rest, cursor = rbac.list_users_page(cursor, limit=1000, role='admin')
+    assert len(rest) == 150 and cursor is None
+    assert list(rbac.iter_users(role='guest')) == []
+    assert rbac.list_users().splitlines()[0] == 'user0: admin'
+
+    print("Removal is O(1); re-adding a removed user moves it to the end")
+    table = UserTable()
+    table.add_many((f'u{i}', f'role{i}') for i in range(300))
+    del table['u1']
+    assert 'u1' not in table and len(table) == 299
+    table['u1'] = 'role7'
+    table['u2'] = 'role8'
+    assert len(table) == 300 and list(table)[-1] == 'u1'
+    assert table['u1'] == 'role7' and table['u2'] == 'role8' and table['u299'] == 'role299'
+
+    print("Memory stays within an order-list slot of a plain dict")
+    user_ids = [f'user{i}' for i in range(100000)]
+    roles = ['guest', 'user', 'editor', 'admin']
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        plain = {user_id: roles[i % 4] for i, user_id in enumerate(user_ids)}
+        plain_bytes = tracemalloc.get_traced_memory()[0] - start
+        del plain
+        start = tracemalloc.get_traced_memory()[0]
+        table = UserTable()
+        table.add_many((user_id, roles[i % 4]) for i, user_id in enumerate(user_ids))
+        table_bytes = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    assert table_bytes <= plain_bytes + 10 * len(user_ids), (table_bytes, plain_bytes)
+
+
 if __name__ == "__main__":
     test_rbac()
+    test_compiled_permission_index()
+    test_role_inheritance()
+    test_resource_rules()
+    test_batch_authorization()
+    test_hot_reload()
+    test_metrics()
+    test_user_table()